@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures how the redis operations per second of threads sharing a
+single backend scale with the number of threads.
+
+    python benchmarks/backend_contention.py --threads 1 2 4 8 16 32
+
+Every thread pushes and pops items through the same JSONRedisBackend.
+``--locked`` runs the operations one at a time in the lock of the
+backend, like before, for comparison. Requires a redis server
+reachable through ``LINEUP_REDIS_URI``.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+from threading import Thread
+
+from lineup import JSONRedisBackend
+
+
+def run(backend, threads, operations):
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+    key = 'benchmark-contention'
+    backend.redis.delete(key)
+
+    def work():
+        for n in xrange(operations // 2):
+            backend.rpush(key, payload)
+            backend.lpop(key)
+
+    workers = [Thread(target=work) for n in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    return threads * operations / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--operations', type=int, default=10000,
+                        help='per thread')
+    parser.add_argument('--locked', action='store_true')
+    args = parser.parse_args()
+
+    backend = JSONRedisBackend()
+    backend.thread_safe = not args.locked
+
+    baseline = None
+    for threads in args.threads:
+        rate = run(backend, threads, args.operations)
+        baseline = baseline or rate
+        print("{0:>3} thread(s) {1:>10.0f} ops/sec {2:>6.2f}x".format(
+            threads, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Compares items/sec of Queue.put/get against Queue.put_many/get_many.
+
+    python benchmarks/bulk_queue.py --items 100000 --batch 500
+
+Requires a redis server reachable through ``LINEUP_REDIS_URI``.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+
+from lineup import Queue, JSONRedisBackend
+
+
+def timed(label, items, func):
+    started = time.time()
+    func()
+    elapsed = time.time() - started
+    print("{0:<24} {1:>10.0f} items/sec".format(label, items / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    queue = Queue('benchmark-bulk', backend_class=JSONRedisBackend)
+    queue.backend.redis.delete(queue.name)
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+    batches = xrange(0, args.items, args.batch)
+
+    def put_one_by_one():
+        for n in xrange(args.items):
+            queue.put(payload)
+
+    def get_one_by_one():
+        for n in xrange(args.items):
+            queue.get()
+
+    def put_in_batches():
+        for n in batches:
+            queue.put_many([payload] * args.batch)
+
+    def get_in_batches():
+        for n in batches:
+            queue.get_many(args.batch)
+
+    timed('put', args.items, put_one_by_one)
+    timed('get', args.items, get_one_by_one)
+    timed('put_many({0})'.format(args.batch), args.items, put_in_batches)
+    timed('get_many({0})'.format(args.batch), args.items, get_in_batches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures the compression ratio and the time to compress and
+decompress a downloaded HTML page, for every compressor and level.
+
+    python benchmarks/compression.py --url http://example.com/
+
+Without ``--url`` a generated page of ``--size`` bytes is used. The
+lzma compressor is only measured when lzma is installed. Doesn't need
+a redis server.
+"""
+from __future__ import unicode_literals
+import json
+import time
+import random
+import urllib2
+import argparse
+
+from lineup.backends.compression import Compression
+
+WORDS = ('lineup', 'queue', 'step', 'pipeline', 'redis', 'worker',
+         'download', 'parse', 'item', 'backend')
+
+
+def make_page(size):
+    paragraphs = []
+    while sum(map(len, paragraphs)) < size:
+        words = ' '.join(random.choice(WORDS) for n in range(40))
+        paragraphs.append('<p class="text">{0}</p>\n'.format(words))
+
+    return '<html><body>\n{0}</body></html>'.format(''.join(paragraphs))
+
+
+def measure(compression, product, rounds):
+    started = time.time()
+    for n in xrange(rounds):
+        compressed = compression.compress(product)
+    compressing = (time.time() - started) / rounds
+
+    started = time.time()
+    for n in xrange(rounds):
+        compression.decompress(compressed)
+    decompressing = (time.time() - started) / rounds
+
+    return compressing, decompressing, len(compressed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url')
+    parser.add_argument('--size', type=int, default=100 * 1024)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--compressors', nargs='+',
+                        default=['zlib', 'bz2', 'lzma'])
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9])
+    args = parser.parse_args()
+
+    page = args.url and urllib2.urlopen(args.url).read().decode(
+        'utf-8', 'replace') or make_page(args.size)
+    product = json.dumps({'url': args.url, 'content': page})
+
+    print("{0} bytes uncompressed".format(len(product)))
+    print("{0:<6} {1:>5} {2:>10} {3:>8} {4:>14} {5:>15}".format(
+        'codec', 'level', 'bytes', 'ratio', 'compress (ms)',
+        'decompress (ms)'))
+
+    for name in args.compressors:
+        for level in args.levels:
+            try:
+                compression = Compression(name, level, threshold=0)
+            except RuntimeError:
+                continue
+
+            compressing, decompressing, size = measure(
+                compression, product, args.rounds)
+            print("{0:<6} {1:>5} {2:>10} {3:>8.2f} {4:>14.2f} {5:>15.2f}"
+                  .format(name, level, size, float(len(product)) / size,
+                          compressing * 1e3, decompressing * 1e3))
+
+
+if __name__ == '__main__':
+    main()
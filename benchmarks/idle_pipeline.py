@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures what an idle pipeline costs: process CPU time and redis
+commands per second while 10 steps wait on empty queues.
+
+    python benchmarks/idle_pipeline.py
+    python benchmarks/idle_pipeline.py --busy-spin   # the old lpop loop
+
+Requires a redis server reachable through ``LINEUP_REDIS_URI``.
+"""
+from __future__ import unicode_literals
+import time
+import resource
+import argparse
+
+from lineup import Step, Pipeline, Queue, JSONRedisBackend
+
+
+class Forward(Step):
+    def before_consume(self):
+        pass
+
+    def after_consume(self, instructions):
+        pass
+
+    def consume(self, instructions):
+        self.produce(instructions)
+
+
+class IdlePipeline(Pipeline):
+    name = 'benchmark-idle'
+    steps = [Forward] * 10
+
+
+def busy_spin_get(queue, wait=False, timeout=None):
+    done = queue.backend.lpop(queue.name)
+    while wait and done is None:
+        done = queue.backend.lpop(queue.name)
+
+    return done
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def commands_processed(backend):
+    return backend.redis.info('stats')['total_commands_processed']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--busy-spin', action='store_true',
+                        help='poll with lpop like lineup <= 0.1.8 did')
+    args = parser.parse_args()
+
+    if args.busy_spin:
+        Queue.get = busy_spin_get
+
+    backend = JSONRedisBackend()
+    pipeline = IdlePipeline(JSONRedisBackend)
+    pipeline.run_daemon()
+    time.sleep(0.5)
+
+    commands_before = commands_processed(backend)
+    cpu_before = cpu_time()
+    time.sleep(args.seconds)
+    cpu_spent = cpu_time() - cpu_before
+    commands = commands_processed(backend) - commands_before
+
+    # the feed below goes through all 10 steps and wakes them up
+    started = time.time()
+    pipeline.feed({'ping': 'pong'})
+    pipeline.get_result()
+    latency = time.time() - started
+
+    print("mode:             {0}".format(
+        args.busy_spin and 'busy-spin (lpop)' or 'blocking (blpop)'))
+    print("idle cpu:         {0:.1f}% of a core".format(
+        100 * cpu_spent / args.seconds))
+    print("redis ops/sec:    {0:.0f}".format(commands / args.seconds))
+    print("10-hop latency:   {0:.2f}ms".format(latency * 1000))
+
+
+if __name__ == '__main__':
+    main()
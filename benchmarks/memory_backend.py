@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Compares the items/sec of the same pipeline running on top of the
+MemoryBackend and of the JSONRedisBackend.
+
+    python benchmarks/memory_backend.py --items 100000 --steps 3
+
+The redis run requires a redis server reachable through
+``LINEUP_REDIS_URI``, skip it with ``--memory-only``.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+
+from lineup import Step, Pipeline, JSONRedisBackend, MemoryBackend
+
+
+class Forward(Step):
+    def before_consume(self):
+        pass
+
+    def after_consume(self, instructions):
+        pass
+
+    def consume(self, instructions):
+        self.produce(instructions)
+
+
+def make_pipeline(steps):
+    class Forwarder(Pipeline):
+        name = 'benchmark-memory'
+        # so that the steps notice stop
+        timeout = 1
+
+    Forwarder.steps = [Forward] * steps
+    return Forwarder
+
+
+def run(Forwarder, backend_class, items, batch):
+    manager = Forwarder(backend_class)
+    for queue in manager.queues:
+        while queue.get_many(10000):
+            pass
+
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+
+    started = time.time()
+    manager.run_daemon()
+    for n in xrange(0, items, batch):
+        manager.feed_many([payload] * batch)
+
+    received = 0
+    while received < items:
+        received += len(manager.output.get_many(batch, wait=True))
+
+    elapsed = time.time() - started
+    manager.stop()
+    for worker in manager.workers:
+        worker.join()
+
+    return items / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--steps', type=int, default=3)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--memory-only', action='store_true')
+    args = parser.parse_args()
+
+    Forwarder = make_pipeline(args.steps)
+    backends = [MemoryBackend]
+    if not args.memory_only:
+        backends.append(JSONRedisBackend)
+
+    for backend_class in backends:
+        rate = run(Forwarder, backend_class, args.items, args.batch)
+        print("{0:<20} {1:>10.0f} items/sec through {2} steps".format(
+            backend_class.__name__, rate, args.steps))
+
+
+if __name__ == '__main__':
+    main()
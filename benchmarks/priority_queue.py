@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Compares the cost of put/get on a PriorityQueue against a Queue
+that already holds a large backlog.
+
+    python benchmarks/priority_queue.py --backlog 1000000 --items 10000
+
+Requires a redis server >= 5.0 reachable through ``LINEUP_REDIS_URI``.
+"""
+from __future__ import unicode_literals
+import time
+import random
+import argparse
+
+from lineup import Queue, PriorityQueue, JSONRedisBackend
+
+
+def fill(queue, backlog, payload, priority=False):
+    batch = 10000
+    for n in xrange(0, backlog, batch):
+        if priority:
+            queue.put_many([payload] * batch, priority=random.randint(0, 9))
+        else:
+            queue.put_many([payload] * batch)
+
+
+def timed(label, items, func):
+    started = time.time()
+    for n in xrange(items):
+        func()
+
+    elapsed = time.time() - started
+    print("{0:<20} {1:>10.1f}us/op {2:>10.0f} ops/sec".format(
+        label, 1000000 * elapsed / items, items / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backlog', type=int, default=1000000)
+    parser.add_argument('--items', type=int, default=10000)
+    args = parser.parse_args()
+
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+    queues = [
+        ('Queue', Queue('benchmark-list', JSONRedisBackend), False),
+        ('PriorityQueue', PriorityQueue('benchmark-zset', JSONRedisBackend),
+         True),
+    ]
+
+    for label, queue, priority in queues:
+        redis = queue.backend.redis
+        redis.delete(queue.name, ':'.join([queue.name, 'sequence']))
+        fill(queue, args.backlog, payload, priority)
+        memory = redis.execute_command('MEMORY', 'USAGE', queue.name)
+
+        print("{0} with {1} queued items, {2:.1f}MB in redis".format(
+            label, queue.get_size(), memory / 1024.0 / 1024))
+
+        def put():
+            if priority:
+                queue.put(payload, priority=random.randint(0, 9))
+            else:
+                queue.put(payload)
+
+        timed('  put', args.items, put)
+        timed('  get', args.items, queue.get)
+        redis.delete(queue.name)
+
+
+if __name__ == '__main__':
+    main()
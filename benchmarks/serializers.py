@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures the encode and decode time and the size of the items of
+every serializer for a few representative payloads.
+
+    python benchmarks/serializers.py --rounds 10000
+
+The msgpack serializer is only measured when msgpack is installed.
+JSON can't hold binary content, so it is reported as failing for that
+payload. Doesn't need a redis server.
+"""
+from __future__ import unicode_literals
+import os
+import time
+import argparse
+
+from lineup.backends.serializers import (
+    get_serializer, is_framed, decode,
+)
+
+
+PAYLOADS = {
+    'small dict': {'url': 'http://example.com/', 'attempt': 1},
+    'large dict': {
+        'links': ['http://example.com/{0}'.format(n) for n in range(1000)],
+        'headers': dict(('X-{0}'.format(n), 'value') for n in range(50)),
+    },
+    'binary content': {
+        'url': 'http://example.com/image.png',
+        'content': os.urandom(256 * 1024),
+    },
+}
+
+
+def measure(serializer, payload, rounds):
+    started = time.time()
+    for n in xrange(rounds):
+        product = serializer.encode(payload)
+    encoding = (time.time() - started) / rounds
+
+    started = time.time()
+    for n in xrange(rounds):
+        if is_framed(product):
+            decode(product, serializer)
+        else:
+            serializer.loads(product)
+    decoding = (time.time() - started) / rounds
+
+    return encoding, decoding, len(product)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=1000)
+    parser.add_argument('--serializers', nargs='+',
+                        default=['json', 'msgpack', 'pickle'])
+    args = parser.parse_args()
+
+    print("{0:<16} {1:<8} {2:>12} {3:>12} {4:>10}".format(
+        'payload', 'codec', 'encode (us)', 'decode (us)', 'bytes'))
+
+    for label, payload in sorted(PAYLOADS.items()):
+        for name in args.serializers:
+            try:
+                serializer = get_serializer(name)
+                encoding, decoding, size = measure(
+                    serializer, payload, args.rounds)
+            except RuntimeError:
+                continue
+            except (TypeError, ValueError, UnicodeDecodeError) as e:
+                print("{0:<16} {1:<8} fails: {2}".format(label, name, e))
+                continue
+
+            print("{0:<16} {1:<8} {2:>12.1f} {3:>12.1f} {4:>10}".format(
+                label, name, encoding * 1e6, decoding * 1e6, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures how the throughput of a ShardedQueue grows with the number
+of redis servers it is spread over.
+
+    python benchmarks/sharded_queue.py --servers 4 --items 200000
+
+Starts its own ``redis-server`` processes on ports 6400 and up, so
+``redis-server`` must be in the PATH.
+"""
+from __future__ import unicode_literals
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+from threading import Thread
+
+import redis
+
+from lineup import ShardedQueue, JSONRedisBackend
+
+
+def start_servers(count, port):
+    directory = tempfile.mkdtemp()
+    processes = []
+    for n in range(count):
+        processes.append(subprocess.Popen([
+            'redis-server', '--port', str(port + n), '--save', '',
+            '--appendonly', 'no', '--dir', directory,
+        ], stdout=subprocess.PIPE))
+
+    for n in range(count):
+        client = redis.StrictRedis(port=port + n)
+        while True:
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+
+    return directory, processes
+
+
+def run(queue, items, batch, producers, consumers):
+    per_producer = items // producers
+    per_consumer = items // consumers
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+
+    def produce():
+        for n in xrange(0, per_producer, batch):
+            queue.put_many([payload] * batch)
+
+    def consume():
+        received = 0
+        while received < per_consumer:
+            received += len(queue.get_many(batch, wait=True, timeout=5))
+
+    threads = [Thread(target=produce) for n in range(producers)]
+    threads += [Thread(target=consume) for n in range(consumers)]
+
+    started = time.time()
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=6400)
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--consumers', type=int, default=4)
+    args = parser.parse_args()
+
+    directory, processes = start_servers(args.servers, args.port)
+    try:
+        baseline = None
+        for count in range(1, args.servers + 1):
+            uris = ['redis://0@localhost:{0}'.format(args.port + n)
+                    for n in range(count)]
+            queue = ShardedQueue('benchmark-sharded', JSONRedisBackend,
+                                 uris=uris)
+            elapsed = run(queue, args.items, args.batch,
+                          args.producers, args.consumers)
+            rate = args.items / elapsed
+            baseline = baseline or rate
+            print("{0} server(s) {1:>10.0f} items/sec {2:>6.2f}x".format(
+                count, rate, rate / baseline))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Compares the items/sec that producer processes hand over to consumer
+processes through the SharedMemoryBackend and the JSONRedisBackend.
+
+    python benchmarks/shared_memory.py --items 200000 --producers 2
+
+The redis run requires a redis server reachable through
+``LINEUP_REDIS_URI``, skip it with ``--shm-only``.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+from multiprocessing import Process
+
+from lineup import Queue, JSONRedisBackend, SharedMemoryBackend
+
+
+def produce(backend_class, items, batch):
+    queue = Queue('benchmark-shm', backend_class)
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+    for n in xrange(0, items, batch):
+        queue.put_many([payload] * batch)
+
+
+def consume(backend_class, items, batch):
+    queue = Queue('benchmark-shm', backend_class)
+    received = 0
+    while received < items:
+        received += len(queue.get_many(batch, wait=True, timeout=5))
+
+
+def run(backend_class, items, batch, producers, consumers):
+    queue = Queue('benchmark-shm', backend_class)
+    while queue.get_many(10000):
+        pass
+
+    processes = [
+        Process(target=produce,
+                args=(backend_class, items // producers, batch))
+        for n in range(producers)
+    ]
+    processes += [
+        Process(target=consume,
+                args=(backend_class, items // consumers, batch))
+        for n in range(consumers)
+    ]
+
+    started = time.time()
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    return items / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--producers', type=int, default=2)
+    parser.add_argument('--consumers', type=int, default=2)
+    parser.add_argument('--shm-only', action='store_true')
+    args = parser.parse_args()
+
+    backends = [SharedMemoryBackend]
+    if not args.shm_only:
+        backends.append(JSONRedisBackend)
+
+    for backend_class in backends:
+        rate = run(backend_class, args.items, args.batch,
+                   args.producers, args.consumers)
+        print("{0:<20} {1:>10.0f} items/sec".format(
+            backend_class.__name__, rate))
+
+
+if __name__ == '__main__':
+    main()
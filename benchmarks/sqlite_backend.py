@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures the sustained items/sec of the SQLiteBackend while a queue
+grows to millions of rows and is drained again.
+
+    python benchmarks/sqlite_backend.py --rows 10000000 --synchronous FULL
+
+Prints the rate of every ``--every`` rows, so that a slowdown as the
+table grows shows up. Writes the database to a temporary directory
+unless ``--path`` is given.
+"""
+from __future__ import unicode_literals
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from lineup import SQLiteBackend
+
+
+def measure(label, rows, batch, every, operation):
+    started = last = time.time()
+    for done in xrange(batch, rows + 1, batch):
+        operation(batch)
+        if done % every == 0:
+            now = time.time()
+            print("{0:<6} {1:>10} rows {2:>10.0f} items/sec".format(
+                label, done, every / (now - last)))
+            last = now
+
+    return rows / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--every', type=int, default=1000000)
+    parser.add_argument('--synchronous', default='NORMAL')
+    parser.add_argument('--path')
+    args = parser.parse_args()
+
+    directory = None
+    if not args.path:
+        directory = tempfile.mkdtemp()
+        args.path = os.path.join(directory, 'benchmark.db')
+
+    backend = SQLiteBackend(args.path, synchronous=args.synchronous)
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+    items = [payload] * args.batch
+    try:
+        pushed = measure('push', args.rows, args.batch, args.every,
+                         lambda count: backend.rpush_many('benchmark', items))
+        popped = measure('pop', args.rows, args.batch, args.every,
+                         lambda count: backend.lpop_many('benchmark', count))
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+    print("synchronous={0}: {1:.0f} pushes/sec {2:.0f} pops/sec".format(
+        backend.synchronous, pushed, popped))
+
+
+if __name__ == '__main__':
+    main()
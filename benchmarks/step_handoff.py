@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures the round trips to redis per item and the items per second
+of a pipeline of reliable queues, handing the items off atomically or
+one command at a time.
+
+    python benchmarks/step_handoff.py --items 10000
+    python benchmarks/step_handoff.py --items 10000 --separate
+
+Every step logs before and after consuming, like the default steps.
+Requires a redis server reachable through ``LINEUP_REDIS_URI``.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+from threading import Lock, current_thread
+
+from redis.connection import Connection
+
+from lineup import Step, Pipeline, JSONRedisBackend
+
+
+class Forward(Step):
+    def consume(self, instructions):
+        self.produce(instructions)
+
+
+class HandoffPipeline(Pipeline):
+    name = 'benchmark-handoff'
+    reliable = True
+    steps = [Forward] * 3
+
+
+class RoundTrips(object):
+    """counts the requests the steps send to redis, a redis pipeline
+    counts once"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = Lock()
+        self.send = Connection.send_packed_command
+
+    def install(self):
+        counter = self
+
+        def send_packed_command(connection, *args, **kw):
+            if isinstance(current_thread(), Step):
+                with counter.lock:
+                    counter.count += 1
+
+            return counter.send(connection, *args, **kw)
+
+        Connection.send_packed_command = send_packed_command
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--separate', action='store_true',
+                        help='turn the atomic handoff off')
+    args = parser.parse_args()
+
+    Forward.atomic_handoff = not args.separate
+    backend = JSONRedisBackend()
+    backend.redis.flushdb()
+
+    pipeline = HandoffPipeline(JSONRedisBackend)
+    pipeline.input.put_many([{'n': n} for n in xrange(args.items)])
+
+    round_trips = RoundTrips()
+    round_trips.install()
+
+    started = time.time()
+    pipeline.run_daemon()
+    while pipeline.output.get_size() < args.items:
+        time.sleep(0.01)
+
+    elapsed = time.time() - started
+    pipeline.stop()
+
+    hops = args.items * len(HandoffPipeline.steps)
+    print("mode:                {0}".format(
+        args.separate and 'separate commands' or 'atomic handoff'))
+    print("round trips per hop: {0:.2f}".format(
+        float(round_trips.count) / hops))
+    print("items/sec:           {0:.0f}".format(args.items / elapsed))
+
+
+if __name__ == '__main__':
+    main()
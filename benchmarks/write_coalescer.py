@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Measures the pushes per second of many threads sharing the redis
+backends of a process, with the write-behind off and at different
+linger times.
+
+    python benchmarks/write_coalescer.py --lingers 0 0.001 0.005 0.02
+
+A linger of 0 pushes right away, like the default. The pushes are
+flushed before the clock stops, so every rate counts writes that
+reached redis. Requires a redis server reachable through
+``LINEUP_REDIS_URI``.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+from threading import Thread
+
+from lineup import JSONRedisBackend
+from lineup.backends.coalescer import coalescers
+
+
+def run(linger, batch_size, threads, pushes):
+    Backend = type(str('LingeringBackend'), (JSONRedisBackend,), {
+        'linger': linger,
+        'batch_size': batch_size,
+    })
+    backend = Backend()
+
+    key = 'benchmark-coalescer'
+    backend.redis.delete(key)
+    payload = {'message': 'Download is done', 'when': time.time()}
+
+    def work():
+        for n in xrange(pushes):
+            backend.rpush(key, payload)
+
+    workers = [Thread(target=work) for n in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    backend.flush()
+    elapsed = time.time() - started
+
+    assert backend.redis.llen(key) == threads * pushes
+    backend.redis.delete(key)
+    return threads * pushes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lingers', type=float, nargs='+',
+                        default=[0, 0.001, 0.005, 0.02])
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--pushes', type=int, default=10000,
+                        help='per thread')
+    args = parser.parse_args()
+
+    baseline = None
+    for linger in args.lingers:
+        rate = run(linger, args.batch_size, args.threads, args.pushes)
+        baseline = baseline or rate
+        print("linger {0:>6.1f}ms {1:>10.0f} pushes/sec {2:>6.2f}x".format(
+            linger * 1000, rate, rate / baseline))
+
+    coalescers.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+"""Compares the latency of one hop between two step processes through
+redis and through ZeroMQ channels over ipc:// and tcp://127.0.0.1.
+
+    python benchmarks/zmq_backend.py --round-trips 10000
+
+One process pushes an item and waits for it to come back from the
+other one, a hop is half of that round trip. Requires pyzmq and a
+redis server reachable through ``LINEUP_REDIS_URI``, which the
+ZMQBackend uses to find the consumers.
+"""
+from __future__ import unicode_literals
+import time
+import argparse
+from multiprocessing import Process
+
+from lineup import JSONRedisBackend, ZMQBackend
+
+BACKENDS = {
+    'redis': lambda: JSONRedisBackend(),
+    'zmq-ipc': lambda: ZMQBackend(transport='ipc'),
+    'zmq-tcp': lambda: ZMQBackend(transport='tcp'),
+}
+
+
+def echo(name, round_trips):
+    backend = BACKENDS[name]()
+    for n in xrange(round_trips + 1):
+        backend.rpush('benchmark-pong', backend.blpop('benchmark-ping'))
+
+
+def run(name, round_trips):
+    backend = BACKENDS[name]()
+    backend.redis.delete('benchmark-ping', 'benchmark-pong',
+                         'lineup:zmq:benchmark-ping',
+                         'lineup:zmq:benchmark-pong')
+    process = Process(target=echo, args=(name, round_trips))
+    process.start()
+
+    payload = {'url': 'http://example.com/', 'attempt': 1}
+
+    # the first round trip connects the sockets
+    backend.rpush('benchmark-ping', payload)
+    backend.blpop('benchmark-pong')
+
+    latencies = []
+    for n in xrange(round_trips):
+        started = time.time()
+        backend.rpush('benchmark-ping', payload)
+        backend.blpop('benchmark-pong')
+        latencies.append((time.time() - started) / 2)
+
+    process.join()
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--round-trips', type=int, default=10000)
+    parser.add_argument('--backends', nargs='+', default=sorted(BACKENDS),
+                        choices=sorted(BACKENDS))
+    args = parser.parse_args()
+
+    for name in args.backends:
+        latencies = run(name, args.round_trips)
+        median = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print("{0:<10} {1:>8.1f}us per hop (median) {2:>8.1f}us (p99)".format(
+            name, median * 1e6, p99 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
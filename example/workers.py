@@ -6,10 +6,16 @@ import codecs
 import re
 import requests
 
-from lineup import Step
+from lineup import Step, ConcurrentStep
 
 
-class Download(Step):
+class Download(ConcurrentStep):
+    # the same url is only downloaded once an hour
+    dedup = 'url'
+
+    # how many downloads are in flight at once
+    concurrency = 50
+
     def after_consume(self, instructions):
         self.log(
             "Done downloading %s",
@@ -26,11 +26,31 @@
 
 from __future__ import unicode_literals, absolute_import
 
-from .steps import Step
-from .datastructures import Queue
+from .steps import Step, ConcurrentStep
+from .datastructures import Queue, PriorityQueue, ShardedQueue, StreamQueue
 from .framework import Pipeline
-from .backends.redis import JSONRedisBackend
+from .backends.redis import JSONRedisBackend, StreamsRedisBackend
+from .backends.memory import MemoryBackend
+from .backends.shm import SharedMemoryBackend
+from .backends.sqlite import SQLiteBackend
+from .backends.log import LogBackend
+from .backends.zmq import ZMQBackend
 
 
-__all__ = ['Step', 'Pipeline', 'JSONRedisBackend', 'Queue']
+__all__ = [
+    'Step',
+    'ConcurrentStep',
+    'Pipeline',
+    'JSONRedisBackend',
+    'StreamsRedisBackend',
+    'MemoryBackend',
+    'SharedMemoryBackend',
+    'SQLiteBackend',
+    'LogBackend',
+    'ZMQBackend',
+    'Queue',
+    'PriorityQueue',
+    'ShardedQueue',
+    'StreamQueue',
+]
 __version__ = '0.1.8'
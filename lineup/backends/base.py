@@ -26,12 +26,19 @@
 
 from __future__ import unicode_literals
 
-import time
 from functools import wraps
 from threading import RLock
 
 
 class BaseBackend(object):
+    # whether the operations of a single backend may run from many
+    # threads at once, see io_operation
+    thread_safe = False
+
+    # whether a step can ack its item, push its outputs and append its
+    # logs in a single round trip, see lineup.steps.Step.hand_off
+    atomic_handoff = False
+
     def __init__(self, *args, **kwargs):
         self.lock = RLock()
         self.initialize(*args, **kwargs)
@@ -45,17 +52,23 @@ class BaseBackend(object):
     def initialize(self, *args, **kwargs):
         """to be overwriten by subclasses"""
 
+    def flush(self):
+        """sends the writes that the backend holds back, if any"""
+
 
 def io_operation(method):
-    """decorator for methods of a backend, allowing the redis
-    operations to run in a lock per thread.
+    """decorator for methods of a backend that talk to its store.
+
+    The operations of a backend that isn't ``thread_safe`` run one at
+    a time, in the lock of the backend. The others run right away, so
+    that the threads sharing a backend do their I/O concurrently.
     """
     @wraps(method)
     def decorator(backend, *args, **kwargs):
-        backend.lock.acquire()
-        result = method(backend, *args, **kwargs)
-        time.sleep(0)
-        backend.lock.release()
-        return result
+        if getattr(backend, 'thread_safe', False):
+            return method(backend, *args, **kwargs)
+
+        with backend.lock:
+            return method(backend, *args, **kwargs)
 
     return decorator
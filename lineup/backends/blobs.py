@@ -0,0 +1,120 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals, absolute_import
+import os
+import errno
+import uuid
+import tempfile
+from urlparse import urlparse
+
+from redis import StrictRedis
+
+from lineup.backends.pools import pools
+
+# Blob stores keep the large payload fields that the backends take out
+# of the payloads (the claim-check pattern), see
+# JSONRedisBackend.check_in. Every store takes the serialized field and
+# gives back an id, then gives the serialized field back by that id.
+
+
+class RedisBlobStore(object):
+    """keeps each blob in a redis key that expires after ``ttl``
+    seconds, so blobs of items that are never consumed don't pile up.
+    The ttl must outlive the items that refer to the blob."""
+    prefix = 'lineup:blob'
+
+    def __init__(self, redis, ttl=86400):
+        self.redis = redis
+        self.ttl = ttl
+
+    def __repr__(self):
+        return '<RedisBlobStore(ttl={0})>'.format(self.ttl)
+
+    def get_key(self, id):
+        return ':'.join([self.prefix, id])
+
+    def put(self, value):
+        id = uuid.uuid4().hex
+        self.redis.set(self.get_key(id), value, ex=self.ttl)
+        return id
+
+    def get(self, id):
+        return self.redis.get(self.get_key(id))
+
+
+class FileBlobStore(object):
+    """keeps each blob in a file of ``directory``, which may be shared
+    between hosts. Nothing is ever removed, that is left to whatever
+    cleans up the directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        return '<FileBlobStore({0})>'.format(self.directory)
+
+    def get_path(self, id):
+        return os.path.join(self.directory, id)
+
+    def put(self, value):
+        id = uuid.uuid4().hex
+        # written aside and renamed, so that readers never see a
+        # partial blob
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(value)
+
+        os.rename(path, self.get_path(id))
+        return id
+
+    def get(self, id):
+        with open(self.get_path(id), 'rb') as stream:
+            return stream.read()
+
+
+def make_blob_store(uri, redis=None, ttl=86400):
+    """builds the blob store for the given uri:
+
+    * ``redis`` keeps the blobs in the given redis connection
+    * ``redis://dbindex@hostname:port`` or ``unix:///path/to/redis.sock``
+      in another redis server
+    * ``file:///some/directory`` or a plain path in a directory
+    """
+    if uri == 'redis':
+        return RedisBlobStore(redis, ttl)
+
+    conf = urlparse(uri)
+    if conf.scheme in ('redis', 'unix'):
+        return RedisBlobStore(StrictRedis(connection_pool=pools.get(uri)),
+                              ttl)
+
+    return FileBlobStore(conf.path)
@@ -0,0 +1,196 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals, absolute_import
+import time
+import atexit
+import logging
+from threading import Thread, Condition, Lock
+
+logger = logging.getLogger('lineup.backends.coalescer')
+
+
+class WriteCoalescer(Thread):
+    """write-behind for the pushes to the tail of the lists of one
+    redis server: they are queued in memory and sent as a single
+    MULTI/EXEC pipeline once ``batch_size`` of them are waiting or the
+    oldest one waited ``linger`` seconds.
+
+    A batch is all or nothing: when it fails it is put back in front
+    of the newer writes and retried. When redis can't keep up and
+    ``batch_size * max_batches`` writes are waiting, the threads that
+    push flush the batch themselves, so that memory stays bounded and
+    errors reach them.
+    """
+    max_batches = 10
+    retry_interval = 0.1
+
+    def __init__(self, redis, linger, batch_size):
+        super(WriteCoalescer, self).__init__()
+        self.daemon = True
+        self.redis = redis
+        self.linger = linger
+        self.batch_size = batch_size
+        self.condition = Condition()
+        # only one batch in flight at a time, so they land in order
+        self.flushing = Lock()
+        self.pending = []
+        # how many items of each list are pending, what rpush returns
+        self.lengths = {}
+        self.oldest = None
+        self.running = True
+        self.start()
+
+    def rpush(self, key, products):
+        """queues the products for the tail of the list ``key``,
+        returns how many items of that list are waiting to be sent:
+        the length of the list in redis isn't known until then"""
+        if not products:
+            with self.condition:
+                return self.lengths.get(key, 0)
+
+        with self.condition:
+            if not self.pending:
+                self.oldest = time.time()
+
+            self.pending.append((key, products))
+            length = self.lengths.get(key, 0) + len(products)
+            self.lengths[key] = length
+            waiting = len(self.pending)
+            if waiting == 1 or waiting >= self.batch_size:
+                self.condition.notify()
+
+        if not self.running or waiting >= self.batch_size * self.max_batches:
+            self.flush()
+
+        return length
+
+    def is_due(self):
+        if not self.pending:
+            return False
+
+        return (len(self.pending) >= self.batch_size or
+                time.time() - self.oldest >= self.linger)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.is_due():
+                    timeout = None
+                    if self.pending:
+                        timeout = self.oldest + self.linger - time.time()
+
+                    self.condition.wait(timeout)
+
+                if not self.running and not self.pending:
+                    return
+
+            try:
+                self.flush()
+            except Exception:
+                if not self.running:
+                    return
+
+                logger.exception("failed to flush the writes to redis, "
+                                 "retrying in %ss", self.retry_interval)
+                time.sleep(self.retry_interval)
+
+    def flush(self):
+        """sends the pending writes now, returns how many were sent"""
+        with self.flushing:
+            with self.condition:
+                batch, self.pending = self.pending, []
+                lengths, self.lengths = self.lengths, {}
+                oldest, self.oldest = self.oldest, None
+
+            if not batch:
+                return 0
+
+            pipeline = self.redis.pipeline(transaction=True)
+            for key, products in batch:
+                pipeline.rpush(key, *products)
+
+            try:
+                pipeline.execute()
+            except Exception:
+                with self.condition:
+                    self.pending[:0] = batch
+                    for key, length in lengths.items():
+                        self.lengths[key] = self.lengths.get(key, 0) + length
+
+                    self.oldest = oldest
+
+                raise
+
+            return len(batch)
+
+    def close(self):
+        """sends whatever is pending and stops the thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.join()
+        self.flush()
+
+
+class WriteCoalescers(object):
+    """the write coalescers of the process, one per redis uri and
+    settings, shared by every backend so that the writes of all the
+    queues and steps make the same batches. They are all flushed when
+    the process exits."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.coalescers = {}
+
+    def get(self, uri, redis, linger, batch_size):
+        key = (uri, linger, batch_size)
+        with self.lock:
+            if key not in self.coalescers:
+                self.coalescers[key] = WriteCoalescer(
+                    redis, linger, batch_size)
+
+            return self.coalescers[key]
+
+    def flush(self):
+        with self.lock:
+            coalescers = self.coalescers.values()
+
+        for coalescer in coalescers:
+            coalescer.flush()
+
+    def close(self):
+        with self.lock:
+            coalescers = self.coalescers.values()
+            self.coalescers = {}
+
+        for coalescer in coalescers:
+            coalescer.close()
+
+
+coalescers = WriteCoalescers()
+atexit.register(coalescers.close)
@@ -0,0 +1,236 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals, absolute_import
+import bz2
+import time
+import zlib
+from abc import ABCMeta, abstractmethod
+from threading import Lock
+
+from lineup.backends.serializers import MARKER
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# A compressed item starts with MARKER and the code of its compressor,
+# followed by the compressed item as its serializer wrote it. Codes
+# are upper case so that they never clash with the ones of the
+# serializers. Consumers decompress whatever compressor wrote an item,
+# with or without a compression of their own.
+
+COMPRESSORS = {}
+CODES = {}
+
+
+class Compressor(object):
+    """compresses the serialized items, subclasses implement compress
+    and decompress"""
+    __metaclass__ = ABCMeta
+
+    name = None
+    code = None
+    default_level = None
+
+    @abstractmethod
+    def compress(self, data, level):
+        """returns the data compressed at the given level"""
+
+    @abstractmethod
+    def decompress(self, data):
+        """returns the data as it was before being compressed"""
+
+
+class ZlibCompressor(Compressor):
+    name = 'zlib'
+    code = b'Z'
+    default_level = 6
+
+    def compress(self, data, level):
+        return zlib.compress(data, level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class BZ2Compressor(Compressor):
+    name = 'bz2'
+    code = b'B'
+    default_level = 9
+
+    def compress(self, data, level):
+        return bz2.compress(data, level)
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+
+class LZMACompressor(Compressor):
+    """the smallest items at the highest cost, it requires the lzma
+    module: part of python 3, pip install backports.lzma on python 2"""
+    name = 'lzma'
+    code = b'X'
+    default_level = 6
+
+    def __init__(self):
+        if lzma is None:
+            raise RuntimeError(
+                'the lzma compressor requires lzma, '
+                'run: pip install backports.lzma')
+
+    def compress(self, data, level):
+        return lzma.compress(data, preset=level)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+
+def register_compressor(compressor_class):
+    COMPRESSORS[compressor_class.name] = compressor_class
+    CODES[compressor_class.code] = compressor_class
+    return compressor_class
+
+
+def is_compressed(product):
+    return product[:1] == MARKER and product[1:2] in CODES
+
+
+class Compression(object):
+    """compresses the items of a queue longer than ``threshold`` bytes
+    with the compressor ``name`` at the given ``level``, and keeps
+    count of how much it saved and how long it took. Shorter items,
+    and the ones that wouldn't shrink, are left as they are."""
+
+    def __init__(self, name='zlib', level=None, threshold=1024):
+        if name not in COMPRESSORS:
+            msg = 'compression must be one of {0}, got {1}'
+            raise ValueError(msg.format(', '.join(sorted(COMPRESSORS)),
+                                        name))
+
+        self.name = name
+        self.compressor = COMPRESSORS[name]()
+        self.level = level is None and self.compressor.default_level or level
+        self.threshold = threshold
+        self.lock = Lock()
+        self.reset()
+
+    def __repr__(self):
+        return b'<lineup.Compression({0}, level={1}, threshold={2})>'.format(
+            self.name, self.level, self.threshold)
+
+    def copy(self):
+        return Compression(self.name, self.level, self.threshold)
+
+    def reset(self):
+        self.items = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+        self.decompressed = 0
+        self.decompress_seconds = 0.0
+
+    def compress(self, product):
+        if len(product) < self.threshold:
+            with self.lock:
+                self.items += 1
+                self.bytes_in += len(product)
+                self.bytes_out += len(product)
+
+            return product
+
+        started = time.time()
+        data = self.compressor.compress(product, self.level)
+        elapsed = time.time() - started
+
+        shrunk = len(data) + 2 < len(product)
+        result = shrunk and MARKER + self.compressor.code + data or product
+        with self.lock:
+            self.items += 1
+            self.compressed += shrunk and 1 or 0
+            self.bytes_in += len(product)
+            self.bytes_out += len(result)
+            self.compress_seconds += elapsed
+
+        return result
+
+    def decompress(self, product):
+        started = time.time()
+        data = decompress(product)
+        elapsed = time.time() - started
+        with self.lock:
+            self.decompressed += 1
+            self.decompress_seconds += elapsed
+
+        return data
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'compression': self.name,
+                'level': self.level,
+                'threshold': self.threshold,
+                'items': self.items,
+                'compressed': self.compressed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': self.bytes_out and (
+                    float(self.bytes_in) / self.bytes_out) or 1.0,
+                'compress_seconds': self.compress_seconds,
+                'decompressed': self.decompressed,
+                'decompress_seconds': self.decompress_seconds,
+            }
+
+
+def decompress(product):
+    """returns the item as its serializer wrote it"""
+    code = product[1:2]
+    if code not in CODES:
+        raise ValueError('unknown compressor code {0!r}'.format(code))
+
+    return CODES[code]().decompress(product[2:])
+
+
+def make_compression(compression):
+    """a Compression of its own for every queue, so that each one
+    keeps its own stats. Takes a compressor name or a Compression to
+    copy the settings from"""
+    if not compression:
+        return None
+
+    if isinstance(compression, Compression):
+        return compression.copy()
+
+    return Compression(compression)
+
+
+for compressor_class in (ZlibCompressor, BZ2Compressor, LZMACompressor):
+    register_compressor(compressor_class)
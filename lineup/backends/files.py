@@ -0,0 +1,177 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+import os
+import re
+import json
+import time
+import fcntl
+import errno
+import tempfile
+
+from lineup.backends.base import BaseBackend
+
+
+class FileLock(object):
+    """holds both the thread lock and the flock of an object with a
+    ``lock`` and an open ``fd``: the flock keeps other processes out,
+    the thread lock other threads of this one, which share the flock.
+
+    The thread lock must be reentrant: nested blocks only take the
+    flock once, and the outermost one releases it."""
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __enter__(self):
+        self.owner.lock.acquire()
+        depth = getattr(self.owner, 'lock_depth', 0)
+        if not depth:
+            fcntl.flock(self.owner.fd, fcntl.LOCK_EX)
+
+        self.owner.lock_depth = depth + 1
+
+    def __exit__(self, *args):
+        self.owner.lock_depth -= 1
+        if not self.owner.lock_depth:
+            fcntl.flock(self.owner.fd, fcntl.LOCK_UN)
+
+        self.owner.lock.release()
+
+
+class FileBackend(BaseBackend):
+    """the base of the backends that keep their queues in the files of
+    a directory shared by the processes of one host.
+
+    Subclasses store their lists in files ending with
+    ``list_suffix`` and implement ``lpop_many``, ``llen`` and the
+    pushes; values and step reports are small JSON files next to them
+    and the blocking pops poll the lists.
+    """
+    # the environment variable with the directory, and its default
+    directory_variable = None
+    default_directory = None
+    list_suffix = None
+
+    # the blocking pops back off up to this many seconds between
+    # attempts
+    poll_interval = 0.01
+
+    def initialize(self, directory=None):
+        self.directory = directory or os.environ.get(
+            self.directory_variable, self.get_default_directory())
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def get_default_directory(self):
+        return self.default_directory
+
+    def serialize(self, value):
+        return json.dumps(value, default=bytes).encode('utf-8')
+
+    def deserialize(self, value):
+        return value and json.loads(value) or None
+
+    def get_path(self, key, suffix):
+        name = re.sub(r'[^\w.:-]+', '_', key)
+        return os.path.join(self.directory, name + suffix)
+
+    # read operations
+    def get(self, key):
+        try:
+            with open(self.get_path(key, '.json')) as stream:
+                return self.deserialize(stream.read())
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def lpop(self, key):
+        items = self.lpop_many(key, 1)
+        return items and items[0] or None
+
+    def key_type(self, key):
+        path = self.get_path(key, self.list_suffix)
+        if os.path.exists(path) and self.llen(key):
+            return 'list'
+
+        if os.path.exists(self.get_path(key, '.json')):
+            return 'string'
+
+        return 'none'
+
+    # Blocking operations
+    def blpop(self, key, timeout=0):
+        keys = isinstance(key, (list, tuple)) and key or [key]
+        deadline = timeout and timeout > 0 and time.time() + timeout
+        delay = 0.0001
+        while True:
+            for key in keys:
+                items = self.lpop_many(key, 1)
+                if items:
+                    return items[0]
+
+            if deadline and time.time() >= deadline:
+                return None
+
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    # Write operations
+    def set(self, key, value):
+        # written aside and renamed, so readers never see half of it
+        path = self.get_path(key, '.json')
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(self.serialize(value))
+
+        os.rename(temporary, path)
+        return True
+
+    def promote(self, key, queue, now, limit):
+        # there is no delayed delivery, nothing is ever due
+        return 0
+
+    # Pipeline operations
+    def report_steps(self, name, consumers, producers):
+        path = self.get_path(name, '.steps')
+        with open(path, 'a+') as stream:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+            stream.seek(0)
+            steps = self.deserialize(stream.read()) or {}
+            all_consumers = set(steps.get('consumers', [])) | set(consumers)
+            all_producers = set(steps.get('producers', [])) | set(producers)
+            stream.seek(0)
+            stream.truncate()
+            stream.write(self.serialize({
+                'consumers': sorted(all_consumers),
+                'producers': sorted(all_producers),
+            }))
+
+        return all_consumers, all_producers
@@ -0,0 +1,360 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+import os
+import mmap
+import errno
+import struct
+from threading import Lock, RLock
+
+from lineup.backends.files import FileLock, FileBackend
+
+# every record is its length followed by the serialized item
+RECORD = struct.Struct(b'<I')
+
+# a position in a log: a byte offset and how many records lie before it
+POSITION = struct.Struct(b'<qq')
+
+SEGMENT_NAME = '{0:020d}-{1:020d}.segment'
+
+
+class Cursor(object):
+    """a position in a log kept in a small memory mapped file, so that
+    every process sees it move and it survives restarts"""
+
+    def __init__(self, path, default=(0, 0)):
+        self.lock = RLock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.locked():
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, POSITION.size)
+                self.map = mmap.mmap(self.fd, POSITION.size)
+                self.write(*default)
+            else:
+                self.map = mmap.mmap(self.fd, POSITION.size)
+
+    def locked(self):
+        return FileLock(self)
+
+    def read(self):
+        return POSITION.unpack_from(self.map, 0)
+
+    def write(self, offset, records):
+        POSITION.pack_into(self.map, 0, offset, records)
+
+
+class SegmentedLog(object):
+    """an append-only log of length-prefixed records split in segment
+    files named after the offset and the number of records they start
+    at. A batch of records never spans two segments.
+
+    Readers keep their own :py:class:`Cursor` per consumer group, in
+    ``<group>.offset`` files of the log directory, and a segment is
+    deleted once the cursor of every group is past it. With a
+    ``retention``, only that many of the newest segments are kept,
+    read or not.
+    """
+
+    def __init__(self, directory, segment_size, retention=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.retention = retention
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # the end of the log, also the lock of the writers
+        self.tail = Cursor(os.path.join(directory, 'tail'))
+        self.cursors = {}
+        self.writer = None
+
+        # guards the mappings, which the threads of the process share
+        self.lock = RLock()
+        self.maps = {}
+        self.oldest = None
+
+    def get_segments(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.endswith('.segment')]
+        return [tuple(map(int, name[:-len('.segment')].split('-')))
+                for name in sorted(names)]
+
+    def get_segment_path(self, offset, records):
+        return os.path.join(self.directory,
+                            SEGMENT_NAME.format(offset, records))
+
+    def get_cursor(self, group):
+        if group not in self.cursors:
+            # a new group starts at the oldest record still around
+            segments = self.get_segments()
+            default = segments and segments[0] or self.tail.read()
+            path = os.path.join(self.directory, group + '.offset')
+            self.cursors[group] = Cursor(path, default)
+
+        return self.cursors[group]
+
+    def get_end(self):
+        with self.tail.locked():
+            return self.tail.read()
+
+    def get_position(self, cursor):
+        """the offset and the number of records of the cursor, moved up
+        to the oldest segment when the retention deleted the records it
+        pointed to"""
+        offset, records = cursor.read()
+        if self.retention:
+            segments = self.get_segments()
+            if segments and offset < segments[0][0]:
+                return segments[0]
+
+        return offset, records
+
+    def append(self, products):
+        """writes the products at the end of the log and returns how
+        many records it has ever had"""
+        frames = b''.join(RECORD.pack(len(product)) + product
+                          for product in products)
+        with self.tail.locked():
+            end, records = self.tail.read()
+            if self.writer is None or self.writer[0] + \
+                    self.segment_size <= end or self.writer[1].closed:
+                self.roll(end, records)
+
+            self.writer[1].write(frames)
+            self.writer[1].flush()
+            records += len(products)
+            self.tail.write(end + len(frames), records)
+            return records
+
+    def roll(self, end, records):
+        # picks up the last segment, left by this process or another
+        # one, unless it is full
+        segments = self.get_segments()
+        if segments and segments[-1][0] + self.segment_size > end:
+            start, first = segments[-1]
+        else:
+            start, first = end, records
+
+        if self.writer and self.writer[0] != start:
+            self.writer[1].close()
+
+        if not self.writer or self.writer[0] != start:
+            path = self.get_segment_path(start, first)
+            self.writer = (start, open(path, 'ab'))
+
+        if self.retention:
+            self.expire()
+
+    def get_map(self, offset, size):
+        """returns the start of the segment holding ``offset`` and a
+        mapping of it covering ``size`` bytes from there"""
+        with self.lock:
+            return self.map_segment(offset, size)
+
+    def map_segment(self, offset, size):
+        starts = [start for start in self.maps if start <= offset]
+        start = starts and max(starts)
+        if not starts or offset + size > start + len(self.maps[start]):
+            # a segment still written to is mapped again as it grows
+            segments = [segment for segment in self.get_segments()
+                        if segment[0] <= offset]
+            start, records = segments[-1]
+            path = self.get_segment_path(start, records)
+            with open(path, 'rb') as stream:
+                mapping = mmap.mmap(stream.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+
+            if start in self.maps:
+                self.maps[start].close()
+
+            self.maps[start] = mapping
+
+        return start, self.maps[start]
+
+    def read(self, offset, end, limit, decode):
+        """decodes up to ``limit`` records from ``offset`` and before
+        ``end``, straight out of the mapped segments. Returns them, the
+        offset after the last one and whether it read past the oldest
+        segment, which may be deleted then."""
+        items = []
+        starts = set()
+        with self.lock:
+            while offset < end and len(items) < limit:
+                start, segment = self.get_map(offset, RECORD.size)
+                starts.add(start)
+                position = offset - start
+                length, = RECORD.unpack_from(segment, position)
+                start, segment = self.get_map(offset, RECORD.size + length)
+                position += RECORD.size
+                items.append(decode(buffer(segment, position, length)))
+                offset += RECORD.size + length
+
+            if starts and self.oldest is None:
+                self.oldest = self.get_segments()[0][0]
+
+            return items, offset, any(start > self.oldest
+                                      for start in starts)
+
+    def compact(self):
+        """deletes the segments that every group is done with"""
+        groups = [name[:-len('.offset')] for name in os.listdir(
+            self.directory) if name.endswith('.offset')]
+        done = min(self.get_cursor(group).read()[0] for group in groups)
+        with self.lock:
+            segments = self.get_segments()
+            for segment, following in zip(segments, segments[1:]):
+                if following[0] > done:
+                    break
+
+                self.delete(segment)
+                self.oldest = following[0]
+
+    def expire(self):
+        """deletes the segments older than the ``retention`` newest"""
+        with self.lock:
+            segments = self.get_segments()
+            for segment in segments[:-self.retention]:
+                self.delete(segment)
+
+            self.oldest = segments[-self.retention:][0][0]
+
+    def delete(self, segment):
+        mapping = self.maps.pop(segment[0], None)
+        if mapping is not None:
+            mapping.close()
+
+        try:
+            os.unlink(self.get_segment_path(*segment))
+        except OSError as e:
+            # already deleted by another process
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class LogBackend(FileBackend):
+    """keeps every queue in a segmented append-only log on disk, for
+    very high ingest rates.
+
+    The logs live in ``LINEUP_LOG_DIRECTORY`` (``lineup-logs`` by
+    default). Writers append batches of records under a lock and
+    readers of the same consumer group, ``LINEUP_LOG_GROUP``
+    (``lineup`` by default), share a persisted offset, so a restarted
+    step resumes right after the last item popped. Each group reads
+    every item of a log, and segments are deleted once all of them
+    are past. Items given back with ``lpush`` go to the end of the
+    log. It covers the list operations of
+    :py:class:`lineup.datastructures.Queue`, but not bounded queues,
+    delayed delivery, reliable, priority or deduplicating queues.
+
+    The logs of the steps (see Step.log) only keep their newest
+    ``log_retention`` segments of ``log_segment_size`` bytes.
+    """
+    directory_variable = 'LINEUP_LOG_DIRECTORY'
+    default_directory = 'lineup-logs'
+    list_suffix = '.log'
+
+    segment_size = 64 * 1024 * 1024
+
+    log_segment_size = 1024 * 1024
+    log_retention = 2
+
+    logs = {}
+    logs_lock = Lock()
+
+    def initialize(self, directory=None, group=None):
+        super(LogBackend, self).initialize(directory)
+        self.group = group or os.environ.get('LINEUP_LOG_GROUP', 'lineup')
+
+    def get_log(self, key):
+        # one set of mappings per log and process, shared by all the
+        # backends
+        path = self.get_path(key, self.list_suffix)
+        with self.logs_lock:
+            if path not in self.logs:
+                self.logs[path] = self.make_log(key, path)
+
+            return self.logs[path]
+
+    def make_log(self, key, path):
+        if key.endswith(':logging'):
+            return SegmentedLog(path, self.log_segment_size,
+                                self.log_retention)
+
+        return SegmentedLog(path, self.segment_size)
+
+    def decode(self, record):
+        # the only copy of a record, out of the mapped segment
+        return self.deserialize(str(record))
+
+    # read operations
+    def lpop_many(self, key, count):
+        if count < 1:
+            return []
+
+        log = self.get_log(key)
+        cursor = log.get_cursor(self.group)
+        with cursor.locked():
+            offset, records = log.get_position(cursor)
+            end = log.get_end()[0]
+            items, offset, crossed = log.read(offset, end, count,
+                                              self.decode)
+            cursor.write(offset, records + len(items))
+
+        if crossed:
+            log.compact()
+
+        return items
+
+    def llen(self, key):
+        log = self.get_log(key)
+        records = log.get_position(log.get_cursor(self.group))[1]
+        return log.get_end()[1] - records
+
+    def lrange(self, key, start, stop):
+        log = self.get_log(key)
+        if stop < 0:
+            stop = self.llen(key) + stop
+
+        offset = log.get_position(log.get_cursor(self.group))[0]
+        end = log.get_end()[0]
+        items = log.read(offset, end, stop + 1, self.decode)[0]
+        return items[start:]
+
+    # write operations
+    def rpush(self, key, value):
+        return self.rpush_many(key, [value])
+
+    def rpush_many(self, key, values):
+        log = self.get_log(key)
+        records = log.append(map(self.serialize, values))
+        return records - log.get_position(log.get_cursor(self.group))[1]
+
+    def lpush(self, key, value):
+        # a log can only grow at its end
+        return self.rpush_many(key, [value])
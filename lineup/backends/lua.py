@@ -0,0 +1,313 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+
+# Lua scripts that run server-side in redis. The backends register
+# them by name with `register_script`, so after the first call each
+# one runs through EVALSHA and never ships its source again.
+
+BOUNDED_RPUSH = """
+-- KEYS[1]: the list
+-- ARGV[1]: the maximum size of the list
+-- ARGV[2]: the overflow policy: block, reject or drop-oldest
+-- ARGV[3...]: the values to push
+--
+-- returns the new size of the list, or -1 when the values didn't fit
+local maxsize = tonumber(ARGV[1])
+local overflow = ARGV[2]
+local count = #ARGV - 2
+
+if overflow ~= 'drop-oldest' and
+        redis.call('LLEN', KEYS[1]) + count > maxsize then
+    return -1
+end
+
+for index = 3, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[index])
+end
+
+if overflow == 'drop-oldest' then
+    redis.call('LTRIM', KEYS[1], -maxsize, -1)
+end
+
+return redis.call('LLEN', KEYS[1])
+"""
+
+RELIABLE_POP = """
+-- KEYS[1]: the queue
+-- KEYS[2]: the processing list of the consumer
+-- KEYS[3]: the zset of processing lists scored by their lease deadline
+-- ARGV[1]: how many items the consumer is done with
+-- ARGV[2]: how many items to take from the queue
+-- ARGV[3]: the new lease deadline
+--
+-- acknowledges the finished items, which are always at the head of
+-- the processing list, then moves the next items into it and renews
+-- the lease. Returns the moved items.
+local acks = tonumber(ARGV[1])
+if acks > 0 then
+    redis.call('LTRIM', KEYS[2], acks, -1)
+end
+
+local items = {}
+for index = 1, tonumber(ARGV[2]) do
+    local item = redis.call('LPOP', KEYS[1])
+    if not item then
+        break
+    end
+    redis.call('RPUSH', KEYS[2], item)
+    items[#items + 1] = item
+end
+
+if redis.call('LLEN', KEYS[2]) > 0 then
+    redis.call('ZADD', KEYS[3], ARGV[3], KEYS[2])
+else
+    redis.call('ZREM', KEYS[3], KEYS[2])
+end
+
+return items
+"""
+
+RECLAIM = """
+-- KEYS[1]: the queue
+-- KEYS[2]: the zset of processing lists scored by their lease deadline
+-- ARGV[1]: the current time
+-- ARGV[2]: how many expired processing lists to reclaim at most
+--
+-- moves the items of expired processing lists back to the head of
+-- the queue, in their original order. Returns how many were moved.
+local expired = redis.call(
+    'ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local moved = 0
+
+for _, processing in ipairs(expired) do
+    local item = redis.call('RPOP', processing)
+    while item do
+        redis.call('LPUSH', KEYS[1], item)
+        moved = moved + 1
+        item = redis.call('RPOP', processing)
+    end
+    redis.call('ZREM', KEYS[2], processing)
+end
+
+return moved
+"""
+
+PRIORITY_PUSH = """
+-- KEYS[1]: the zset
+-- KEYS[2]: the sequence counter of the zset
+-- ARGV[1]: the priority, lower goes first
+-- ARGV[2]: the maximum size of the zset, 0 means unbounded
+-- ARGV[3]: the overflow policy: block, reject or drop-oldest
+-- ARGV[4...]: the values to push
+--
+-- scores are priority * 2^32 + sequence, so that items of the same
+-- priority keep their FIFO order. Members are prefixed with the
+-- sequence in 16 hex digits to keep identical values apart.
+--
+-- returns the new size of the zset, or -1 when the values didn't fit
+local priority = tonumber(ARGV[1])
+local maxsize = tonumber(ARGV[2])
+local overflow = ARGV[3]
+local count = #ARGV - 3
+
+if maxsize > 0 and overflow ~= 'drop-oldest' and
+        redis.call('ZCARD', KEYS[1]) + count > maxsize then
+    return -1
+end
+
+local last = redis.call('INCRBY', KEYS[2], count)
+for index = 4, #ARGV do
+    local sequence = last - count + index - 3
+    redis.call('ZADD', KEYS[1],
+               priority * 4294967296 + sequence % 4294967296,
+               string.format('%016x', sequence) .. ARGV[index])
+end
+
+-- dropping the "oldest" of a priority queue means dropping the
+-- least urgent items
+if maxsize > 0 and overflow == 'drop-oldest' then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], maxsize, -1)
+end
+
+return redis.call('ZCARD', KEYS[1])
+"""
+
+PROMOTE_DUE = """
+-- KEYS[1]: the zset of delayed items scored by their due time
+-- KEYS[2]: the queue
+-- ARGV[1]: the current time
+-- ARGV[2]: how many due items to promote at most
+--
+-- moves the items that are due to the tail of the queue, in order of
+-- due time. Members are prefixed with 32 hex digits that keep
+-- identical values apart. Returns how many items were moved.
+local due = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+
+for _, member in ipairs(due) do
+    redis.call('RPUSH', KEYS[2], string.sub(member, 33))
+    redis.call('ZREM', KEYS[1], member)
+end
+
+return #due
+"""
+
+DEDUP_PUSH = """
+-- KEYS[1]: the list, or the zset of delayed items
+-- KEYS[2...]: one marker per value, named after its idempotency key
+-- ARGV[1]: how long the markers live, in seconds
+-- ARGV[2]: the due time of the values, empty to push them to the list
+-- ARGV[3...]: the values, in the same order as their markers
+--
+-- pushes only the values whose marker didn't exist yet, setting it so
+-- that repeats are dropped until it expires. Delayed values are
+-- already prefixed, see PROMOTE_DUE. Returns how many were pushed.
+local pushed = 0
+for index = 2, #KEYS do
+    if redis.call('SET', KEYS[index], 1, 'NX', 'EX', ARGV[1]) then
+        if ARGV[2] == '' then
+            redis.call('RPUSH', KEYS[1], ARGV[index + 1])
+        else
+            redis.call('ZADD', KEYS[1], ARGV[2], ARGV[index + 1])
+        end
+        pushed = pushed + 1
+    end
+end
+
+return pushed
+"""
+
+BLOOM_PUSH = """
+-- KEYS[1]: the list, or the zset of delayed items
+-- KEYS[2]: the bloom filter of the current time window
+-- KEYS[3]: the bloom filter of the previous time window
+-- ARGV[1]: how long a filter lives, in seconds
+-- ARGV[2]: the due time of the values, empty to push them to the list
+-- ARGV[3]: how many bits of the filter each value sets
+-- ARGV[4...]: for each value, the offsets of its bits then the value
+--
+-- like DEDUP_PUSH, but a value counts as seen when all of its bits are
+-- set in either filter. Returns how many values were pushed.
+local hashes = tonumber(ARGV[3])
+local pushed = 0
+local index = 4
+
+while index <= #ARGV do
+    local current, previous = true, true
+    for bit = index, index + hashes - 1 do
+        if current and redis.call('GETBIT', KEYS[2], ARGV[bit]) == 0 then
+            current = false
+        end
+        if previous and redis.call('GETBIT', KEYS[3], ARGV[bit]) == 0 then
+            previous = false
+        end
+    end
+
+    if not (current or previous) then
+        for bit = index, index + hashes - 1 do
+            redis.call('SETBIT', KEYS[2], ARGV[bit], 1)
+        end
+
+        local value = ARGV[index + hashes]
+        if ARGV[2] == '' then
+            redis.call('RPUSH', KEYS[1], value)
+        else
+            redis.call('ZADD', KEYS[1], ARGV[2], value)
+        end
+        pushed = pushed + 1
+    end
+
+    index = index + hashes + 1
+end
+
+if pushed > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+
+return pushed
+"""
+
+HANDOFF = """
+-- KEYS[1]: the processing list of the consumer
+-- KEYS[2]: the zset of processing lists scored by their lease deadline
+-- KEYS[3]: the produce queue
+-- KEYS[4]: the log list of the step
+-- KEYS[5]: the hash of counters of the step
+-- ARGV[1]: how many items the consumer is done with
+-- ARGV[2]: the new lease deadline
+-- ARGV[3]: how many items to push to the produce queue
+-- ARGV[4]: how many log records to append
+-- ARGV[5...]: the items, then the log records, then for each counter
+-- its name and increment
+--
+-- what a step does once it consumed an item, in one go: acknowledges
+-- it like RELIABLE_POP, pushes what it produced, appends its logs and
+-- bumps its counters. An item is never gone from the processing list
+-- before its outputs are in the produce queue. Returns how many items
+-- were pushed.
+local acks = tonumber(ARGV[1])
+if acks > 0 then
+    redis.call('LTRIM', KEYS[1], acks, -1)
+    if redis.call('LLEN', KEYS[1]) > 0 then
+        redis.call('ZADD', KEYS[2], ARGV[2], KEYS[1])
+    else
+        redis.call('ZREM', KEYS[2], KEYS[1])
+    end
+end
+
+local products = tonumber(ARGV[3])
+local records = tonumber(ARGV[4])
+local first = 5
+
+for index = first, first + products - 1 do
+    redis.call('RPUSH', KEYS[3], ARGV[index])
+end
+
+first = first + products
+for index = first, first + records - 1 do
+    redis.call('RPUSH', KEYS[4], ARGV[index])
+end
+
+for index = first + records, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[5], ARGV[index], ARGV[index + 1])
+end
+
+return products
+"""
+
+
+SCRIPTS = {
+    'bounded_rpush': BOUNDED_RPUSH,
+    'reliable_pop': RELIABLE_POP,
+    'reclaim': RECLAIM,
+    'priority_push': PRIORITY_PUSH,
+    'promote_due': PROMOTE_DUE,
+    'dedup_push': DEDUP_PUSH,
+    'bloom_push': BLOOM_PUSH,
+    'handoff': HANDOFF,
+}
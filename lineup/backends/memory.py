@@ -0,0 +1,256 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+import time
+import heapq
+import itertools
+from collections import deque, defaultdict
+from threading import Condition, RLock
+
+from lineup.backends.base import BaseBackend
+
+
+class MemoryStore(object):
+    """the lists, values and sets of every MemoryBackend of a process,
+    guarded by a single lock.
+
+    A blocking pop waits on a condition of its own, registered under
+    the keys it waits for, so that a push only wakes up as many
+    waiters of its key as it pushed items."""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.waiters = defaultdict(deque)
+        self.waiting = {}
+        self.clear()
+
+    def wait(self, keys, timeout):
+        """waits up to ``timeout`` seconds for an item pushed to one of
+        the keys, the lock must be held"""
+        waiter = Condition(self.lock)
+        self.waiting[waiter] = keys = set(keys)
+        for key in keys:
+            self.waiters[key].append(waiter)
+
+        try:
+            waiter.wait(timeout)
+        finally:
+            self.forget(waiter)
+
+    def notify(self, key, count=1):
+        """wakes up to ``count`` waiters of the key, the lock must be
+        held"""
+        waiters = self.waiters.get(key)
+        while waiters and count > 0:
+            waiter = waiters[0]
+            self.forget(waiter)
+            waiter.notify()
+            count -= 1
+
+    def forget(self, waiter):
+        # a waiter is gone from every key once notified, so that the
+        # next push wakes up another one
+        for key in self.waiting.pop(waiter, ()):
+            waiters = self.waiters[key]
+            waiters.remove(waiter)
+            if not waiters:
+                del self.waiters[key]
+
+    def clear(self):
+        with self.lock:
+            self.lists = defaultdict(deque)
+            self.values = {}
+            self.sets = defaultdict(set)
+            self.delayed = defaultdict(list)
+            self.sequence = itertools.count()
+
+
+class MemoryBackend(BaseBackend):
+    """keeps the queues in the memory of the process, for pipelines
+    whose steps all run as threads of one process.
+
+    Items are handed over as the very same python objects, without
+    any serialization, so a step must not change an item after
+    producing it. It covers the list operations of
+    :py:class:`lineup.datastructures.Queue`, including ``maxsize``
+    and delayed delivery, but not reliable, priority, stream or
+    deduplicating queues.
+    """
+    store = MemoryStore()
+
+    # the step logs (see Step.log) only keep their latest entries
+    log_length = 1000
+
+    def initialize(self, *args, **kwargs):
+        # every backend of the process locks the same store
+        self.lock = self.store.lock
+
+    def trim(self, key, items):
+        if key.endswith(':logging'):
+            while len(items) > self.log_length:
+                items.popleft()
+
+    # read operations
+    def get(self, key):
+        with self.lock:
+            return self.store.values.get(key)
+
+    def lpop(self, key):
+        with self.lock:
+            items = self.store.lists.get(key)
+            if items:
+                return items.popleft()
+
+    def rpop(self, key):
+        with self.lock:
+            items = self.store.lists.get(key)
+            if items:
+                return items.pop()
+
+    def lpop_many(self, key, count):
+        with self.lock:
+            items = self.store.lists.get(key) or deque()
+            count = min(max(count, 0), len(items))
+            return [items.popleft() for index in range(count)]
+
+    def llen(self, key):
+        with self.lock:
+            return len(self.store.lists.get(key) or ())
+
+    def lrange(self, key, start, stop):
+        with self.lock:
+            items = list(self.store.lists.get(key) or ())
+
+        # the same inclusive stop as redis
+        return stop == -1 and items[start:] or items[start:stop + 1]
+
+    def key_type(self, key):
+        with self.lock:
+            if self.store.lists.get(key):
+                return 'list'
+
+            if key in self.store.values:
+                return 'string'
+
+            return 'none'
+
+    # Blocking operations
+    def blpop(self, key, timeout=0):
+        return self.bpop(key, timeout, deque.popleft)
+
+    def brpop(self, key, timeout=0):
+        return self.bpop(key, timeout, deque.pop)
+
+    def bpop(self, key, timeout, pop):
+        keys = isinstance(key, (list, tuple)) and key or [key]
+        deadline = timeout and timeout > 0 and time.time() + timeout
+        with self.lock:
+            while True:
+                for key in keys:
+                    items = self.store.lists.get(key)
+                    if items:
+                        return pop(items)
+
+                block = 1
+                if deadline:
+                    block = deadline - time.time()
+                    if block <= 0:
+                        return None
+
+                # waits a second at most even when blocking forever,
+                # so that python 2 still notices signals
+                self.store.wait(keys, min(block, 1))
+
+    # Write operations
+    def set(self, key, value):
+        with self.lock:
+            self.store.values[key] = value
+            return True
+
+    def rpush(self, key, value):
+        return self.rpush_many(key, [value])
+
+    def rpush_many(self, key, values):
+        with self.lock:
+            items = self.store.lists[key]
+            items.extend(values)
+            self.trim(key, items)
+            self.store.notify(key, len(values))
+            return len(items)
+
+    def lpush(self, key, value):
+        with self.lock:
+            items = self.store.lists[key]
+            items.appendleft(value)
+            self.store.notify(key)
+            return len(items)
+
+    def bounded_rpush(self, key, values, maxsize, overflow):
+        # the same rules as lua.BOUNDED_RPUSH
+        with self.lock:
+            items = self.store.lists[key]
+            if overflow != 'drop-oldest' and \
+                    len(items) + len(values) > maxsize:
+                return -1
+
+            items.extend(values)
+            while len(items) > maxsize:
+                items.popleft()
+
+            self.store.notify(key, len(values))
+            return len(items)
+
+    def schedule(self, key, values, due):
+        with self.lock:
+            delayed = self.store.delayed[key]
+            for value in values:
+                entry = (due, next(self.store.sequence), value)
+                heapq.heappush(delayed, entry)
+
+            return len(values)
+
+    def promote(self, key, queue, now, limit):
+        with self.lock:
+            delayed = self.store.delayed.get(key)
+            due = []
+            while delayed and len(due) < limit and delayed[0][0] <= now:
+                due.append(heapq.heappop(delayed)[-1])
+
+            if due:
+                self.store.lists[queue].extend(due)
+                self.store.notify(queue, len(due))
+
+            return len(due)
+
+    # Pipeline operations
+    def report_steps(self, name, consumers, producers):
+        with self.lock:
+            all_consumers = self.store.sets[':'.join([name, 'consumers'])]
+            all_producers = self.store.sets[':'.join([name, 'producers'])]
+            all_consumers.update(consumers)
+            all_producers.update(producers)
+            return set(all_consumers), set(all_producers)
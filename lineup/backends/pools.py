@@ -0,0 +1,149 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+import os
+import inspect
+from urlparse import urlparse, parse_qs
+from threading import Lock
+
+from redis.connection import (
+    Connection,
+    ConnectionPool,
+    BlockingConnectionPool,
+    UnixDomainSocketConnection,
+)
+
+
+def supports(argument):
+    # health checks only exist since redis-py 3.3
+    return argument in inspect.getargspec(Connection.__init__).args
+
+
+class ConnectionPools(object):
+    """the redis connection pools of the process, one per uri, shared
+    by every backend, queue and step, so that the connections to redis
+    follow how many commands actually run at once rather than how
+    many objects talk to redis.
+
+    Besides the usual ``redis://dbindex@hostname:port/password`` the
+    uri may be a unix socket: ``unix:///path/to/redis.sock?db=0``.
+
+    ``LINEUP_REDIS_MAX_CONNECTIONS`` caps the connections of each
+    pool, a thread then waits up to ``LINEUP_REDIS_POOL_TIMEOUT``
+    seconds for a free one. Bear in mind that a step blocked on its
+    queue holds a connection for the whole time.
+    """
+    socket_keepalive = True
+    health_check_interval = 30
+    pool_timeout = 20
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pools = {}
+
+    def get(self, uri):
+        with self.lock:
+            if uri not in self.pools:
+                self.pools[uri] = self.make_pool(uri)
+
+            return self.pools[uri]
+
+    def get_connection_kwargs(self, uri):
+        conf = urlparse(uri)
+        kwargs = {'socket_keepalive': self.socket_keepalive}
+        if supports('health_check_interval'):
+            kwargs['health_check_interval'] = int(os.environ.get(
+                'LINEUP_REDIS_HEALTH_CHECK_INTERVAL',
+                self.health_check_interval))
+
+        if conf.scheme == 'unix':
+            query = parse_qs(conf.query)
+            kwargs.update(
+                connection_class=UnixDomainSocketConnection,
+                path=conf.path,
+                db=query.get('db', [0])[0],
+                password=query.get('password', [None])[0],
+            )
+            # unix sockets have no keepalive
+            kwargs.pop('socket_keepalive')
+        else:
+            kwargs.update(
+                db=conf.username or 0,
+                host=conf.hostname,
+                port=conf.port,
+                # using `path` as password to support the URI like:
+                # redis://dbindex@hostname:port/veryverylongpasswordhash
+                password=conf.path,
+            )
+
+        return kwargs
+
+    def make_pool(self, uri):
+        kwargs = self.get_connection_kwargs(uri)
+        max_connections = os.environ.get('LINEUP_REDIS_MAX_CONNECTIONS')
+        if not max_connections:
+            return ConnectionPool(**kwargs)
+
+        timeout = os.environ.get('LINEUP_REDIS_POOL_TIMEOUT',
+                                 self.pool_timeout)
+        return BlockingConnectionPool(
+            max_connections=int(max_connections),
+            timeout=float(timeout), **kwargs)
+
+    def get_stats(self):
+        """how many connections each pool has opened and lends right
+        now, by uri"""
+        with self.lock:
+            pools = self.pools.items()
+
+        return dict((uri, self.get_pool_stats(pool)) for uri, pool in pools)
+
+    def get_pool_stats(self, pool):
+        if isinstance(pool, BlockingConnectionPool):
+            created = len(pool._connections)
+            idle = len([c for c in pool.pool.queue if c is not None])
+            in_use = created - idle
+        else:
+            created = pool._created_connections
+            in_use = len(pool._in_use_connections)
+
+        return {
+            'created': created,
+            'in_use': in_use,
+            'idle': created - in_use,
+            'max_connections': pool.max_connections,
+        }
+
+    def disconnect(self):
+        """closes every connection and forgets the pools"""
+        with self.lock:
+            pools, self.pools = self.pools.values(), {}
+
+        for pool in pools:
+            pool.disconnect()
+
+
+pools = ConnectionPools()
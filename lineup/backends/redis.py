@@ -27,35 +27,201 @@
 from __future__ import unicode_literals, absolute_import
 import os
 import json
+import math
+import uuid
+import struct
+import hashlib
 from milieu import Environment
 
+from lineup.core import BlobReference, LineUpPayloadDict
+from lineup.backends import lua, serializers
+from lineup.backends.compression import is_compressed, decompress
+from lineup.backends.blobs import make_blob_store
+from lineup.backends.pools import pools
+from lineup.backends.coalescer import coalescers
+from lineup.datastructures import StreamQueue
 from lineup.backends.base import BaseBackend, io_operation
 
-from redis import StrictRedis
+from redis import StrictRedis, ResponseError
 
 env = Environment()
 os.environ.setdefault('LINEUP_REDIS_URI', 'redis://0@localhost:6379')
 
 
 class JSONRedisBackend(BaseBackend):
-    def initialize(self):
-        conf = env.get_uri("LINEUP_REDIS_URI")
-
-        self.redis = StrictRedis(
-            db=conf.username or 0,
-            host=conf.host,
-            port=conf.port,
-            # using `path` as password to support the URI like:
-            # redis://dbindex@hostname:port/veryverylongpasswordhash
-            password=conf.path,
-        )
+    # StrictRedis takes a connection of the shared pool for every
+    # command, so the threads sharing a backend don't wait on each other
+    thread_safe = True
+
+    # the queues can hand items from step to step in a single round
+    # trip, see hand_off
+    atomic_handoff = True
+
+    # claim-check: the string fields of a payload longer than
+    # blob_threshold characters are kept in a blob store instead, see
+    # lineup.backends.blobs.make_blob_store. Set LINEUP_BLOB_STORE to
+    # turn it on
+    blob_store = None
+    blob_threshold = 64 * 1024
+    blob_ttl = 86400
+
+    # how the items are written, see lineup.backends.serializers: None
+    # is plain JSON. Whatever the serializer, the items written by the
+    # other safe ones are read too, but pickled items only when it is
+    # pickle
+    serializer = None
+
+    # a lineup.backends.compression.Compression that compresses the long
+    # items it writes. Compressed items are read either way
+    compression = None
+
+    # write-behind: with a linger, in seconds, the pushes to the tail of
+    # the lists wait in memory for up to that long and go to redis in
+    # batches of up to batch_size, see lineup.backends.coalescer. Call
+    # flush() to read your own writes
+    linger = None
+    batch_size = 500
+    coalescer = None
+
+    # redis >= 6.0 blocks for fractions of a second, older servers only
+    # take whole seconds. None asks the server, see get_blocking_timeout
+    fractional_timeouts = None
+
+    def initialize(self, uri=None):
+        # an explicit uri lets a process talk to many redis servers,
+        # like the shards of a lineup.datastructures.ShardedQueue
+        self.uri = uri or env.get("LINEUP_REDIS_URI")
+
+        # every backend of the process shares the connections to the
+        # same uri, see lineup.backends.pools.ConnectionPools
+        self.redis = StrictRedis(connection_pool=pools.get(self.uri))
+        self.scripts = {}
+        self.blobs = self.make_blob_store()
+        self.coalescer = self.make_coalescer()
+
+    def make_blob_store(self):
+        uri = env.get('LINEUP_BLOB_STORE', self.blob_store)
+        if uri:
+            return make_blob_store(uri, self.redis, self.blob_ttl)
+
+    def make_coalescer(self):
+        linger = float(os.environ.get('LINEUP_REDIS_LINGER',
+                                      self.linger or 0))
+        if not linger:
+            return None
+
+        batch_size = int(os.environ.get('LINEUP_REDIS_BATCH_SIZE',
+                                        self.batch_size))
+        return coalescers.get(self.uri, self.redis, linger, batch_size)
+
+    def flush(self):
+        if self.coalescer is not None:
+            self.coalescer.flush()
+
+    def get_script(self, name):
+        if name not in self.scripts:
+            source = lua.SCRIPTS[name]
+            self.scripts[name] = self.redis.register_script(source)
+
+        return self.scripts[name]
 
     def serialize(self, value):
-        return json.dumps(value, default=bytes)
+        if self.blobs is not None:
+            value = self.check_in(value)
+
+        return self.encode(value)
+
+    def encode(self, value):
+        if self.serializer is not None:
+            product = self.serializer.encode(value)
+        else:
+            product = json.dumps(value, default=bytes)
+
+        if self.compression is not None:
+            return self.compression.compress(product)
+
+        return product
+
+    def decompress(self, product):
+        if self.compression is not None:
+            return self.compression.decompress(product)
+
+        return decompress(product)
 
     def deserialize(self, value):
+        if value and is_compressed(value):
+            value = self.decompress(value)
+
+        if value and serializers.is_framed(value):
+            value = serializers.decode(value, self.serializer)
+            if self.blobs is not None:
+                value = self.check_out_all(value)
+
+            return value or None
+
+        if self.blobs is not None and value:
+            return json.loads(value, object_hook=self.check_out)
+
         return value and json.loads(value) or None
 
+    def check_in(self, value):
+        """returns a copy of the value where the long strings are
+        replaced by references to the blob store. References that came
+        in are passed on as plain dicts, without their resolver nor the
+        blob they may have fetched, so a blob is only stored once."""
+        if isinstance(value, BlobReference):
+            return dict(value)
+
+        if isinstance(value, dict):
+            return dict((key, self.check_in(item))
+                        for key, item in value.items())
+
+        if isinstance(value, (list, tuple)):
+            return map(self.check_in, value)
+
+        if isinstance(value, basestring) and \
+                len(value) > self.blob_threshold:
+            blob = self.serialize_blob(value)
+            return {BlobReference.key: self.blobs.put(blob)}
+
+        return value
+
+    def check_out(self, value):
+        # json object_hook: references are resolved lazily, the dicts
+        # that hold them resolve them when the field is read
+        if BlobReference.is_reference(value):
+            return BlobReference(value, self.get_blob)
+
+        if any(isinstance(item, BlobReference) for item in value.values()):
+            return LineUpPayloadDict(value)
+
+        return value
+
+    def check_out_all(self, value):
+        # check_out for the serializers that have no object_hook
+        if isinstance(value, dict):
+            return self.check_out(dict(
+                (key, self.check_out_all(item))
+                for key, item in value.items()))
+
+        if isinstance(value, list):
+            return map(self.check_out_all, value)
+
+        return value
+
+    def serialize_blob(self, value):
+        return self.encode(value)
+
+    def get_blob(self, id):
+        blob = self.blobs.get(id)
+        if is_compressed(blob):
+            blob = self.decompress(blob)
+
+        if serializers.is_framed(blob):
+            return serializers.decode(blob, self.serializer)
+
+        return json.loads(blob)
+
     # read operations
     @io_operation
     def get(self, key):
@@ -77,12 +243,161 @@ class JSONRedisBackend(BaseBackend):
     def lrange(self, key, start, stop):
         return map(self.deserialize, self.redis.lrange(key, start, stop))
 
+    @io_operation
+    def key_type(self, key):
+        return self.redis.type(key)
+
+    # raw operations skip (de)serialization, they move the values
+    # exactly as stored, see lineup.snapshots
+    @io_operation
+    def lrange_raw(self, key, start, count):
+        return self.redis.lrange(key, start, start + count - 1)
+
+    @io_operation
+    def lpop_many_raw(self, key, count):
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(key, 0, count - 1)
+        pipeline.ltrim(key, count, -1)
+        return pipeline.execute()[0]
+
+    @io_operation
+    def rpush_raw(self, key, batches):
+        # one RPUSH per batch, all of them in a single round trip
+        pipeline = self.redis.pipeline(transaction=False)
+        for products in batches:
+            pipeline.rpush(key, *products)
+
+        return pipeline.execute()
+
+    @io_operation
+    def zrange_raw(self, key, start, count):
+        return self.redis.zrange(key, start, start + count - 1,
+                                 withscores=True)
+
+    @io_operation
+    def zpop_many_raw(self, key, count):
+        pipeline = self.redis.pipeline()
+        pipeline.zrange(key, 0, count - 1, withscores=True)
+        pipeline.zremrangebyrank(key, 0, count - 1)
+        return pipeline.execute()[0]
+
+    @io_operation
+    def zadd_raw(self, key, batches):
+        # one ZADD per batch of (member, score) pairs, all of them in a
+        # single round trip
+        pipeline = self.redis.pipeline(transaction=False)
+        for pairs in batches:
+            arguments = []
+            for member, score in pairs:
+                arguments.extend([score, member])
+
+            pipeline.execute_command('ZADD', key, *arguments)
+
+        return pipeline.execute()
+
+    @io_operation
+    def get_raw(self, key):
+        return self.redis.get(key)
+
+    @io_operation
+    def set_raw(self, key, value, only_missing=False):
+        return self.redis.set(key, value, nx=only_missing)
+
+    @io_operation
+    def lpop_many(self, key, count):
+        if count < 1:
+            return []
+
+        # LRANGE + LTRIM inside MULTI/EXEC: atomic and a single round
+        # trip, regardless of the redis server version
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(key, 0, count - 1)
+        pipeline.ltrim(key, count, -1)
+        values = pipeline.execute()[0]
+        return map(self.deserialize, values)
+
+    @io_operation
+    def reliable_pop(self, key, processing, leases, acks, count, lease):
+        script = self.get_script('reliable_pop')
+        values = script(keys=[key, processing, leases],
+                        args=[acks, count, lease])
+        return map(self.deserialize, values)
+
+    @io_operation
+    def zpopmin(self, key, count):
+        # ZPOPMIN needs redis >= 5.0, members are prefixed with the
+        # 16 hex digits of their sequence (see lua.PRIORITY_PUSH)
+        if count < 1:
+            return []
+
+        items = self.redis.execute_command('ZPOPMIN', key, count)
+        return [self.deserialize(member[16:]) for member in items[::2]]
+
+    @io_operation
+    def zcard(self, key):
+        return self.redis.zcard(key)
+
     @io_operation
     def rpop(self, key):
         value = self.redis.rpop(key)
         result = self.deserialize(value)
         return result
 
+    # Blocking operations
+    #
+    # These don't go through `io_operation`: the redis connection
+    # pool is thread-safe and holding the backend lock while redis
+    # waits for an item would stall every other thread sharing this
+    # backend, including the producers that would wake us up.
+    def blpop(self, key, timeout=0):
+        timeout = self.get_blocking_timeout(timeout)
+        item = self.redis.blpop(key, timeout=timeout)
+        return item and self.deserialize(item[1]) or None
+
+    def brpop(self, key, timeout=0):
+        timeout = self.get_blocking_timeout(timeout)
+        item = self.redis.brpop(key, timeout=timeout)
+        return item and self.deserialize(item[1]) or None
+
+    def reliable_bpop(self, key, processing, leases, timeout, lease):
+        # the lease is renewed in the same round trip, before
+        # blocking, so that it also covers an item that arrives while
+        # we wait. BLMOVE needs redis >= 6.2
+        timeout = self.get_blocking_timeout(timeout)
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.execute_command('ZADD', leases, lease, processing)
+        pipeline.execute_command(
+            'BLMOVE', key, processing, 'LEFT', 'RIGHT', timeout)
+        value = pipeline.execute()[-1]
+        return self.deserialize(value)
+
+    def bzpopmin(self, key, timeout=0):
+        # BZPOPMIN needs redis >= 5.0
+        timeout = self.get_blocking_timeout(timeout)
+        item = self.redis.execute_command('BZPOPMIN', key, timeout)
+        return item and self.deserialize(item[1][16:]) or None
+
+    def get_blocking_timeout(self, timeout):
+        # redis understands 0 as "block forever" and servers older
+        # than 6.0 only accept whole seconds
+        if not timeout or timeout < 0:
+            return 0
+
+        if self.supports_fractional_timeouts():
+            # redis counts milliseconds, and a timeout rounded down to
+            # 0 would block forever
+            return max(round(timeout, 3), 0.001)
+
+        return int(math.ceil(timeout))
+
+    def supports_fractional_timeouts(self):
+        if self.fractional_timeouts is None:
+            version = self.redis.info('server')['redis_version']
+            major = int(version.split('.')[0])
+            self.fractional_timeouts = major >= 6
+
+        return self.fractional_timeouts
+
     # Write operations
     @io_operation
     def set(self, key, value):
@@ -92,13 +407,107 @@ class JSONRedisBackend(BaseBackend):
     @io_operation
     def rpush(self, key, value):
         product = self.serialize(value)
+        if self.coalescer is not None:
+            return self.coalescer.rpush(key, [product])
+
         return self.redis.rpush(key, product)
 
+    @io_operation
+    def rpush_many(self, key, values):
+        products = map(self.serialize, values)
+        if self.coalescer is not None:
+            return self.coalescer.rpush(key, products)
+
+        return self.redis.rpush(key, *products)
+
+    @io_operation
+    def bounded_rpush(self, key, values, maxsize, overflow):
+        products = map(self.serialize, values)
+        script = self.get_script('bounded_rpush')
+        return script(keys=[key], args=[maxsize, overflow] + products)
+
+    @io_operation
+    def zpush(self, key, sequence, values, priority, maxsize, overflow):
+        products = map(self.serialize, values)
+        script = self.get_script('priority_push')
+        return script(keys=[key, sequence],
+                      args=[priority, maxsize or 0, overflow] + products)
+
+    def make_member(self, value):
+        # the random prefix keeps identical values apart in the zset
+        # of delayed items, see lua.PROMOTE_DUE
+        return uuid.uuid4().hex + self.serialize(value)
+
+    @io_operation
+    def schedule(self, key, values, due):
+        arguments = []
+        for value in values:
+            arguments.extend([due, self.make_member(value)])
+
+        return self.redis.execute_command('ZADD', key, *arguments)
+
+    @io_operation
+    def dedup_push(self, key, markers, values, ttl, due=None):
+        if due is None:
+            products = map(self.serialize, values)
+        else:
+            products = map(self.make_member, values)
+
+        script = self.get_script('dedup_push')
+        return script(keys=[key] + markers,
+                      args=[int(math.ceil(ttl)), due or ''] + products)
+
+    @io_operation
+    def bloom_push(self, key, filters, ids, values, ttl, bits, hashes,
+                   due=None):
+        arguments = [int(math.ceil(ttl)), due or '', hashes]
+        for id, value in zip(ids, values):
+            arguments.extend(self.get_bloom_offsets(id, bits, hashes))
+            if due is None:
+                arguments.append(self.serialize(value))
+            else:
+                arguments.append(self.make_member(value))
+
+        script = self.get_script('bloom_push')
+        return script(keys=[key] + filters, args=arguments)
+
+    def get_bloom_offsets(self, id, bits, hashes):
+        # double hashing: the i-th offset is h1 + i * h2, which is as
+        # good as i independent hash functions for a bloom filter
+        digest = hashlib.md5(id).digest()
+        h1, h2 = struct.unpack(b'>QQ', digest)
+        return [(h1 + index * h2) % bits for index in range(hashes)]
+
+    @io_operation
+    def promote(self, key, queue, now, limit):
+        script = self.get_script('promote_due')
+        return script(keys=[key, queue], args=[now, limit])
+
     @io_operation
     def lpush(self, key, value):
         product = self.serialize(value)
         return self.redis.lpush(key, product)
 
+    @io_operation
+    def reclaim(self, key, leases, now, limit):
+        script = self.get_script('reclaim')
+        return script(keys=[key, leases], args=[now, limit])
+
+    @io_operation
+    def hand_off(self, processing, leases, acks, lease, key, products,
+                 log_key, records, stats_key, counters):
+        # the products and the log records come serialized, by the
+        # backends of their queue and of their step
+        script = self.get_script('handoff')
+        args = [acks, lease, len(products), len(records)]
+        args.extend(products)
+        args.extend(records)
+        for name, increment in sorted(counters.items()):
+            args.extend([name, increment])
+
+        return script(keys=[processing, leases, key, log_key, stats_key],
+                      args=args)
+
     # Pipeline operations
     @io_operation
     def report_steps(self, name, consumers, producers):
@@ -120,3 +529,85 @@ class JSONRedisBackend(BaseBackend):
         all_producers = result[-1]
 
         return all_consumers, all_producers
+
+
+class StreamsRedisBackend(JSONRedisBackend):
+    """keeps each queue in a redis stream (redis >= 6.2) read through
+    consumer groups, see :py:class:`lineup.datastructures.StreamQueue`.
+
+    Pipelines given this backend use stream queues unless told
+    otherwise, everything else works like :py:class:`JSONRedisBackend`.
+    """
+    queue_class = StreamQueue
+
+    # the field of the stream entries that holds the serialized value
+    field = 'payload'
+
+    def parse_entries(self, entries):
+        # entries of deleted messages come back as (id, None)
+        return [(id, self.deserialize(fields[self.field]))
+                for id, fields in entries or [] if fields]
+
+    @io_operation
+    def xadd_many(self, key, values, maxlen):
+        # MAXLEN ~ lets redis trim whole macro nodes, which is much
+        # cheaper than keeping the exact length
+        pipeline = self.redis.pipeline(transaction=False)
+        for value in values:
+            fields = {self.field: self.serialize(value)}
+            pipeline.xadd(key, fields, maxlen=maxlen, approximate=True)
+
+        return pipeline.execute()
+
+    @io_operation
+    def xgroup_create(self, key, group):
+        # the group starts from the beginning of the stream, so that
+        # the items put before the first consumer showed up are read
+        try:
+            return self.redis.xgroup_create(key, group, id='0',
+                                            mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in '{0}'.format(e):
+                raise
+
+    @io_operation
+    def xreadgroup(self, key, group, consumer, acks, count):
+        # the acks go in the same round trip as the read
+        pipeline = self.redis.pipeline(transaction=False)
+        if acks:
+            pipeline.xack(key, group, *acks)
+
+        pipeline.xreadgroup(group, consumer, {key: '>'}, count=count)
+        streams = pipeline.execute()[-1]
+        return streams and self.parse_entries(streams[0][1]) or []
+
+    @io_operation
+    def xautoclaim(self, key, group, consumer, acks, min_idle, count):
+        # XAUTOCLAIM replies with the next cursor, the claimed
+        # entries as flat [id, [field, value, ...]] pairs and, since
+        # redis 7.0, the ids that were deleted meanwhile
+        pipeline = self.redis.pipeline(transaction=False)
+        if acks:
+            pipeline.xack(key, group, *acks)
+
+        pipeline.execute_command('XAUTOCLAIM', key, group, consumer,
+                                 min_idle, '0-0', 'COUNT', count)
+        reply = pipeline.execute()[-1]
+        entries = [(entry[0], dict(zip(entry[1][::2], entry[1][1::2])))
+                   for entry in reply[1] if entry and entry[1]]
+        return self.parse_entries(entries)
+
+    @io_operation
+    def xack(self, key, group, ids):
+        return self.redis.xack(key, group, *ids)
+
+    @io_operation
+    def xlen(self, key):
+        return self.redis.xlen(key)
+
+    def bxreadgroup(self, key, group, consumer, count, timeout=0):
+        # blocking, so not an io_operation, see JSONRedisBackend.blpop
+        block = int(self.get_blocking_timeout(timeout) * 1000)
+        streams = self.redis.xreadgroup(group, consumer, {key: '>'},
+                                        count=count, block=block)
+        return streams and self.parse_entries(streams[0][1]) or []
@@ -0,0 +1,169 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+import json
+import cPickle as pickle
+from abc import ABCMeta, abstractmethod
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# A serialized item that doesn't start with MARKER is plain JSON, what
+# every version of lineup reads and writes. The others start with
+# MARKER and the code of their serializer, so that producers and
+# consumers configured with different serializers still understand
+# each other.
+MARKER = b'\x00'
+
+SERIALIZERS = {}
+CODES = {}
+INSTANCES = {}
+
+
+class Serializer(object):
+    """turns the items of a queue into bytes and back, subclasses
+    implement dumps and loads"""
+    __metaclass__ = ABCMeta
+
+    name = None
+    code = None
+
+    # whether the items of this serializer can be read by any queue.
+    # The others are only read by the queues configured with them, see
+    # decode
+    safe = True
+
+    @abstractmethod
+    def dumps(self, value):
+        """returns the bytes of the value"""
+
+    @abstractmethod
+    def loads(self, data):
+        """returns the value of the bytes"""
+
+    def encode(self, value):
+        return MARKER + self.code + self.dumps(value)
+
+
+class JSONSerializer(Serializer):
+    name = 'json'
+    code = b'j'
+
+    def dumps(self, value):
+        return json.dumps(value, default=bytes)
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def encode(self, value):
+        # unframed, so that older consumers can still read it
+        return self.dumps(value)
+
+
+class PickleSerializer(Serializer):
+    """round-trips any python object, binary strings included. Only
+    use it when every producer is trusted: unpickling runs code."""
+    name = 'pickle'
+    code = b'p'
+    safe = False
+    protocol = pickle.HIGHEST_PROTOCOL
+
+    def dumps(self, value):
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    """compact, fast and keeps binary strings apart from text, it
+    requires the msgpack package"""
+    name = 'msgpack'
+    code = b'm'
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError(
+                'the msgpack serializer requires msgpack, '
+                'run: pip install msgpack')
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+def register_serializer(serializer_class):
+    """makes the serializer available by its name to the queues and
+    the pipelines, and its items readable by every backend"""
+    SERIALIZERS[serializer_class.name] = serializer_class
+    CODES[serializer_class.code] = serializer_class
+    INSTANCES.pop(serializer_class.name, None)
+    return serializer_class
+
+
+def get_serializer(name):
+    if isinstance(name, Serializer):
+        return name
+
+    if name not in SERIALIZERS:
+        msg = 'serializer must be one of {0}, got {1}'
+        raise ValueError(msg.format(', '.join(sorted(SERIALIZERS)), name))
+
+    if name not in INSTANCES:
+        INSTANCES[name] = SERIALIZERS[name]()
+
+    return INSTANCES[name]
+
+
+def is_framed(product):
+    return product[:1] == MARKER
+
+
+def decode(product, serializer=None):
+    """deserializes a framed item, whatever ``safe`` serializer wrote
+    it. The items of the other serializers, like pickle, are only read
+    when ``serializer`` is the one that wrote them: otherwise anyone
+    able to push to a queue could run code in its consumers."""
+    code = product[1:2]
+    if code not in CODES:
+        raise ValueError('unknown serializer code {0!r}'.format(code))
+
+    serializer_class = CODES[code]
+    if not serializer_class.safe and \
+            not isinstance(serializer, serializer_class):
+        msg = 'refusing an item of the {0} serializer, the queue reads {1}'
+        raise ValueError(msg.format(
+            serializer_class.name, serializer and serializer.name or 'json'))
+
+    return get_serializer(serializer_class.name).loads(product[2:])
+
+
+for serializer_class in (JSONSerializer, PickleSerializer, MsgpackSerializer):
+    register_serializer(serializer_class)
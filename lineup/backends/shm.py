@@ -0,0 +1,293 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+import os
+import time
+import mmap
+import struct
+import tempfile
+from threading import Lock, RLock
+
+from lineup.core import LineUpQueueFull
+from lineup.backends.files import FileLock, FileBackend
+
+# the header of a ring: the offsets of its head and tail, which wrap
+# around the data, and how many frames lie between them
+HEADER = struct.Struct(b'<qqq')
+
+# every frame is its length followed by the serialized item
+FRAME = struct.Struct(b'<I')
+
+
+def get_default_directory():
+    # /dev/shm is memory backed on linux, so the rings never hit a disk
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/lineup'
+
+    return os.path.join(tempfile.gettempdir(), 'lineup')
+
+
+class RingBuffer(object):
+    """a fixed size ring of length-prefixed frames in a memory mapped
+    file, that every process mapping the same file shares.
+
+    Each operation takes an exclusive flock on the file, to keep other
+    processes out, and a thread lock, since threads of one process
+    share the flock.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.lock = RLock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.locked():
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, HEADER.size + size)
+
+        total = os.fstat(self.fd).st_size
+        self.capacity = total - HEADER.size
+        self.map = mmap.mmap(self.fd, total)
+
+    def locked(self):
+        return FileLock(self)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def read_header(self):
+        return HEADER.unpack_from(self.map, 0)
+
+    def write_header(self, head, tail, count):
+        HEADER.pack_into(self.map, 0, head, tail, count)
+
+    def read(self, offset, size):
+        position = offset % self.capacity
+        first = min(size, self.capacity - position)
+        start = HEADER.size + position
+        data = self.map[start:start + first]
+        if first < size:
+            data += self.map[HEADER.size:HEADER.size + size - first]
+
+        return data
+
+    def write(self, offset, data):
+        position = offset % self.capacity
+        first = min(len(data), self.capacity - position)
+        start = HEADER.size + position
+        self.map[start:start + first] = data[:first]
+        if first < len(data):
+            rest = len(data) - first
+            self.map[HEADER.size:HEADER.size + rest] = data[first:]
+
+    def frame(self, product):
+        return FRAME.pack(len(product)) + product
+
+    def push(self, products, front=False):
+        """appends the products, or prepends them keeping their order
+        when ``front`` is true. Returns the new length, or -1 when
+        they don't fit, in which case nothing is written."""
+        frames = map(self.frame, products)
+        size = sum(map(len, frames))
+        if size > self.capacity:
+            msg = '{0} bytes can never fit in {1} ({2} bytes)'
+            raise LineUpQueueFull(msg.format(size, self.path,
+                                             self.capacity))
+
+        with self.locked():
+            head, tail, count = self.read_header()
+            if tail - head + size > self.capacity:
+                return -1
+
+            if front:
+                head -= size
+                offset = head
+            else:
+                offset = tail
+                tail += size
+
+            for frame in frames:
+                self.write(offset, frame)
+                offset += len(frame)
+
+            count += len(frames)
+            self.write_header(head, tail, count)
+            return count
+
+    def frames(self, head, tail, limit):
+        offset = head
+        while offset < tail and limit > 0:
+            length, = FRAME.unpack(self.read(offset, FRAME.size))
+            offset += FRAME.size
+            yield offset + length, self.read(offset, length)
+            offset += length
+            limit -= 1
+
+    def pop(self, count):
+        with self.locked():
+            head, tail, length = self.read_header()
+            products = []
+            for head, product in self.frames(head, tail, count):
+                products.append(product)
+
+            if products:
+                self.write_header(head, tail, length - len(products))
+
+            return products
+
+    def peek(self, start, count):
+        with self.locked():
+            head, tail, length = self.read_header()
+            frames = self.frames(head, tail, start + count)
+            return [product for end, product in frames][start:]
+
+    def __len__(self):
+        with self.locked():
+            return self.read_header()[2]
+
+
+class SharedMemoryBackend(FileBackend):
+    """keeps every queue in a ring buffer of shared memory, so the steps
+    of pipelines running in many processes of one host hand items to
+    each other without redis nor sockets.
+
+    The rings live in ``LINEUP_SHM_DIRECTORY`` (``/dev/shm/lineup`` by
+    default) and hold ``ring_size`` bytes of items each. A push into a
+    full ring waits up to ``push_timeout`` seconds for room and then
+    raises :py:class:`lineup.core.LineUpQueueFull`. It covers the list
+    operations of :py:class:`lineup.datastructures.Queue`, including
+    ``maxsize``, but not delayed delivery, reliable, priority, stream
+    or deduplicating queues.
+    """
+    ring_size = 8 * 1024 * 1024
+    push_timeout = 10
+
+    # the step logs (see Step.log) only keep their latest entries, and
+    # drop the oldest ones to make room in a full ring
+    log_length = 1000
+
+    directory_variable = 'LINEUP_SHM_DIRECTORY'
+    list_suffix = '.ring'
+
+    rings = {}
+    rings_lock = Lock()
+
+    def get_default_directory(self):
+        return get_default_directory()
+
+    def get_ring(self, key):
+        # one mapping per ring and process, shared by all the backends
+        path = self.get_path(key, self.list_suffix)
+        with self.rings_lock:
+            if path not in self.rings:
+                self.rings[path] = RingBuffer(path, self.ring_size)
+
+            return self.rings[path]
+
+    # read operations
+    def lpop_many(self, key, count):
+        if count < 1:
+            return []
+
+        return map(self.deserialize, self.get_ring(key).pop(count))
+
+    def llen(self, key):
+        return len(self.get_ring(key))
+
+    def lrange(self, key, start, stop):
+        ring = self.get_ring(key)
+        if stop < 0:
+            stop = len(ring) + stop
+
+        products = ring.peek(start, stop - start + 1)
+        return map(self.deserialize, products)
+
+    # write operations
+    def rpush(self, key, value):
+        return self.rpush_many(key, [value])
+
+    def rpush_many(self, key, values):
+        products = map(self.serialize, values)
+        if key.endswith(':logging'):
+            return self.push_log(key, products)
+
+        return self.push(key, products)
+
+    def lpush(self, key, value):
+        return self.push(key, [self.serialize(value)], front=True)
+
+    def push(self, key, products, front=False):
+        ring = self.get_ring(key)
+        deadline = time.time() + self.push_timeout
+        delay = 0.0001
+        while True:
+            length = ring.push(products, front)
+            if length >= 0:
+                return length
+
+            if time.time() >= deadline:
+                msg = '{0} is full ({1} bytes)'
+                raise LineUpQueueFull(msg.format(key, ring.capacity))
+
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    def push_log(self, key, products):
+        ring = self.get_ring(key)
+        with ring.locked():
+            length = ring.push(products)
+            while length < 0:
+                ring.pop(1)
+                length = ring.push(products)
+
+            if length > self.log_length:
+                ring.pop(length - self.log_length)
+                length = self.log_length
+
+            return length
+
+    def bounded_rpush(self, key, values, maxsize, overflow):
+        # the same rules as lua.BOUNDED_RPUSH, under the lock of the
+        # ring so that other processes can't push in between
+        ring = self.get_ring(key)
+        products = map(self.serialize, values)
+        with ring.locked():
+            length = ring.read_header()[2]
+            if overflow != 'drop-oldest' and \
+                    length + len(values) > maxsize:
+                return -1
+
+            length = ring.push(products)
+            if length < 0:
+                msg = '{0} is full ({1} bytes)'
+                raise LineUpQueueFull(msg.format(key, ring.capacity))
+
+            if length > maxsize:
+                ring.pop(length - maxsize)
+                length = maxsize
+
+            return length
@@ -0,0 +1,356 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+import os
+import json
+import time
+import sqlite3
+from threading import local
+
+from lineup.backends.base import BaseBackend
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_key ON items (key);
+CREATE TABLE IF NOT EXISTS lengths (
+    key TEXT PRIMARY KEY,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS delayed (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    due REAL NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS delayed_key_due ON delayed (key, due);
+CREATE TABLE IF NOT EXISTS "values" (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    key TEXT NOT NULL,
+    member TEXT NOT NULL,
+    PRIMARY KEY (key, member)
+);
+'''
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class Transaction(object):
+    """takes the write lock of the database right away, so that the
+    reads of a pop and its delete can't interleave with another
+    writer, and commits or rolls back on the way out"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, kind, error, traceback):
+        if kind is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')
+
+
+class SQLiteBackend(BaseBackend):
+    """keeps the queues in a SQLite database in WAL mode, so they
+    survive a restart of the host without running redis.
+
+    The items of every queue are rows of a single table, in the order
+    of their rowid: a push inserts after the largest rowid, a
+    ``lpush`` before the smallest one and a pop reads the first rows
+    of the queue through the ``(key, rowid)`` index and deletes them by
+    rowid. Each thread has a connection of its own, the concurrency
+    is left to SQLite instead of the ``io_operation`` lock.
+
+    The database is ``LINEUP_SQLITE_PATH`` (``lineup.db`` by default)
+    and ``LINEUP_SQLITE_SYNCHRONOUS`` picks between ``NORMAL``, which
+    may lose the last transactions when the host loses power, and
+    ``FULL``, which syncs every commit to disk.
+    """
+    synchronous = 'NORMAL'
+
+    # seconds a connection waits for the lock of another writer
+    busy_timeout = 30
+
+    # the blocking pops poll the database, backing off up to this many
+    # seconds between attempts
+    poll_interval = 0.05
+
+    # the step logs (see Step.log) only keep their latest entries
+    log_length = 1000
+
+    def initialize(self, path=None, synchronous=None):
+        self.path = path or os.environ.get('LINEUP_SQLITE_PATH', 'lineup.db')
+        self.synchronous = (
+            synchronous or
+            os.environ.get('LINEUP_SQLITE_SYNCHRONOUS') or
+            self.synchronous
+        ).upper()
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            msg = 'synchronous must be one of {0}, got {1}'
+            raise ValueError(msg.format(', '.join(SYNCHRONOUS_MODES),
+                                        self.synchronous))
+
+        self.connections = local()
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None:
+            # transactions are handled by Transaction
+            connection = sqlite3.connect(self.path, isolation_level=None,
+                                         timeout=self.busy_timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'PRAGMA synchronous={0}'.format(self.synchronous))
+            self.connections.connection = connection
+
+        return connection
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    def serialize(self, value):
+        return json.dumps(value, default=bytes)
+
+    def deserialize(self, value):
+        return value and json.loads(value) or None
+
+    # read operations
+    def get(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM "values" WHERE key = ?', (key,)).fetchone()
+        return row and self.deserialize(row[0]) or None
+
+    def lpop(self, key):
+        items = self.pop(key, 1, 'ASC')
+        return items and items[0] or None
+
+    def rpop(self, key):
+        items = self.pop(key, 1, 'DESC')
+        return items and items[0] or None
+
+    def lpop_many(self, key, count):
+        if count < 1:
+            return []
+
+        return self.pop(key, count, 'ASC')
+
+    def pop(self, key, count, order):
+        with self.transaction() as connection:
+            rows = connection.execute(
+                'SELECT id, value FROM items WHERE key = ? '
+                'ORDER BY id {0} LIMIT ?'.format(order),
+                (key, count)).fetchall()
+            connection.executemany('DELETE FROM items WHERE id = ?',
+                                   [(id,) for id, value in rows])
+            self.resize(connection, key, -len(rows))
+
+        return [self.deserialize(value) for id, value in rows]
+
+    def llen(self, key):
+        return self.get_length(self.connection, key)
+
+    def get_length(self, connection, key):
+        row = connection.execute(
+            'SELECT length FROM lengths WHERE key = ?', (key,)).fetchone()
+        return row and row[0] or 0
+
+    def resize(self, connection, key, delta):
+        # the lengths are kept aside, counting the rows of a queue
+        # gets slower as it grows
+        length = self.get_length(connection, key) + delta
+        connection.execute(
+            'INSERT OR REPLACE INTO lengths (key, length) VALUES (?, ?)',
+            (key, length))
+        return length
+
+    def lrange(self, key, start, stop):
+        if stop < 0:
+            stop = self.llen(key) + stop
+
+        rows = self.connection.execute(
+            'SELECT value FROM items WHERE key = ? '
+            'ORDER BY id LIMIT ? OFFSET ?',
+            (key, max(stop - start + 1, 0), start)).fetchall()
+        return [self.deserialize(value) for value, in rows]
+
+    def has_items(self, key):
+        return self.connection.execute(
+            'SELECT 1 FROM items WHERE key = ? LIMIT 1',
+            (key,)).fetchone() is not None
+
+    def key_type(self, key):
+        if self.has_items(key):
+            return 'list'
+
+        if self.connection.execute(
+                'SELECT 1 FROM "values" WHERE key = ?', (key,)).fetchone():
+            return 'string'
+
+        return 'none'
+
+    # Blocking operations
+    def blpop(self, key, timeout=0):
+        return self.bpop(key, timeout, 'ASC')
+
+    def brpop(self, key, timeout=0):
+        return self.bpop(key, timeout, 'DESC')
+
+    def bpop(self, key, timeout, order):
+        keys = isinstance(key, (list, tuple)) and key or [key]
+        deadline = timeout and timeout > 0 and time.time() + timeout
+        delay = 0.001
+        while True:
+            for key in keys:
+                # a plain read first, polling an empty queue shouldn't
+                # take the write lock
+                items = self.has_items(key) and self.pop(key, 1, order)
+                if items:
+                    return items[0]
+
+            if deadline and time.time() >= deadline:
+                return None
+
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    # Write operations
+    def set(self, key, value):
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO "values" (key, value) VALUES (?, ?)',
+                (key, self.serialize(value)))
+
+        return True
+
+    def rpush(self, key, value):
+        return self.rpush_many(key, [value])
+
+    def rpush_many(self, key, values):
+        # a single transaction for the whole batch
+        with self.transaction() as connection:
+            length = self.insert(connection, key, values)
+            if key.endswith(':logging') and length > self.log_length:
+                length = self.drop_oldest(connection, key,
+                                          length - self.log_length)
+
+            return length
+
+    def insert(self, connection, key, values):
+        connection.executemany(
+            'INSERT INTO items (key, value) VALUES (?, ?)',
+            [(key, self.serialize(value)) for value in values])
+        return self.resize(connection, key, len(values))
+
+    def lpush(self, key, value):
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT INTO items (id, key, value) VALUES ('
+                '(SELECT COALESCE(MIN(id), 1) - 1 FROM items), ?, ?)',
+                (key, self.serialize(value)))
+            return self.resize(connection, key, 1)
+
+    def bounded_rpush(self, key, values, maxsize, overflow):
+        # the same rules as lua.BOUNDED_RPUSH
+        with self.transaction() as connection:
+            length = self.get_length(connection, key)
+            if overflow != 'drop-oldest' and \
+                    length + len(values) > maxsize:
+                return -1
+
+            length = self.insert(connection, key, values)
+            if length > maxsize:
+                length = self.drop_oldest(connection, key, length - maxsize)
+
+            return length
+
+    def drop_oldest(self, connection, key, count):
+        connection.execute(
+            'DELETE FROM items WHERE id IN ('
+            'SELECT id FROM items WHERE key = ? '
+            'ORDER BY id LIMIT ?)', (key, count))
+        return self.resize(connection, key, -count)
+
+    def schedule(self, key, values, due):
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT INTO delayed (key, due, value) VALUES (?, ?, ?)',
+                [(key, due, self.serialize(value)) for value in values])
+
+        return len(values)
+
+    def has_due(self, key, now):
+        return self.connection.execute(
+            'SELECT 1 FROM delayed WHERE key = ? AND due <= ? LIMIT 1',
+            (key, now)).fetchone() is not None
+
+    def promote(self, key, queue, now, limit):
+        # a plain read first, the housekeeper shouldn't take the write
+        # lock when nothing is due
+        if not self.has_due(key, now):
+            return 0
+
+        with self.transaction() as connection:
+            rows = connection.execute(
+                'SELECT id, value FROM delayed WHERE key = ? AND due <= ? '
+                'ORDER BY due, id LIMIT ?', (key, now, limit)).fetchall()
+            connection.executemany('DELETE FROM delayed WHERE id = ?',
+                                   [(id,) for id, value in rows])
+            connection.executemany(
+                'INSERT INTO items (key, value) VALUES (?, ?)',
+                [(queue, value) for id, value in rows])
+            self.resize(connection, queue, len(rows))
+
+        return len(rows)
+
+    # Pipeline operations
+    def report_steps(self, name, consumers, producers):
+        consumers_key = ':'.join([name, 'consumers'])
+        producers_key = ':'.join([name, 'producers'])
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO members (key, member) VALUES (?, ?)',
+                [(consumers_key, member) for member in consumers] +
+                [(producers_key, member) for member in producers])
+
+            def members(key):
+                rows = connection.execute(
+                    'SELECT member FROM members WHERE key = ?', (key,))
+                return set(member for member, in rows)
+
+            return members(consumers_key), members(producers_key)
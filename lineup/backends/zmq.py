@@ -0,0 +1,305 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+import os
+import time
+import uuid
+import errno
+import tempfile
+from threading import local
+
+from lineup.core import LineUpQueueFull
+from lineup.backends.redis import JSONRedisBackend
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+TRANSPORTS = ('ipc', 'tcp')
+
+
+class ZMQBackend(JSONRedisBackend):
+    """hands the items of the queues from step to step over ZeroMQ
+    PUSH/PULL sockets, leaving redis to the control plane: which
+    sockets consume a queue, the step logs, values and reports.
+
+    Every thread that pops from a queue binds a PULL socket of its own
+    and announces it in redis, in the sorted set
+    ``lineup:zmq:<queue>``, and the PUSH sockets of the producers
+    connect to every socket announced in the last ``registry_ttl``
+    seconds, spreading the items round-robin. A PUSH socket only holds
+    ``sndhwm`` items per consumer and a PULL socket ``rcvhwm`` items,
+    past that a push waits up to ``push_timeout`` seconds and then
+    raises :py:class:`lineup.core.LineUpQueueFull`.
+
+    ``LINEUP_ZMQ_TRANSPORT`` picks ``ipc`` (the default, sockets in
+    ``LINEUP_ZMQ_DIRECTORY``) for the processes of one host or ``tcp``
+    (bound to ``LINEUP_ZMQ_HOST``) for many hosts.
+
+    Items in flight live in the memory of the sockets and are lost
+    with the process holding them. Delayed items wait in redis until
+    they are due; bounded, reliable, priority and deduplicating queues
+    are not supported, and the length of a queue is unknown.
+    """
+    transport = 'ipc'
+    sndhwm = 1000
+    rcvhwm = 1000
+    push_timeout = 10
+
+    # the items don't live in redis, so they can't be handed off in
+    # the same script as the acks
+    atomic_handoff = False
+
+    # consumers announce their sockets every refresh_interval seconds,
+    # and producers look for new ones as often
+    refresh_interval = 1
+    registry_ttl = 30
+
+    # the keys that stay in redis: the logs, errors, heartbeats and
+    # counters of the steps (see lineup.steps.KeyMaker), the registry
+    # of the sockets, the delayed items on their way to a queue and
+    # the dead-letter queue, which no step consumes
+    registry_prefix = 'lineup:zmq:'
+    control_suffixes = (':logging', ':alive', ':error', ':stats',
+                        ':delayed', '.dead-letter')
+
+    def initialize(self, uri=None, transport=None):
+        if zmq is None:
+            raise RuntimeError(
+                'ZMQBackend requires pyzmq, run: pip install pyzmq')
+
+        super(ZMQBackend, self).initialize(uri)
+        self.transport = (transport or os.environ.get(
+            'LINEUP_ZMQ_TRANSPORT', self.transport)).lower()
+        if self.transport not in TRANSPORTS:
+            msg = 'transport must be one of {0}, got {1}'
+            raise ValueError(msg.format(', '.join(TRANSPORTS),
+                                        self.transport))
+
+        self.host = os.environ.get('LINEUP_ZMQ_HOST', '127.0.0.1')
+        self.directory = os.environ.get(
+            'LINEUP_ZMQ_DIRECTORY',
+            os.path.join(tempfile.gettempdir(), 'lineup-zmq'))
+        self.context = zmq.Context.instance()
+
+        # zmq sockets must not be shared between threads
+        self.sockets = local()
+
+    def is_control(self, key):
+        return (key.startswith(self.registry_prefix) or
+                key.endswith(self.control_suffixes))
+
+    def get_registry_key(self, key):
+        return self.registry_prefix + key
+
+    def get_sockets(self):
+        if not hasattr(self.sockets, 'pullers'):
+            self.sockets.pullers = {}
+            self.sockets.pushers = {}
+
+        return self.sockets
+
+    def bind(self, socket):
+        if self.transport == 'tcp':
+            port = socket.bind_to_random_port('tcp://' + self.host)
+            return 'tcp://{0}:{1}'.format(self.host, port)
+
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        name = '{0}.sock'.format(uuid.uuid4().hex)
+        endpoint = 'ipc://' + os.path.join(self.directory, name)
+        socket.bind(endpoint)
+        return endpoint
+
+    def get_puller(self, key):
+        pullers = self.get_sockets().pullers
+        if key not in pullers:
+            socket = self.context.socket(zmq.PULL)
+            socket.setsockopt(zmq.RCVHWM, self.rcvhwm)
+            socket.setsockopt(zmq.LINGER, 0)
+            pullers[key] = [socket, self.bind(socket), 0]
+
+        puller = pullers[key]
+        now = time.time()
+        if now - puller[2] >= self.refresh_interval:
+            self.redis.execute_command(
+                'ZADD', self.get_registry_key(key), now, puller[1])
+            puller[2] = now
+
+        return puller[0]
+
+    def get_pusher(self, key, refresh=False):
+        pushers = self.get_sockets().pushers
+        if key not in pushers:
+            socket = self.context.socket(zmq.PUSH)
+            socket.setsockopt(zmq.SNDHWM, self.sndhwm)
+            # only hands items to the consumers actually connected
+            socket.setsockopt(zmq.IMMEDIATE, 1)
+            pushers[key] = [socket, set(), 0]
+
+        socket, endpoints, refreshed_at = pushers[key]
+        now = time.time()
+        if refresh or now - refreshed_at >= self.refresh_interval:
+            announced = set(self.redis.zrangebyscore(
+                self.get_registry_key(key), now - self.registry_ttl, '+inf'))
+            for endpoint in announced - endpoints:
+                socket.connect(endpoint)
+
+            for endpoint in endpoints - announced:
+                socket.disconnect(endpoint)
+
+            pushers[key][1:] = [announced, now]
+
+        return socket
+
+    def close(self):
+        """closes the sockets of the calling thread, withdrawing its
+        consumers from the registry"""
+        sockets = self.get_sockets()
+        for key, (socket, endpoint, announced_at) in sockets.pullers.items():
+            self.redis.zrem(self.get_registry_key(key), endpoint)
+            socket.close()
+
+        for socket, endpoints, refreshed_at in sockets.pushers.values():
+            socket.close()
+
+        sockets.pullers.clear()
+        sockets.pushers.clear()
+
+    # read operations
+    def lpop(self, key):
+        items = self.lpop_many(key, 1)
+        return items and items[0] or None
+
+    def lpop_many(self, key, count):
+        if self.is_control(key):
+            return super(ZMQBackend, self).lpop_many(key, count)
+
+        socket = self.get_puller(key)
+        items = []
+        while len(items) < count:
+            try:
+                product = socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            items.append(self.deserialize(product))
+
+        return items
+
+    def llen(self, key):
+        if self.is_control(key):
+            return super(ZMQBackend, self).llen(key)
+
+        # the items are spread over the sockets of every process
+        return 0
+
+    def lrange(self, key, start, stop):
+        if self.is_control(key):
+            return super(ZMQBackend, self).lrange(key, start, stop)
+
+        return []
+
+    # Blocking operations
+    def blpop(self, key, timeout=0):
+        keys = isinstance(key, (list, tuple)) and key or [key]
+        if all(map(self.is_control, keys)):
+            return super(ZMQBackend, self).blpop(key, timeout)
+
+        deadline = timeout and timeout > 0 and time.time() + timeout
+        while True:
+            poller = zmq.Poller()
+            for key in keys:
+                poller.register(self.get_puller(key), zmq.POLLIN)
+
+            # wakes up every refresh_interval to keep announcing the
+            # sockets, even when blocking forever
+            block = self.refresh_interval
+            if deadline:
+                block = min(block, deadline - time.time())
+
+            for socket, event in poller.poll(max(block, 0) * 1000):
+                return self.deserialize(socket.recv(zmq.NOBLOCK))
+
+            if deadline and time.time() >= deadline:
+                return None
+
+    # Write operations
+    def rpush(self, key, value):
+        return self.rpush_many(key, [value])
+
+    def rpush_many(self, key, values):
+        if self.is_control(key):
+            return super(ZMQBackend, self).rpush_many(key, values)
+
+        socket = self.get_pusher(key)
+        deadline = time.time() + self.push_timeout
+        for product in map(self.serialize, values):
+            while True:
+                try:
+                    socket.send(product, zmq.NOBLOCK)
+                    break
+                except zmq.Again:
+                    # every consumer is full, or there is none yet
+                    if time.time() >= deadline:
+                        msg = 'no consumer of {0} took an item in {1}s'
+                        raise LineUpQueueFull(
+                            msg.format(key, self.push_timeout))
+
+                    time.sleep(0.001)
+                    socket = self.get_pusher(key)
+
+        return len(values)
+
+    def lpush(self, key, value):
+        if self.is_control(key):
+            return super(ZMQBackend, self).lpush(key, value)
+
+        # a channel has no front, the item goes to any consumer
+        return self.rpush_many(key, [value])
+
+    def promote(self, key, queue, now, limit):
+        # the due items go through a redis list, then down the channel.
+        # They only leave the list once sent, so the ones that a full
+        # channel refused are sent again by the next promote
+        staging = ':'.join([queue, 'due'])
+        moved = super(ZMQBackend, self).promote(key, staging, now, limit)
+        values = super(ZMQBackend, self).lrange(staging, 0, -1)
+        sent = 0
+        try:
+            for value in values:
+                self.rpush_many(queue, [value])
+                sent += 1
+        finally:
+            if sent:
+                self.redis.ltrim(staging, sent, -1)
+
+        return moved
@@ -33,6 +33,33 @@ class LineUpKeyError(KeyError):
     pass
 
 
+class LineUpQueueFull(Exception):
+    pass
+
+
+class BlobReference(dict):
+    """stands for a large payload field that the backend moved to a
+    blob store. It serializes as the reference itself, so passing it
+    along to the next step never copies the blob, and the blob is only
+    fetched by :py:meth:`resolve`, at most once."""
+
+    key = '__lineup__blob__'
+
+    def __init__(self, reference, resolver=None):
+        super(BlobReference, self).__init__(reference)
+        self.resolver = resolver
+
+    @classmethod
+    def is_reference(cls, value):
+        return isinstance(value, dict) and cls.key in value
+
+    def resolve(self):
+        if not hasattr(self, 'value'):
+            self.value = self.resolver(self[self.key])
+
+        return self.value
+
+
 class LineUpPayloadDict(dict):
     # # TODO
     # def get(self, key, fallback=None):
@@ -41,11 +68,22 @@ class LineUpPayloadDict(dict):
     #         value = LineUpPayloadDict(value)
     #     return value
 
+    def get(self, key, fallback=None):
+        if key in self:
+            return self[key]
+
+        return fallback
+
     def __getitem__(self, key, *args):
         try:
             value = super(LineUpPayloadDict, self).__getitem__(key, *args)
-            return value
         except KeyError:
             msg = ("expected key {1} to be present "
                    "in the payload {0}".format(self, key))
             raise LineUpKeyError(msg)
+
+        # fields kept in a blob store are fetched once they're read
+        if isinstance(value, BlobReference):
+            return value.resolve()
+
+        return value
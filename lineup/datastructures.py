@@ -25,16 +25,217 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 from __future__ import unicode_literals
+import os
+import json
+import time
+import zlib
+import hashlib
+import socket
+import logging
+import itertools
+from collections import deque
+from threading import Thread, Event, Lock, Condition, local, current_thread
+
+from lineup.core import LineUpQueueFull
+from lineup.backends.serializers import get_serializer
+from lineup.backends.compression import make_compression
+
+OVERFLOW_POLICIES = ('block', 'reject', 'drop-oldest')
+DEDUP_FILTERS = ('set', 'bloom')
+
+logger = logging.getLogger('lineup.datastructures')
+
+
+class Consumer(object):
+    """the bookkeeping of one consumer of a reliable queue: its
+    processing list and how many of its items were already acked
+    locally but not yet in redis."""
+
+    def __init__(self, queue, name):
+        self.name = name
+        self.processing = ':'.join([queue.name, 'processing', name])
+        self.pending_acks = 0
+        self.lock = Lock()
+
+    def ack(self, count=1):
+        with self.lock:
+            self.pending_acks += count
+
+    def take_acks(self):
+        with self.lock:
+            acks, self.pending_acks = self.pending_acks, 0
+
+        return acks
+
+
+class StreamConsumer(Consumer):
+    """the consumer of a :py:class:`StreamQueue`, it remembers the ids
+    of the entries it was delivered until they are acked"""
+
+    def __init__(self, queue, name):
+        super(StreamConsumer, self).__init__(queue, name)
+        self.delivered = deque()
+        self.next_claim = 0
+
+    def deliver(self, entries):
+        with self.lock:
+            self.delivered.extend(id for id, payload in entries)
+
+        return [payload for id, payload in entries]
+
+    def take_acks(self):
+        with self.lock:
+            count = min(self.pending_acks, len(self.delivered))
+            self.pending_acks = 0
+            return [self.delivered.popleft() for index in range(count)]
+
+
+class Prefetcher(Thread):
+    """a daemon thread that keeps a small local buffer of items taken
+    from a queue ahead of time on behalf of one worker thread, see
+    :py:meth:`Queue.start_prefetch`.
+
+    The buffer is refilled in batches whenever it drops to half of
+    ``depth``. Given the :py:class:`Consumer` of the worker the items
+    are taken reliably, into its processing list, so that the acks of
+    the worker keep working as usual.
+    """
+
+    # how long a blocking fetch lasts, so that stop isn't held back
+    poll_interval = 1
+
+    def __init__(self, queue, depth, consumer=None):
+        super(Prefetcher, self).__init__()
+        self.daemon = True
+        self.queue = queue
+        self.depth = depth
+        self.consumer = consumer
+        self.buffer = deque()
+        self.condition = Condition()
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.condition:
+                while len(self.buffer) > self.depth // 2:
+                    if self.stopped.is_set():
+                        return
+
+                    self.condition.wait(self.poll_interval)
+
+                room = self.depth - len(self.buffer)
+
+            items = self.fetch(room)
+            with self.condition:
+                self.buffer.extend(items)
+                self.condition.notify_all()
+
+    def fetch(self, count):
+        try:
+            if self.consumer:
+                return self.queue.get_reliable(
+                    self.consumer, count, True, self.poll_interval)
+
+            return self.queue.get_many(
+                count, wait=True, timeout=self.poll_interval)
+
+        except Exception:
+            logger.exception("prefetching from %s failed", self.queue)
+            self.stopped.wait(self.poll_interval)
+            return []
+
+    def get_many(self, count, wait=False, timeout=None):
+        """takes up to ``count`` items from the buffer, when ``wait``
+        is true and the buffer is empty it waits for the next batch,
+        the same way :py:meth:`Queue.get_many` would"""
+        if timeout is None:
+            timeout = self.queue.timeout
+
+        deadline = timeout > 0 and time.time() + timeout or None
+        with self.condition:
+            while wait and not self.buffer:
+                block = self.poll_interval
+                if deadline:
+                    block = deadline - time.time()
+                    if block <= 0:
+                        break
+
+                self.condition.wait(block)
+
+            count = min(count, len(self.buffer))
+            items = [self.buffer.popleft() for index in range(count)]
+            self.condition.notify_all()
+
+        return items
+
+    def stop(self):
+        """stops refilling the buffer and returns the items left in it"""
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+
+        if self.is_alive():
+            self.join()
+
+        with self.condition:
+            items = list(self.buffer)
+            self.buffer.clear()
+
+        return items
 
 
 class Queue(object):
     prefix = 'lineup'
+    consumer_class = Consumer
+
+    # the size of the bloom filters of dedup_filter='bloom', in bits,
+    # and how many bits each idempotency key sets. 8M bits (1MB) hold
+    # ~800k keys per window with a false positive rate of ~1%
+    bloom_bits = 2 ** 23
+    bloom_hashes = 7
+
+    # whether the steps may hand the items of the queue off atomically,
+    # see hand_off. The queues that don't keep their items in a plain
+    # redis list opt out
+    atomic_handoff = True
+
+    # the Housekeeper that promotes the delayed items of the queue, it
+    # is woken up by the first item scheduled
+    housekeeper = None
+
+    def __init__(self, name, backend_class, maxsize=None, timeout=-1,
+                 overflow='block', reliable=False, visibility_timeout=300,
+                 dedup=None, dedup_ttl=3600, dedup_filter='set',
+                 serializer=None, compression=None):
+        if overflow not in OVERFLOW_POLICIES:
+            msg = 'overflow must be one of {0}, got {1}'
+            raise ValueError(msg.format(', '.join(OVERFLOW_POLICIES),
+                                        overflow))
+
+        if dedup_filter not in DEDUP_FILTERS:
+            msg = 'dedup_filter must be one of {0}, got {1}'
+            raise ValueError(msg.format(', '.join(DEDUP_FILTERS),
+                                        dedup_filter))
+
+        if dedup and maxsize:
+            raise ValueError('a deduplicating queue cannot be bounded')
 
-    def __init__(self, name, backend_class, maxsize=None, timeout=-1):
         self.name = ':'.join([self.prefix, name])
+        self.delayed = ':'.join([self.name, 'delayed'])
         self.maxsize = maxsize
         self.timeout = timeout
-        self.backend = backend_class()
+        self.overflow = overflow
+        self.reliable = reliable
+        self.visibility_timeout = visibility_timeout
+        self.leases = ':'.join([self.name, 'leases'])
+        self.dedup = dedup
+        self.dedup_ttl = dedup_ttl
+        self.dedup_filter = dedup_filter
+        self.seen = ':'.join([self.name, 'seen'])
+        self.local = local()
+        self.serializer = serializer and get_serializer(serializer)
+        self.compression = make_compression(compression)
+        self.backend = self.make_backend(backend_class)
         self.producers = set()
         self.consumers = set()
 
@@ -42,6 +243,31 @@ class Queue(object):
         return b'<lineup.Queue({0}, backend={1})>'.format(
             self.name, self.backend)
 
+    def make_backend(self, backend_class, *args):
+        # a queue may write its items with a serializer of its own,
+        # see lineup.backends.serializers
+        backend = backend_class(*args)
+        if self.serializer is not None:
+            backend.serializer = self.serializer
+
+        # and compress them, see lineup.backends.compression
+        if self.compression is not None:
+            backend.compression = self.compression
+
+        return backend
+
+    def flush(self):
+        """sends the writes that the backend of the queue holds back,
+        see lineup.backends.coalescer"""
+        flush = getattr(self.backend, 'flush', None)
+        if flush:
+            flush()
+
+    def get_compression_stats(self):
+        """how much the compression of the queue saved so far and how
+        long it took, None when the queue isn't compressed"""
+        return self.compression and self.compression.get_stats()
+
     def adopt_producer(self, producer):
         self.producers.add(producer.id)
         return self.report()
@@ -54,15 +280,852 @@ class Queue(object):
         self.consumers.add(consumer.id)
         return self.report()
 
-    def put(self, payload):
+    def put(self, payload, timeout=None, delay=None, eta=None):
+        """pushes an item to the tail of the queue.
+
+        Given a ``delay`` in seconds or an ``eta`` timestamp the item
+        is parked in redis instead, and only enters the queue once it
+        is due (see :py:meth:`promote`).
+
+        A queue created with ``dedup`` drops the items it already saw
+        within ``dedup_ttl`` seconds, see :py:meth:`put_unique`.
+        """
+        if self.dedup:
+            return self.put_unique([payload], delay, eta)
+
+        if delay is not None or eta is not None:
+            return self.schedule([payload], delay, eta)
+
+        if self.maxsize:
+            return self.put_bounded([payload], timeout)
+
         self.backend.rpush(self.name, payload)
 
-    def get(self, wait=False):
-        done = self.backend.lpop(self.name)
-        while wait and done is None:
-            done = self.backend.lpop(self.name)
+    def put_many(self, payloads, timeout=None, delay=None, eta=None):
+        """pushes all the given payloads in a single round trip"""
+        payloads = list(payloads)
+        if payloads and self.dedup:
+            return self.put_unique(payloads, delay, eta)
+
+        if payloads and (delay is not None or eta is not None):
+            return self.schedule(payloads, delay, eta)
+
+        if payloads and self.maxsize:
+            return self.put_bounded(payloads, timeout)
+
+        if payloads:
+            self.backend.rpush_many(self.name, payloads)
+
+    def get_idempotency_key(self, payload):
+        """the key that tells repeated payloads apart. ``dedup`` is the
+        name of a field of the payload, a callable that takes the
+        payload and returns its key, or ``True`` to use the whole
+        payload."""
+        if self.dedup is True:
+            key = json.dumps(payload, sort_keys=True, default=bytes)
+        elif callable(self.dedup):
+            key = self.dedup(payload)
+        else:
+            key = payload[self.dedup]
+
+        return '{0}'.format(key).encode('utf-8')
+
+    def put_unique(self, payloads, delay=None, eta=None):
+        """pushes the payloads whose idempotency key wasn't seen within
+        the last ``dedup_ttl`` seconds, returns how many were pushed.
+
+        The check happens in redis along with the push, in the same
+        round trip. With ``dedup_filter='set'`` every key leaves a
+        marker that expires after ``dedup_ttl``. With ``'bloom'`` the
+        keys go to a fixed size bloom filter per ``dedup_ttl`` window
+        instead, which costs far less memory but drops a small share
+        of new items as false positives, and remembers keys for
+        between one and two windows.
+        """
+        if delay is not None and eta is None:
+            eta = time.time() + delay
+
+        key = eta is None and self.name or self.delayed
+        ids = map(self.get_idempotency_key, payloads)
+        if eta is not None:
+            self.wake_housekeeper()
+
+        if self.dedup_filter == 'bloom':
+            window = int(time.time() // self.dedup_ttl)
+            filters = [':'.join([self.seen, str(window - age)])
+                       for age in (0, 1)]
+            return self.backend.bloom_push(
+                key, filters, ids, payloads, self.dedup_ttl * 2,
+                self.bloom_bits, self.bloom_hashes, eta)
+
+        markers = [':'.join([self.seen, hashlib.sha1(id).hexdigest()])
+                   for id in ids]
+        return self.backend.dedup_push(
+            key, markers, payloads, self.dedup_ttl, eta)
+
+    def put_bounded(self, payloads, timeout=None, **kw):
+        """pushes the payloads only if they fit within ``maxsize``,
+        the check and the push happen atomically in redis.
+
+        What happens when they don't fit depends on the ``overflow``
+        policy of the queue:
+
+        * ``block`` waits for consumers to make room, for up to
+          ``timeout`` seconds (the queue timeout by default) overall.
+          Batches larger than ``maxsize`` go in chunks of ``maxsize``
+          items, each waiting for room
+        * ``reject`` raises :py:class:`LineUpQueueFull` right away
+        * ``drop-oldest`` pushes anyway and discards the items at the
+          head of the queue
+        """
+        if self.maxsize and len(payloads) > self.maxsize and \
+                self.overflow == 'reject':
+            msg = '{0} items can never fit in {1} (maxsize={2})'
+            raise LineUpQueueFull(msg.format(
+                len(payloads), self.name, self.maxsize))
+
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = timeout > 0 and time.time() + timeout or None
+        chunk = self.overflow == 'block' and self.maxsize or len(payloads)
+        for start in range(0, len(payloads), chunk):
+            size = self.push_bounded(
+                payloads[start:start + chunk], deadline, **kw)
+
+        return size
+
+    def push_bounded(self, payloads, deadline, **kw):
+        delay = 0.001
+        while True:
+            size = self.try_push(payloads, **kw)
+            if size >= 0:
+                return size
+
+            if self.overflow == 'reject' or (
+                    deadline and time.time() >= deadline):
+                msg = '{0} is full (maxsize={1})'
+                raise LineUpQueueFull(msg.format(self.name, self.maxsize))
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def schedule(self, payloads, delay=None, eta=None):
+        """parks the payloads in a sorted set scored by their due time,
+        they don't hold any worker while they wait"""
+        if eta is None:
+            eta = time.time() + delay
+
+        self.wake_housekeeper()
+        return self.backend.schedule(self.delayed, payloads, eta)
+
+    def wake_housekeeper(self):
+        if self.housekeeper is not None:
+            self.housekeeper.wake()
+
+    def promote(self, limit=1000):
+        """moves the delayed items that are due into the queue, in
+        batches of ``limit`` items per round trip. Returns how many
+        were moved."""
+        total = 0
+        while True:
+            moved = self.backend.promote(
+                self.delayed, self.name, time.time(), limit)
+            total += moved
+            if moved < limit:
+                return total
+
+    def try_push(self, payloads):
+        """pushes the payloads if they fit, returns the new size of the
+        queue or -1 when they don't"""
+        return self.backend.bounded_rpush(
+            self.name, payloads, self.maxsize, self.overflow)
+
+    def put_back(self, payload):
+        """returns a payload that was just taken to the head of the
+        queue, it doesn't count against ``maxsize`` since it was
+        already in the queue."""
+        self.backend.lpush(self.name, payload)
+
+    def put_back_many(self, payloads):
+        """returns many payloads to the head of the queue, keeping
+        their order"""
+        for payload in reversed(payloads):
+            self.put_back(payload)
+
+    def retry(self, payload, delay):
+        """puts a payload that failed back in the queue, to be consumed
+        again in ``delay`` seconds. Unlike :py:meth:`put` it neither
+        counts against ``maxsize`` nor goes through ``dedup``.
+
+        Backends without delayed delivery, like the shared memory and
+        the log backends, retry it right away, behind the others."""
+        if not hasattr(self.backend, 'schedule'):
+            return self.backend.rpush(self.name, payload)
+
+        return self.schedule([payload], delay)
+
+    def wait_for_room(self, timeout=None):
+        """blocks until a bounded queue has room for one more item,
+        returns whether it does.
+
+        Steps call it before taking work from their own queue, so
+        that a slow consumer makes every step upstream slow down
+        instead of piling items up in redis.
+        """
+        if not self.maxsize or self.overflow == 'drop-oldest':
+            return True
+
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = timeout > 0 and time.time() + timeout or None
+        delay = 0.001
+        while self.get_size() >= self.maxsize:
+            if deadline and time.time() >= deadline:
+                return False
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+        return True
+
+    def get(self, wait=False, timeout=None):
+        """pops the next item from the queue.
+
+        When ``wait`` is true it blocks in redis (BLPOP) until an item
+        arrives or ``timeout`` seconds elapse, in which case it returns
+        ``None``. The timeout defaults to the one given to the queue,
+        where a negative value means wait forever.
+        """
+        if self.reliable or self.get_prefetcher():
+            items = self.get_many(1, wait, timeout)
+            return items and items[0] or None
+
+        if not wait:
+            return self.backend.lpop(self.name)
+
+        if timeout is None:
+            timeout = self.timeout
+
+        return self.backend.blpop(self.name, timeout=timeout)
+
+    def get_many(self, count, wait=False, timeout=None):
+        """pops up to ``count`` items in a single round trip.
+
+        When the queue is empty and ``wait`` is true it blocks like
+        :py:meth:`get` for the first item and then takes whatever
+        else is available, up to ``count``.
+        """
+        prefetcher = self.get_prefetcher()
+        if prefetcher:
+            return prefetcher.get_many(count, wait, timeout)
+
+        if self.reliable:
+            return self.get_reliable(
+                self.get_consumer(), count, wait, timeout)
+
+        items = self.backend.lpop_many(self.name, count)
+        if items or not wait:
+            return items
+
+        first = self.get(wait=True, timeout=timeout)
+        if first is None:
+            return []
+
+        return [first] + self.backend.lpop_many(self.name, count - 1)
+
+    def get_consumer(self):
+        """returns the :py:class:`Consumer` of the current thread"""
+        consumer = getattr(self.local, 'consumer', None)
+        if consumer is None:
+            name = '|'.join([
+                socket.gethostname(),
+                str(os.getpid()),
+                str(current_thread().ident),
+            ])
+            consumer = self.local.consumer = self.consumer_class(self, name)
+
+        return consumer
+
+    def get_prefetcher(self):
+        """returns the :py:class:`Prefetcher` of the current thread, if
+        it turned prefetching on"""
+        return getattr(self.local, 'prefetcher', None)
+
+    def start_prefetch(self, depth):
+        """turns prefetching on for the current thread: from now on its
+        calls to :py:meth:`get` and :py:meth:`get_many` are served from
+        a local buffer of up to ``depth`` items, which a background
+        thread refills in batches.
+
+        Call :py:meth:`stop_prefetch` from the same thread when done,
+        so that the buffered items aren't lost.
+        """
+        self.stop_prefetch()
+        consumer = self.reliable and self.get_consumer() or None
+        prefetcher = Prefetcher(self, depth, consumer)
+        self.local.prefetcher = prefetcher
+        prefetcher.start()
+        return prefetcher
+
+    def stop_prefetch(self):
+        """turns prefetching off for the current thread and gives the
+        buffered items back: they return to the head of the queue or,
+        when reliable, to whichever consumer reclaims them first."""
+        prefetcher = self.get_prefetcher()
+        if prefetcher is None:
+            return
+
+        self.local.prefetcher = None
+        items = prefetcher.stop()
+        if not items:
+            return
+
+        if self.reliable:
+            self.release(prefetcher.consumer)
+        else:
+            self.put_back_many(items)
+
+    def release(self, consumer):
+        """sends the pending acks of the consumer and hands whatever is
+        left in its processing list back to the queue, by expiring its
+        lease and reclaiming it right away"""
+        self.backend.reliable_pop(
+            self.name, consumer.processing, self.leases,
+            consumer.take_acks(), 0, 0)
+        return self.reclaim()
+
+    def get_reliable(self, consumer, count, wait=False, timeout=None):
+        """moves up to ``count`` items into the processing list of the
+        consumer, where they stay until acked.
 
-        return done
+        Acks are piggybacked: the items the consumer acked since its
+        last call are trimmed off its processing list by the same
+        script that moves the next ones in.
+        """
+        lease = time.time() + self.visibility_timeout
+        items = self.backend.reliable_pop(
+            self.name, consumer.processing, self.leases,
+            consumer.take_acks(), count, lease)
+
+        if items or not wait:
+            return items
+
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = timeout > 0 and time.time() + timeout or None
+        while True:
+            # block for at most one visibility timeout at a time, so
+            # the lease renewed before blocking is never stale
+            block = self.visibility_timeout
+            if deadline:
+                block = min(block, deadline - time.time())
+                if block <= 0:
+                    return []
+
+            lease = time.time() + block + self.visibility_timeout
+            item = self.backend.reliable_bpop(
+                self.name, consumer.processing, self.leases, block, lease)
+
+            if item is not None:
+                return [item]
+
+    def ack(self, count=1):
+        """marks the oldest ``count`` items taken by the current thread
+        as done. It costs no round trip: the ack reaches redis along
+        with the next :py:meth:`get` or :py:meth:`flush_acks`."""
+        if self.reliable:
+            self.get_consumer().ack(count)
+
+    def flush_acks(self):
+        """sends the pending acks of the current thread to redis"""
+        if not self.reliable:
+            return
+
+        consumer = self.get_consumer()
+        acks = consumer.take_acks()
+        if acks:
+            lease = time.time() + self.visibility_timeout
+            self.backend.reliable_pop(
+                self.name, consumer.processing, self.leases, acks, 0, lease)
+
+    def can_hand_off(self, queue, backend):
+        """whether a step consuming this queue can produce to
+        ``queue`` and log to ``backend`` through :py:meth:`hand_off`:
+        both queues must be plain lists and everything must live in
+        the same redis server.
+
+        With write-behind (see ``JSONRedisBackend.linger``) only the
+        reliable queues hand off, so that their items never leave the
+        processing list before their outputs are in redis. The others
+        leave their pushes and logs to the write coalescer."""
+        backends = [self.backend, queue.backend, backend]
+        lingering = any(getattr(b, 'coalescer', None) is not None
+                        for b in backends)
+        return (self.atomic_handoff and queue.atomic_handoff and
+                not queue.maxsize and not queue.dedup and
+                (self.reliable or not lingering) and
+                all(getattr(b, 'atomic_handoff', False) for b in backends) and
+                len(set(b.uri for b in backends)) == 1)
+
+    def hand_off(self, queue, payloads, log_key, records, stats_key,
+                 counters):
+        """acks the items the current thread is done with, pushes
+        ``payloads`` to ``queue``, appends the already serialized
+        ``records`` to the list ``log_key`` and increments the
+        ``counters`` of the hash ``stats_key``, atomically and in a
+        single round trip. On a reliable queue an item is thus either
+        still in the processing list or its outputs are downstream."""
+        consumer = self.reliable and self.get_consumer() or None
+        acks = consumer and consumer.take_acks() or 0
+        processing = consumer and consumer.processing or self.name
+        lease = time.time() + self.visibility_timeout
+        products = map(queue.backend.serialize, payloads)
+        return self.backend.hand_off(
+            processing, self.leases, acks, lease, queue.name, products,
+            log_key, records, stats_key, counters)
+
+    def reclaim(self, limit=100):
+        """puts the items of consumers whose lease expired back at the
+        head of the queue. Only the expired leases are looked at, at
+        most ``limit`` of them per call."""
+        return self.backend.reclaim(self.name, self.leases, time.time(), limit)
+
+    def housekeeping(self):
+        """the periodic maintenance of the queue, see
+        :py:class:`Housekeeper`: promotes due items and, when
+        reliable, reclaims the items of dead consumers"""
+        self.promote()
+        if self.reliable:
+            self.reclaim()
 
     def get_size(self):
         return self.backend.llen(self.name)
+
+
+class PriorityQueue(Queue):
+    """a queue that hands out the items with the lowest ``priority``
+    first, and in FIFO order among items of the same priority.
+
+    It is backed by a redis sorted set (so it needs redis >= 5.0) and
+    takes the same arguments as :py:class:`Queue`, except that it
+    can't be ``reliable`` nor use ``dedup``. Priorities must be
+    integers between -2**20 and 2**20, and delayed delivery isn't
+    supported. A pipeline stage uses it when its step declares
+    ``consume_queue_class = PriorityQueue``.
+    """
+    default_priority = 0
+    atomic_handoff = False
+
+    # items given back by a step go ahead of everything else
+    head_priority = -2 ** 20
+
+    def __init__(self, *args, **kw):
+        super(PriorityQueue, self).__init__(*args, **kw)
+        if self.reliable or self.dedup:
+            msg = '{0} cannot be reliable nor deduplicating'
+            raise ValueError(msg.format(self.name))
+
+        self.sequence = ':'.join([self.name, 'sequence'])
+
+    def put(self, payload, timeout=None, priority=None):
+        return self.put_bounded([payload], timeout, priority=priority)
+
+    def put_many(self, payloads, timeout=None, priority=None):
+        payloads = list(payloads)
+        if payloads:
+            return self.put_bounded(payloads, timeout, priority=priority)
+
+    def housekeeping(self):
+        # delayed delivery is for list queues only
+        pass
+
+    def try_push(self, payloads, priority=None):
+        if priority is None:
+            priority = self.default_priority
+
+        return self.backend.zpush(self.name, self.sequence, payloads,
+                                  priority, self.maxsize, self.overflow)
+
+    def put_back(self, payload):
+        self.put_back_many([payload])
+
+    def put_back_many(self, payloads):
+        # the payloads were already in the queue, so like in
+        # Queue.put_back they don't count against maxsize
+        self.backend.zpush(self.name, self.sequence, payloads,
+                           self.head_priority, None, self.overflow)
+
+    def retry(self, payload, delay):
+        # without delayed delivery the payload is retried right away,
+        # behind the items of the same priority
+        return self.put(payload)
+
+    def get(self, wait=False, timeout=None):
+        if self.get_prefetcher():
+            items = self.get_many(1, wait, timeout)
+            return items and items[0] or None
+
+        if not wait:
+            items = self.backend.zpopmin(self.name, 1)
+            return items and items[0] or None
+
+        if timeout is None:
+            timeout = self.timeout
+
+        return self.backend.bzpopmin(self.name, timeout=timeout)
+
+    def get_many(self, count, wait=False, timeout=None):
+        prefetcher = self.get_prefetcher()
+        if prefetcher:
+            return prefetcher.get_many(count, wait, timeout)
+
+        items = self.backend.zpopmin(self.name, count)
+        if items or not wait:
+            return items
+
+        first = self.get(wait=True, timeout=timeout)
+        if first is None:
+            return []
+
+        return [first] + self.backend.zpopmin(self.name, count - 1)
+
+    def get_size(self):
+        return self.backend.zcard(self.name)
+
+
+class ShardedQueue(Queue):
+    """one logical queue split over ``shards`` redis lists that are
+    spread round-robin over many redis servers.
+
+    The servers come from ``uris`` or from the comma separated
+    ``LINEUP_REDIS_SHARDS`` environment variable, and each one gets a
+    backend built with ``backend_class(uri)``. By default there is one
+    shard per server.
+
+    Puts go round-robin over the shards, unless ``partition`` is given:
+    a callable that takes a payload and returns a key, payloads with
+    the same key always land in the same shard.
+
+    Consumers try every shard, starting from a different one on each
+    call, and when all are empty they block on all the shards of one
+    server at a time, for ``block_slice`` seconds at most. Redis older
+    than 6.0 blocks for a whole second instead.
+    It can't be ``reliable``, bounded by ``maxsize`` nor use ``dedup``.
+    """
+    atomic_handoff = False
+    block_slice = 0.1
+
+    def __init__(self, name, backend_class, shards=None, uris=None,
+                 partition=None, **kw):
+        super(ShardedQueue, self).__init__(name, backend_class, **kw)
+        if self.reliable or self.maxsize or self.dedup:
+            msg = '{0} cannot be reliable, bounded nor deduplicating'
+            raise ValueError(msg.format(self.name))
+
+        if uris is None:
+            uris = filter(None, os.environ.get(
+                'LINEUP_REDIS_SHARDS', '').split(','))
+
+        self.servers = [self.make_backend(backend_class, uri)
+                        for uri in uris or [None]]
+        self.shards = []
+        for index in range(shards or len(self.servers)):
+            key = ':'.join([self.name, 'shard', str(index)])
+            server = self.servers[index % len(self.servers)]
+            self.shards.append((key, server))
+
+        self.partition = partition
+        self.counter = itertools.count()
+
+    def get_shard(self, payload):
+        if self.partition:
+            key = '{0}'.format(self.partition(payload)).encode('utf-8')
+            index = zlib.crc32(key) & 0xffffffff
+        else:
+            index = next(self.counter)
+
+        return self.shards[index % len(self.shards)]
+
+    def group_by_shard(self, payloads):
+        groups = {}
+        for payload in payloads:
+            shard = self.get_shard(payload)
+            groups.setdefault(shard, []).append(payload)
+
+        return groups.items()
+
+    def rotation(self):
+        """the shards in the order the current thread should try them,
+        every call starts one shard further"""
+        offset = getattr(self.local, 'offset', 0)
+        self.local.offset = offset + 1
+        offset %= len(self.shards)
+        return self.shards[offset:] + self.shards[:offset]
+
+    def put(self, payload, timeout=None, delay=None, eta=None):
+        return self.put_many([payload], timeout, delay, eta)
+
+    def put_many(self, payloads, timeout=None, delay=None, eta=None):
+        if delay is not None or eta is not None:
+            return self.schedule(payloads, delay, eta)
+
+        for (key, backend), group in self.group_by_shard(payloads):
+            backend.rpush_many(key, group)
+
+    def schedule(self, payloads, delay=None, eta=None):
+        if eta is None:
+            eta = time.time() + delay
+
+        self.wake_housekeeper()
+        for (key, backend), group in self.group_by_shard(payloads):
+            backend.schedule(':'.join([key, 'delayed']), group, eta)
+
+    def put_back(self, payload):
+        key, backend = self.rotation()[0]
+        backend.lpush(key, payload)
+
+    def get(self, wait=False, timeout=None):
+        items = self.get_many(1, wait, timeout)
+        return items and items[0] or None
+
+    def get_many(self, count, wait=False, timeout=None):
+        prefetcher = self.get_prefetcher()
+        if prefetcher:
+            return prefetcher.get_many(count, wait, timeout)
+
+        for key, backend in self.rotation():
+            items = backend.lpop_many(key, count)
+            if items:
+                return items
+
+        if not wait:
+            return []
+
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = timeout > 0 and time.time() + timeout or None
+        while True:
+            for backend, keys in self.keys_by_server():
+                block = timeout
+                if deadline:
+                    block = deadline - time.time()
+                    if block <= 0:
+                        return []
+
+                if len(self.servers) > 1:
+                    # with many servers, block on each for a short slice
+                    # at a time so that none of them is left behind
+                    block_slice = self.block_slice
+                    block = deadline and min(block, block_slice) or block_slice
+
+                item = backend.blpop(keys, timeout=block)
+                if item is not None:
+                    return [item]
+
+    def keys_by_server(self):
+        servers = []
+        keys = {}
+        for key, backend in self.rotation():
+            if backend not in keys:
+                servers.append(backend)
+                keys[backend] = []
+            keys[backend].append(key)
+
+        return [(backend, keys[backend]) for backend in servers]
+
+    def promote(self, limit=1000):
+        total = 0
+        for key, backend in self.shards:
+            delayed = ':'.join([key, 'delayed'])
+            while True:
+                moved = backend.promote(delayed, key, time.time(), limit)
+                total += moved
+                if moved < limit:
+                    break
+
+        return total
+
+    def flush(self):
+        for backend, keys in self.keys_by_server():
+            flush = getattr(backend, 'flush', None)
+            if flush:
+                flush()
+
+    def get_size(self):
+        return sum(backend.llen(key) for key, backend in self.shards)
+
+
+class StreamQueue(Queue):
+    """a queue backed by a redis stream (redis >= 6.2), meant to be
+    used through :py:class:`lineup.backends.redis.StreamsRedisBackend`.
+
+    Every step reads the stream through a consumer group of its own,
+    named after the step, and every thread is a consumer of that
+    group. Items are read in batches with XREADGROUP and stay pending
+    until acked, the acks travel along with the next read. A consumer
+    also claims, at most once per ``visibility_timeout``, the items
+    that other consumers left pending for longer than that.
+
+    The stream is trimmed to roughly ``maxlen`` entries, so it should
+    be large enough to hold whatever the consumers are behind by. It
+    is always reliable, can't be bounded by ``maxsize`` nor use
+    ``dedup``, and doesn't support delayed delivery.
+    """
+    consumer_class = StreamConsumer
+    maxlen = 100000
+    atomic_handoff = False
+
+    # the consumer group of whoever reads the queue without a step,
+    # like Pipeline.get_result
+    default_group = 'lineup'
+
+    def __init__(self, name, backend_class, maxlen=None, group=None, **kw):
+        super(StreamQueue, self).__init__(name, backend_class, **kw)
+        if self.maxsize or self.dedup:
+            msg = '{0} cannot be bounded, see maxlen, nor deduplicating'
+            raise ValueError(msg.format(self.name))
+
+        self.reliable = True
+        self.maxlen = maxlen or self.maxlen
+        self.group = group or self.default_group
+        self.groups = set()
+
+    def adopt_consumer(self, consumer):
+        self.group = consumer.get_name()
+        return super(StreamQueue, self).adopt_consumer(consumer)
+
+    def create_group(self):
+        if self.group not in self.groups:
+            self.backend.xgroup_create(self.name, self.group)
+            self.groups.add(self.group)
+
+    def put(self, payload, timeout=None):
+        return self.put_many([payload], timeout)
+
+    def put_many(self, payloads, timeout=None):
+        payloads = list(payloads)
+        if payloads:
+            return self.backend.xadd_many(self.name, payloads, self.maxlen)
+
+    def put_back(self, payload):
+        # a stream can only grow at its tail, the item is read again
+        # after the ones already in the queue
+        self.put(payload)
+
+    def put_back_many(self, payloads):
+        self.put_many(payloads)
+
+    def retry(self, payload, delay):
+        # without delayed delivery the payload is retried right away
+        return self.put(payload)
+
+    def wait_for_room(self, timeout=None):
+        return True
+
+    def read(self, consumer, count):
+        """sends the pending acks of the consumer and reads up to
+        ``count`` items, claiming stuck ones first when it is time"""
+        acks = consumer.take_acks()
+        now = time.time()
+        if now >= consumer.next_claim:
+            consumer.next_claim = now + self.visibility_timeout
+            entries = self.backend.xautoclaim(
+                self.name, self.group, consumer.name, acks,
+                int(self.visibility_timeout * 1000), count)
+            if entries:
+                return consumer.deliver(entries)
+
+            acks = []
+
+        entries = self.backend.xreadgroup(
+            self.name, self.group, consumer.name, acks, count)
+        return consumer.deliver(entries)
+
+    def get_reliable(self, consumer, count, wait=False, timeout=None):
+        self.create_group()
+        items = self.read(consumer, count)
+        if items or not wait:
+            return items
+
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = timeout > 0 and time.time() + timeout or None
+        while True:
+            # wake up once per visibility timeout to claim stuck items
+            block = self.visibility_timeout
+            if deadline:
+                block = min(block, deadline - time.time())
+                if block <= 0:
+                    return []
+
+            entries = self.backend.bxreadgroup(
+                self.name, self.group, consumer.name, count, block)
+            items = consumer.deliver(entries) or self.read(consumer, count)
+            if items:
+                return items
+
+    def flush_acks(self):
+        consumer = self.get_consumer()
+        acks = consumer.take_acks()
+        if acks:
+            self.backend.xack(self.name, self.group, acks)
+
+    def release(self, consumer):
+        # a stream entry can't be given back, the ones that weren't
+        # consumed are claimed by another consumer once idle for
+        # longer than the visibility timeout
+        acks = consumer.take_acks()
+        if acks:
+            self.backend.xack(self.name, self.group, acks)
+
+    def housekeeping(self):
+        # the consumers claim stuck items themselves, see read
+        pass
+
+    def get_size(self):
+        return self.backend.xlen(self.name)
+
+
+class Housekeeper(Thread):
+    """a daemon thread that runs the periodic maintenance of the
+    given queues, like reclaiming the items of dead consumers, every
+    ``interval`` seconds.
+
+    It only starts once :py:meth:`wake` is called, by the pipeline
+    running the steps or by the first item a queue schedules, so that
+    the processes that only feed a pipeline don't poll its queues."""
+
+    def __init__(self, queues, interval=1.0):
+        super(Housekeeper, self).__init__()
+        self.daemon = True
+        self.queues = queues
+        self.interval = interval
+        self.stopped = Event()
+        self.lock = Lock()
+        for queue in queues:
+            queue.housekeeper = self
+
+    def wake(self):
+        """starts the thread unless it already started or was stopped"""
+        with self.lock:
+            if self.ident is None and not self.stopped.is_set():
+                self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sweep()
+
+    def sweep(self):
+        for queue in self.queues:
+            try:
+                queue.housekeeping()
+            except Exception:
+                logger.exception("housekeeping of %s failed", queue)
+
+    def stop(self):
+        self.stopped.set()
@@ -5,7 +5,7 @@ import sys
 import os
 import socket
 import signal
-from lineup.datastructures import Queue
+from lineup.datastructures import Queue, Housekeeper
 from lineup.core import PipelineRegistry
 
 
@@ -62,6 +62,9 @@ class Node(object):
     def feed(self, item):
         self.input.put(item)
 
+    def feed_many(self, items):
+        self.input.put_many(items)
+
     def stop(self):
         for child in self.workers:
             child.stop()
@@ -78,6 +81,26 @@ class Node(object):
 
 class Pipeline(Node):
     timeout = -1
+    maxsize = None
+    overflow = 'block'
+    reliable = False
+    visibility_timeout = 300
+    queue_class = None
+
+    # seconds between two rounds of maintenance of the queues, see
+    # lineup.datastructures.Housekeeper. LINEUP_HOUSEKEEPING_INTERVAL
+    # overrides it
+    housekeeping_interval = 1.0
+
+    # how the items of the queues are written, by name, see
+    # lineup.backends.serializers. A step may pick its own for its
+    # consume queue. None is plain JSON
+    serializer = None
+
+    # compresses the long items of the queues: a compressor name or a
+    # lineup.backends.compression.Compression. A step may pick its own
+    # for its consume queue. None doesn't compress
+    compression = None
 
     __metaclass__ = PipelineRegistry
 
@@ -85,6 +108,40 @@ class Pipeline(Node):
         self.queues = self.get_queues(*args, **kwargs)
         isteps = enumerate(self.steps)
         self.workers = [self.make_worker(Type, i) for i, Type in isteps]
+        self.housekeeper = self.make_housekeeper()
+        self.dead_letter = self.make_dead_letter()
+
+    def make_dead_letter(self):
+        # where the steps send the items they gave up on, see
+        # Step.max_attempts
+        name = '.'.join([self.name, b'dead-letter'])
+        return Queue(name, backend_class=self.backend_class,
+                     serializer=self.serializer,
+                     compression=self.compression)
+
+    def make_housekeeper(self):
+        interval = float(os.environ.get('LINEUP_HOUSEKEEPING_INTERVAL',
+                                        self.housekeeping_interval))
+        return Housekeeper(self.queues, interval)
+
+    def run_daemon(self):
+        # other processes, or this one before a restart, may have
+        # scheduled items already, so the housekeeper always runs along
+        # with the workers
+        if self.housekeeper:
+            self.housekeeper.wake()
+
+        super(Pipeline, self).run_daemon()
+
+    def stop(self):
+        if self.housekeeper:
+            self.housekeeper.stop()
+
+        super(Pipeline, self).stop()
+
+        # whatever the write-behind of the backends holds goes out now
+        for queue in self.queues + [self.dead_letter]:
+            queue.flush()
 
     @property
     def input(self):
@@ -95,7 +152,9 @@ class Pipeline(Node):
         return self.queues[-1]
 
     def get_result(self):
-        return self.output.get(wait=True)
+        result = self.output.get(wait=True)
+        self.output.ack()
+        return result
 
     def make_queue(self, index):
         name = '.'.join([
@@ -103,9 +162,53 @@ class Pipeline(Node):
             b'queue',
             str(index),
         ])
-        return Queue(name,
-                     backend_class=self.backend_class,
-                     timeout=self.timeout)
+        QueueClass = self.get_queue_class(index)
+        Step = self.get_consumer_step(index)
+        return QueueClass(name,
+                          backend_class=self.backend_class,
+                          maxsize=self.maxsize,
+                          overflow=self.overflow,
+                          reliable=self.reliable,
+                          visibility_timeout=self.visibility_timeout,
+                          timeout=self.timeout,
+                          dedup=getattr(Step, 'dedup', None),
+                          dedup_ttl=getattr(Step, 'dedup_ttl', 3600),
+                          dedup_filter=getattr(Step, 'dedup_filter', 'set'),
+                          serializer=self.get_serializer(index),
+                          compression=self.get_compression(index))
+
+    def get_serializer(self, index):
+        return (getattr(self.get_consumer_step(index), 'serializer', None) or
+                self.serializer)
+
+    def get_compression(self, index):
+        return (getattr(self.get_consumer_step(index), 'compression', None) or
+                self.compression)
+
+    def get_compression_stats(self):
+        """the compression stats of every compressed queue, by name"""
+        queues = self.queues + [self.dead_letter]
+        return dict((queue.name, queue.get_compression_stats())
+                    for queue in queues if queue.compression is not None)
+
+    def get_consumer_step(self, index):
+        # the step class that consumes the queue at the given index,
+        # None for the output queue
+        steps = getattr(self, 'steps', None) or []
+        if index < len(steps):
+            return steps[index]
+
+    def get_queue_class(self, index):
+        # each step may choose the kind of queue it consumes from
+        QueueClass = getattr(self.get_consumer_step(index),
+                             'consume_queue_class', None)
+        if QueueClass:
+            return QueueClass
+
+        # then the pipeline, then the backend, like the
+        # StreamsRedisBackend that keeps its queues in redis streams
+        return (self.queue_class or
+                getattr(self.backend_class, 'queue_class', None) or Queue)
 
     def get_queues(self):
         steps = getattr(self, 'steps', None) or []
@@ -9,6 +9,7 @@ import logging
 import coloredlogs
 
 from lineup import JSONRedisBackend
+from lineup.snapshots import snapshot_queue, restore_queue
 
 from lineup.utils import PipelineScanner
 
@@ -131,9 +132,12 @@ class RunPipeline(Command):
         output = self.get_output(arguments)
 
         while output.is_open():
-            result = self.pipeline.output.get(wait=False)
+            # block for a little while so that `lineup stop` is
+            # noticed without spinning on an empty output queue
+            result = self.pipeline.output.get(wait=True, timeout=1)
             if result:
                 output.write(result)
+                self.pipeline.output.ack()
 
         logger.warning("%s has stopped gracefully",
                        self.pipeline)
@@ -158,8 +162,33 @@ class PushToPipeline(Command):
 
     def when_executed(self, arguments, remainder):
         data = self.get_json_data(arguments)
-        for item in data:
-            self.pipeline.feed(item)
+        self.pipeline.feed_many(data)
+
+
+class SnapshotPipeline(Command):
+    name = 'snapshot'
+
+    def when_executed(self, arguments, remainder):
+        if not os.path.isdir(arguments.directory):
+            os.makedirs(arguments.directory)
+
+        # the failed items of the dead-letter queue are kept too
+        for queue in self.pipeline.queues + [self.pipeline.dead_letter]:
+            paths = snapshot_queue(queue, arguments.directory,
+                                   batch_size=arguments.batch_size,
+                                   drain=arguments.drain)
+            for path in paths:
+                logger.info("%s saved to %s", queue.name, path)
+
+
+class RestorePipeline(Command):
+    name = 'restore'
+
+    def when_executed(self, arguments, remainder):
+        for queue in self.pipeline.queues + [self.pipeline.dead_letter]:
+            total = restore_queue(queue, arguments.directory,
+                                  batch_size=arguments.batch_size)
+            logger.info("%s items restored to %s", total, queue.name)
 
 
 class PipelinesCmd(Command):
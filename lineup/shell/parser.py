@@ -16,6 +16,8 @@ from lineup.shell.commands import (
     RunPipeline,
     StopPipeline,
     PushToPipeline,
+    SnapshotPipeline,
+    RestorePipeline,
     PipelinesCmd,
 )
 
@@ -104,6 +106,45 @@ def main():
                      default='rpush@{0}-done'.format(pipeline_name),
                      help=('Output to a given list'),
     )
+    snapshot = subparsers.add_parser(
+        'snapshot', help=('Saves the queues of the given pipeline to '
+                          'gzipped JSONL files, one per queue'))
+
+    snapshot.add_argument('-d', '--directory',
+                          type=str,
+                          default='.',
+                          help=('Where to write the snapshot files'),
+    )
+
+    snapshot.add_argument('-b', '--batch-size',
+                          type=int,
+                          default=1000,
+                          help=('How many items to read per round trip'),
+    )
+
+    snapshot.add_argument('--drain',
+                          action='store_true',
+                          help=('Removes the items from redis as they '
+                                'are saved, otherwise the pipeline '
+                                'should be stopped meanwhile'),
+    )
+
+    restore = subparsers.add_parser(
+        'restore', help=('Pushes the items saved by snapshot back to '
+                         'the queues of the given pipeline'))
+
+    restore.add_argument('-d', '--directory',
+                         type=str,
+                         default='.',
+                         help=('Where to read the snapshot files from'),
+    )
+
+    restore.add_argument('-b', '--batch-size',
+                         type=int,
+                         default=1000,
+                         help=('How many items to push per RPUSH'),
+    )
+
     pipelines = subparsers.add_parser(
         'pipelines', help='Special command for handling pipelines')
 
@@ -111,6 +152,8 @@ def main():
         ('run', run, RunPipeline),
         ('stop', stop, StopPipeline),
         ('push', push, PushToPipeline),
+        ('snapshot', snapshot, SnapshotPipeline),
+        ('restore', restore, RestorePipeline),
         ('pipelines', pipelines, PipelinesCmd),
     ])
 
@@ -0,0 +1,343 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <lineup - python distributed pipeline framework>
+# Copyright (C) <2013>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import unicode_literals
+import os
+import sys
+import time
+import gzip
+import base64
+import logging
+
+from lineup.backends.serializers import MARKER, is_framed
+
+# Snapshots of the queues of a pipeline: every redis list goes to a
+# gzipped file with one serialized item per line (JSONL), read and
+# written in batches so that memory use doesn't depend on the size of
+# the queue. The items are moved exactly as stored, without being
+# deserialized. Items framed by a binary serializer could hold line
+# breaks, so they are written base64 encoded after the frame marker.
+#
+# The sorted sets of a queue (its delayed items, the items of a
+# priority queue and the leases of the consumers of a reliable queue)
+# go to files of their own with the score in front of every member,
+# and the sequence of a priority queue to a file of a single line.
+
+logger = logging.getLogger('lineup.snapshots')
+
+SUFFIXES = {
+    'list': '.jsonl.gz',
+    'zset': '.zset.gz',
+    'string': '.string.gz',
+}
+
+
+def get_queue_keys(queue):
+    """the redis lists of a queue and their backends"""
+    return getattr(queue, 'shards', None) or [(queue.name, queue.backend)]
+
+
+def get_state_keys(backend, key):
+    """the other keys of the queue ``key``: its delayed items, the
+    sequence of a priority queue, and the processing lists of the
+    consumers of a reliable queue along with their leases"""
+    leases = ':'.join([key, 'leases'])
+    processing = []
+    if backend.key_type(leases) == 'zset':
+        members = backend.zrange_raw(leases, 0, backend.zcard(leases))
+        processing = [member for member, lease in members]
+
+    return [':'.join([key, 'delayed']), ':'.join([key, 'sequence'])] + \
+        processing + [leases]
+
+
+def get_snapshot_path(directory, key, kind='list'):
+    return os.path.join(directory, key + SUFFIXES[kind])
+
+
+def find_snapshots(directory, key):
+    """the kind and path of the snapshot files of the key and of its
+    other keys, the key first"""
+    if not os.path.isdir(directory):
+        return
+
+    for name in sorted(os.listdir(directory)):
+        for kind, suffix in SUFFIXES.items():
+            saved = name[:-len(suffix)]
+            if name.endswith(suffix) and (
+                    saved == key or saved.startswith(key + ':')):
+                yield saved, kind, os.path.join(directory, name)
+
+
+def encode_line(product):
+    # the members of the zsets are prefixed, so look for line breaks
+    # past the frame marker too
+    if is_framed(product) or b'\n' in product:
+        return MARKER + base64.b64encode(product)
+
+    return product
+
+
+def decode_line(line):
+    product = line.rstrip(b'\n')
+    if is_framed(product):
+        return base64.b64decode(product[1:])
+
+    return product
+
+
+def dump_list(backend, key, stream, batch_size=1000, drain=False,
+              progress=None):
+    """writes the items of the list to the stream, taking
+    ``batch_size`` of them per round trip. When ``drain`` is true they
+    are removed from redis as they're written, otherwise the list
+    should not change meanwhile. Returns how many items were written.
+    """
+    total = 0
+    while True:
+        if drain:
+            products = backend.lpop_many_raw(key, batch_size)
+        else:
+            products = backend.lrange_raw(key, total, batch_size)
+
+        for product in products:
+            stream.write(encode_line(product))
+            stream.write(b'\n')
+
+        total += len(products)
+        if progress:
+            progress(total)
+
+        if len(products) < batch_size:
+            return total
+
+
+def dump_zset(backend, key, stream, batch_size=1000, drain=False,
+              progress=None):
+    """like :py:func:`dump_list` for a sorted set, every line holds
+    the score of a member and the member"""
+    total = 0
+    while True:
+        if drain:
+            members = backend.zpop_many_raw(key, batch_size)
+        else:
+            members = backend.zrange_raw(key, total, batch_size)
+
+        for member, score in members:
+            stream.write(repr(float(score)) + b' ')
+            stream.write(encode_line(member))
+            stream.write(b'\n')
+
+        total += len(members)
+        if progress:
+            progress(total)
+
+        if len(members) < batch_size:
+            return total
+
+
+def dump_string(backend, key, stream, batch_size=1000, drain=False,
+                progress=None):
+    """writes the value of the key to the stream. It is left in redis
+    even when draining: it is a counter, not an item."""
+    stream.write(encode_line(backend.get_raw(key)))
+    stream.write(b'\n')
+    if progress:
+        progress(1)
+
+    return 1
+
+
+def load_batches(push, stream, batch_size, depth, progress, parse):
+    total = 0
+    batches = [[]]
+    for line in stream:
+        if not line.rstrip(b'\n'):
+            continue
+
+        batches[-1].append(parse(line))
+        if len(batches[-1]) < batch_size:
+            continue
+
+        if len(batches) < depth:
+            batches.append([])
+            continue
+
+        push(batches)
+        total += sum(map(len, batches))
+        batches = [[]]
+        if progress:
+            progress(total)
+
+    batches = filter(None, batches)
+    if batches:
+        push(batches)
+        total += sum(map(len, batches))
+
+    if progress:
+        progress(total)
+
+    return total
+
+
+def load_list(backend, key, stream, batch_size=1000, depth=10,
+              progress=None):
+    """pushes the items read from the stream to the tail of the list,
+    ``batch_size`` items per RPUSH and ``depth`` RPUSHes per round
+    trip. Returns how many items were pushed."""
+    def push(batches):
+        backend.rpush_raw(key, batches)
+
+    return load_batches(push, stream, batch_size, depth, progress,
+                        decode_line)
+
+
+def parse_member(line):
+    score, member = line.split(b' ', 1)
+    return decode_line(member), float(score)
+
+
+def load_zset(backend, key, stream, batch_size=1000, depth=10,
+              progress=None):
+    """adds the members read from the stream to the sorted set with
+    their scores, like :py:func:`load_list`"""
+    def push(batches):
+        backend.zadd_raw(key, batches)
+
+    return load_batches(push, stream, batch_size, depth, progress,
+                        parse_member)
+
+
+def load_string(backend, key, stream, batch_size=1000, depth=10,
+                progress=None):
+    """sets the key to the value read from the stream, unless it was
+    set meanwhile"""
+    for line in stream:
+        backend.set_raw(key, decode_line(line), only_missing=True)
+        if progress:
+            progress(1)
+
+        return 1
+
+    return 0
+
+
+DUMPS = {
+    'list': dump_list,
+    'zset': dump_zset,
+    'string': dump_string,
+}
+
+LOADS = {
+    'list': load_list,
+    'zset': load_zset,
+    'string': load_string,
+}
+
+SIZES = {
+    'list': 'llen',
+    'zset': 'zcard',
+}
+
+
+class Progress(object):
+    """shows how far a snapshot or a restore of one list went"""
+
+    def __init__(self, label, expected=None, stream=sys.stderr):
+        self.label = label
+        self.expected = expected
+        self.stream = stream
+        self.started = time.time()
+
+    def __call__(self, done):
+        elapsed = max(time.time() - self.started, 0.001)
+        expected = self.expected is not None and '/{0}'.format(
+            self.expected) or ''
+        self.stream.write('\r{0}: {1}{2} items, {3:.0f} items/s'.format(
+            self.label, done, expected, done / elapsed))
+        self.stream.flush()
+
+    def finish(self):
+        self.stream.write('\n')
+
+
+def snapshot_queue(queue, directory, batch_size=1000, drain=False,
+                   show_progress=True):
+    """writes every list of the queue, and every other key of it (see
+    :py:func:`get_state_keys`), to its own file of the directory.
+    Returns the paths written. Keys of other types, like the streams
+    of a StreamQueue, are skipped."""
+    paths = []
+    for key, backend in get_queue_keys(queue):
+        for saved in [key] + get_state_keys(backend, key):
+            kind = backend.key_type(saved)
+            if kind == 'none' and saved != key:
+                continue
+
+            # an empty queue still gets its file
+            kind = kind == 'none' and 'list' or kind
+            if kind not in DUMPS:
+                logger.warning("skipping %s: it is a redis %s, only "
+                               "lists, zsets and strings can be "
+                               "snapshotted", saved, kind)
+                continue
+
+            path = get_snapshot_path(directory, saved, kind)
+            size = SIZES.get(kind)
+            progress = show_progress and Progress(
+                saved, size and getattr(backend, size)(saved))
+            with gzip.open(path, 'wb') as stream:
+                DUMPS[kind](backend, saved, stream, batch_size, drain,
+                            progress)
+
+            if progress:
+                progress.finish()
+
+            paths.append(path)
+
+    return paths
+
+
+def restore_queue(queue, directory, batch_size=1000, show_progress=True):
+    """pushes the items of the snapshot files of the queue back to its
+    lists, and its other keys back in place. Returns how many items
+    were restored."""
+    total = 0
+    for key, backend in get_queue_keys(queue):
+        for saved, kind, path in find_snapshots(directory, key):
+            progress = show_progress and Progress(saved)
+            with gzip.open(path, 'rb') as stream:
+                restored = LOADS[kind](backend, saved, stream, batch_size,
+                                       progress=progress)
+
+            # the leases and the sequence aren't items
+            if not saved.endswith((':leases', ':sequence')):
+                total += restored
+
+            if progress:
+                progress.finish()
+
+    return total
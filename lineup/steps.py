@@ -5,11 +5,14 @@ from __future__ import unicode_literals
 import re
 import sys
 import time
+import random
 import logging
 import traceback
 
-from threading import Thread, Event
-from lineup.core import LineUpPayloadDict, LineUpKeyError
+from collections import deque
+from threading import Thread, Event, Condition
+from multiprocessing.pool import ThreadPool
+from lineup.core import LineUpPayloadDict, LineUpKeyError, LineUpQueueFull
 logger = logging.getLogger('lineup.steps')
 
 
@@ -17,14 +20,65 @@ class KeyMaker(object):
     def __init__(self, step):
         self.step = step
 
-        for name in ['logging', 'alive', 'error']:
+        for name in ['logging', 'alive', 'error', 'stats']:
             setattr(self, name, self.make_key(name))
 
     def make_key(self, suffix):
         return ":".join(['lineup', self.step.name, suffix])
 
 
+class Handoff(object):
+    """what a step did during one loop, waiting to be sent to redis
+    along with the ack of its item, see Step.hand_off"""
+
+    def __init__(self):
+        self.payloads = []
+        self.records = []
+        self.consumed = 0
+
+
 class Step(Thread):
+    # the kind of queue this step consumes from, for example
+    # lineup.datastructures.PriorityQueue. None means the pipeline's
+    consume_queue_class = None
+
+    # how many items to take from the consume queue ahead of time, so
+    # that a short consume doesn't wait on a round trip to redis for
+    # every item. 0 turns prefetching off
+    prefetch = 0
+
+    # drop the items of the consume queue that repeat within
+    # dedup_ttl seconds, see lineup.datastructures.Queue.put_unique.
+    # dedup is a field of the payload, a callable or True
+    dedup = None
+    dedup_ttl = 3600
+    dedup_filter = 'set'
+
+    # the serializer of the consume queue, by name, instead of the one
+    # of the pipeline. See lineup.backends.serializers
+    serializer = None
+
+    # the compression of the consume queue, instead of the one of the
+    # pipeline. See lineup.backends.compression
+    compression = None
+
+    # the retry policy: a failed item is consumed again, after an
+    # exponential backoff with jitter, until it failed max_attempts
+    # times and goes to the dead-letter queue of the pipeline. None
+    # keeps the old behaviour of rolling the item back right away
+    max_attempts = None
+    backoff = 1.0
+    max_backoff = 300.0
+    jitter = 0.5
+
+    # ack the item, push what it produced, append the logs and count
+    # it in a single atomic round trip at the end of every loop, see
+    # lineup.datastructures.Queue.hand_off. Steps whose queues can't
+    # do it go through the queues one call at a time
+    atomic_handoff = True
+    hands_off = False
+    handoff = None
+
     # TODO: use AST to make sure that the subclasses are
     def __init__(self, consume_queue, produce_queue, parent):
         self.parent = parent
@@ -44,6 +98,7 @@ class Step(Thread):
 
         consume_queue.adopt_consumer(self)
         produce_queue.adopt_producer(self)
+        self.hands_off = self.can_hand_off()
 
     def get_name(self):
         return getattr(self, 'name', None) or self.taxonomy
@@ -67,10 +122,14 @@ class Step(Thread):
 
     def log(self, message, *args, **kw):
         logger.info(message, *args, **kw)
-        return self.backend.rpush(self.key.logging, {
+        record = {
             'message': message % args % kw,
             'when': time.time()
-        })
+        }
+        if self.handoff is not None:
+            return self.handoff.records.append(self.backend.serialize(record))
+
+        return self.backend.rpush(self.key.logging, record)
 
     def do_consume(self, instructions):
         # safe_instructions is a dictionary wrapped in a
@@ -79,8 +138,11 @@ class Step(Thread):
         safe_instructions = LineUpPayloadDict(instructions)
         return self.consume(safe_instructions)
 
-    def produce(self, payload):
-        return self.produce_queue.put(payload)
+    def produce(self, payload, **kw):
+        if self.handoff is not None and not kw:
+            return self.handoff.payloads.append(payload)
+
+        return self.produce_queue.put(payload, **kw)
 
     def before_consume(self):
         self.log("%s is about to consume its queue", self.name)
@@ -114,9 +176,19 @@ class Step(Thread):
         return not is_locked
 
     def run(self):
+        if self.prefetch:
+            self.consume_queue.start_prefetch(self.prefetch)
+
         while self.is_active():
             self.loop()
 
+        self.finish()
+
+    def finish(self):
+        # the prefetched items that weren't consumed go back to redis
+        self.consume_queue.stop_prefetch()
+        self.consume_queue.flush_acks()
+
     def log_key_error(self, exc, tb):
         filename = re.sub(r'py[cao]$', 'py', tb.tb_frame.f_code.co_filename)
         lineno = tb.tb_frame.f_code.co_firstlineno
@@ -128,11 +200,64 @@ class Step(Thread):
         logger.error(message,
                      exc, filename, lineno)
 
+    def can_hand_off(self):
+        return bool(self.atomic_handoff and self.consume_queue.can_hand_off(
+            self.produce_queue, self.backend))
+
     def loop(self):
+        if not self.hands_off:
+            return self.consume_next()
+
+        self.handoff = Handoff()
+        try:
+            self.consume_next()
+        finally:
+            handoff, self.handoff = self.handoff, None
+
+        self.hand_off(handoff)
+
+    def hand_off(self, handoff):
+        """sends everything the loop did in a single round trip"""
+        counters = {}
+        if handoff.consumed:
+            counters = {
+                'consumed': handoff.consumed,
+                'produced': len(handoff.payloads),
+            }
+
+        self.consume_queue.hand_off(
+            self.produce_queue, handoff.payloads, self.key.logging,
+            handoff.records, self.key.stats, counters)
+
+    def consume_next(self):
         self.before_consume()
 
+        # backpressure: don't take more work while the queue
+        # downstream is full
+        if not self.produce_queue.wait_for_room():
+            return
+
         instructions = self.consume_queue.get(wait=True)
+        if instructions is None:
+            # the consume queue timed out before any work arrived
+            return
+
+        if self.handoff is not None:
+            self.handoff.consumed += 1
+
+        try:
+            self.process(instructions)
+        finally:
+            # done with the instructions one way or the other, a
+            # reliable queue can forget about them. The ready event is
+            # left alone: a stop that came in meanwhile must stick
+            self.consume_queue.ack()
+
+        self.after_consume(instructions)
 
+    def process(self, instructions):
+        """consumes the instructions, dealing with whatever goes
+        wrong"""
         try:
             self.do_consume(instructions)
         except LineUpKeyError as e:
@@ -140,15 +265,22 @@ class Step(Thread):
             self.log_key_error(e, tb)
             self.rollback(instructions)
 
+        except LineUpQueueFull:
+            # the produce queue filled up in the meantime, the
+            # instructions go back to the head of our queue and will
+            # be consumed again once there is room downstream
+            self.consume_queue.put_back(instructions)
+            logger.warning("%s is full, %s will retry",
+                           self.produce_queue, self.name)
+
         except Exception as e:
             self.handle_exception(e, instructions)
             logger.exception("%s failed", self)
-        finally:
-            self.ready.clear()
-
-        self.after_consume(instructions)
 
     def handle_exception(self, e, instructions):
+        if self.max_attempts:
+            return self.handle_failure(instructions)
+
         error = traceback.format_exc(e)
 
         instructions.update({
@@ -160,3 +292,133 @@ class Step(Thread):
         })
 
         self.do_rollback(instructions)
+
+    def handle_failure(self, instructions):
+        """retries the instructions that just failed, or gives up on
+        them once they failed ``max_attempts`` times in this step.
+
+        The attempts are counted in the ``__lineup__retry__`` key of
+        the instructions, along with the error of the last one.
+        """
+        retry = instructions.get('__lineup__retry__') or {}
+        attempts = 1
+        if retry.get('step') == self.name:
+            attempts += retry.get('attempts', 0)
+
+        instructions['__lineup__retry__'] = {
+            'step': self.name,
+            'attempts': attempts,
+            'error': traceback.format_exc(),
+            'failed_at': time.time(),
+        }
+
+        if attempts >= self.max_attempts:
+            return self.give_up(instructions)
+
+        delay = self.get_backoff(attempts)
+        self.consume_queue.retry(instructions, delay)
+        logger.warning("%s failed %s time(s), retrying in %.2fs",
+                       self.name, attempts, delay)
+
+    def get_backoff(self, attempts):
+        """how long to wait before the next attempt: it doubles after
+        every attempt, up to ``max_backoff``, and ``jitter`` takes a
+        random share off it so that items that failed together don't
+        come back together"""
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def give_up(self, instructions):
+        """sends the instructions to the dead-letter queue of the
+        pipeline, or rolls them back when there isn't one"""
+        dead_letter = getattr(self.parent, 'dead_letter', None)
+        if dead_letter is None:
+            return self.rollback(instructions)
+
+        dead_letter.put(instructions)
+        logger.error("%s gave up after %s attempt(s), sent to %s",
+                     self.name, self.max_attempts, dead_letter)
+
+
+class ConcurrentStep(Step):
+    """a step that consumes up to ``concurrency`` items at the same
+    time, for I/O bound steps like downloads: a single step takes the
+    items from its queue and hands them to a pool of threads, instead
+    of running a step per item in flight.
+
+    ``consume`` must be thread safe, and may run in any order. Thread
+    based steps and concurrent steps mix freely in a pipeline.
+    """
+    concurrency = 10
+
+    # the items are done in the threads of the pool, out of order
+    atomic_handoff = False
+
+    def run(self):
+        self.pool = ThreadPool(self.concurrency)
+        self.condition = Condition()
+
+        # the items taken from the queue, in order, as [done] lists:
+        # a reliable queue acks the oldest ones first, so an item is
+        # only acked once all the ones taken before are done
+        self.in_flight = deque()
+        self.running = 0
+        super(ConcurrentStep, self).run()
+
+    def finish(self):
+        self.pool.close()
+        self.pool.join()
+        self.acknowledge()
+        super(ConcurrentStep, self).finish()
+
+    def acknowledge(self):
+        # acks have to come from the thread that took the items
+        with self.condition:
+            done = 0
+            while self.in_flight and self.in_flight[0][0]:
+                self.in_flight.popleft()
+                done += 1
+
+        if done:
+            self.consume_queue.ack(done)
+
+    def wait_for_slot(self):
+        with self.condition:
+            while self.running >= self.concurrency and self.is_active():
+                self.condition.wait(1)
+
+            return self.running < self.concurrency
+
+    def loop(self):
+        self.acknowledge()
+        if not self.wait_for_slot():
+            return
+
+        # backpressure: don't take more work while the queue
+        # downstream is full
+        if not self.produce_queue.wait_for_room():
+            return
+
+        instructions = self.consume_queue.get(wait=True)
+        if instructions is None:
+            # the consume queue timed out before any work arrived
+            return
+
+        entry = [False]
+        with self.condition:
+            self.in_flight.append(entry)
+            self.running += 1
+
+        self.pool.apply_async(self.handle, (instructions, entry))
+
+    def handle(self, instructions, entry):
+        try:
+            self.before_consume()
+            self.process(instructions)
+        finally:
+            with self.condition:
+                entry[0] = True
+                self.running -= 1
+                self.condition.notify()
+
+        self.after_consume(instructions)
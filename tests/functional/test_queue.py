@@ -2,10 +2,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import os
+import shutil
 import socket
-from lineup import Step, Queue
+import tempfile
+import time
+from threading import Thread, Timer
+from lineup import Step, Queue, PriorityQueue, ShardedQueue, StreamQueue
 from lineup.framework import Pipeline, Node
-from lineup.backends.redis import JSONRedisBackend
+from lineup.snapshots import snapshot_queue, restore_queue
+from lineup.backends.redis import JSONRedisBackend, StreamsRedisBackend
 from .base import redis_test
 
 
@@ -201,3 +206,440 @@ def test_pipeline_default_rollback(context):
     result.should.equal({
         'ok': True,
     })
+
+
+@redis_test
+def test_queue_get_wait_timeout(context):
+    ("Queue#get should block until the timeout and return None")
+
+    # Given an empty queue with a short timeout
+    queue = Queue('test-blocking', backend_class=JSONRedisBackend, timeout=1)
+
+    # When I wait for an item
+    started = time.time()
+    result = queue.get(wait=True)
+
+    # Then it should have timed out
+    result.should.be.none
+    (time.time() - started).should.be.greater_than(0.9)
+
+
+@redis_test
+def test_queue_get_wait_wakes_up(context):
+    ("Queue#get should wake up as soon as an item is put")
+
+    # Given an empty queue
+    queue = Queue('test-wakeup', backend_class=JSONRedisBackend)
+
+    # And a thread that puts an item in a little while
+    feeder = Timer(0.1, queue.put, args=({'wake': 'up'},))
+    feeder.start()
+
+    # When I wait for an item
+    result = queue.get(wait=True, timeout=5)
+
+    # Then it should be the item put by the thread
+    result.should.equal({'wake': 'up'})
+
+
+@redis_test
+def test_pipeline_feed_many(context):
+    ("Pipeline#feed_many should enqueue everything in order")
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'double': instructions['number'] * 2})
+
+    class Doubler(Pipeline):
+        name = 'doubler'
+        steps = [Double]
+
+    manager = Doubler(JSONRedisBackend)
+    manager.run_daemon()
+    manager.feed_many({'number': n} for n in range(5))
+
+    results = [manager.get_result() for n in range(5)]
+    manager.stop()
+
+    results.should.equal([{'double': n * 2} for n in range(5)])
+
+
+@redis_test
+def test_pipeline_bounded_queues(context):
+    ("Pipeline with a maxsize should never let its queues grow past it")
+
+    sizes = []
+
+    class Slow(Step):
+        def consume(self, instructions):
+            sizes.append(self.consume_queue.get_size())
+            time.sleep(0.01)
+            self.produce(instructions)
+
+    class Bounded(Pipeline):
+        name = 'bounded'
+        maxsize = 3
+        steps = [Slow]
+
+    def feed():
+        manager.feed_many({'number': n} for n in range(3))
+        for n in range(3, 10):
+            manager.feed({'number': n})
+
+    manager = Bounded(JSONRedisBackend)
+    manager.run_daemon()
+
+    # the feeder blocks whenever the input queue is full, so it
+    # runs alongside the reads from the output
+    feeder = Thread(target=feed)
+    feeder.start()
+
+    results = [manager.get_result() for n in range(10)]
+    manager.stop()
+
+    results.should.equal([{'number': n} for n in range(10)])
+    max(sizes).should.be.lower_than(3)
+
+
+@redis_test
+def test_reliable_queue_acks(context):
+    ("A reliable Queue should keep items in a processing list until acked")
+
+    # Given a reliable queue with two items
+    queue = Queue('test-reliable', backend_class=JSONRedisBackend,
+                  reliable=True)
+    queue.put_many([{'n': 1}, {'n': 2}])
+    processing = queue.get_consumer().processing
+
+    # When I get the first item
+    queue.get().should.equal({'n': 1})
+
+    # Then it should be in the processing list
+    context.redis.lrange(processing, 0, -1).should.equal(['{"n": 1}'])
+
+    # And when I ack it and get the next one
+    queue.ack()
+    queue.get(wait=True, timeout=1).should.equal({'n': 2})
+
+    # Then only the unacked item should be in the processing list
+    context.redis.lrange(processing, 0, -1).should.equal(['{"n": 2}'])
+
+    # And flushing the last ack should clear the list and its lease
+    queue.ack()
+    queue.flush_acks()
+    context.redis.exists(processing).should.be.false
+    context.redis.zcard(queue.leases).should.equal(0)
+
+
+@redis_test
+def test_reliable_queue_reclaim(context):
+    ("A reliable Queue should give back the items of expired leases")
+
+    # Given a reliable queue with a very short visibility timeout
+    queue = Queue('test-reclaim', backend_class=JSONRedisBackend,
+                  reliable=True, visibility_timeout=0.1)
+    queue.put_many([{'n': 1}, {'n': 2}, {'n': 3}])
+
+    # And a consumer that took two items and died
+    queue.get_many(2).should.equal([{'n': 1}, {'n': 2}])
+
+    # When the lease expires and the queue is reclaimed
+    time.sleep(0.2)
+    queue.reclaim().should.equal(2)
+
+    # Then the items should be back in their original order
+    queue.get_many(3).should.equal([{'n': 1}, {'n': 2}, {'n': 3}])
+
+
+@redis_test
+def test_priority_queue(context):
+    ("PriorityQueue should hand out urgent items first, FIFO within "
+     "the same priority")
+
+    queue = PriorityQueue('test-priority', backend_class=JSONRedisBackend)
+    queue.put({'n': 1}, priority=5)
+    queue.put_many([{'n': 2}, {'n': 2}], priority=5)
+    queue.put({'n': 3}, priority=-1)
+    queue.put({'n': 4})
+
+    queue.get_size().should.equal(5)
+    queue.get_many(10).should.equal([
+        {'n': 3}, {'n': 4}, {'n': 1}, {'n': 2}, {'n': 2},
+    ])
+    queue.get(wait=True, timeout=1).should.be.none
+
+
+@redis_test
+def test_pipeline_priority_stage(context):
+    ("Pipeline should use a PriorityQueue for steps that ask for it")
+
+    class Urgent(Step):
+        consume_queue_class = PriorityQueue
+
+        def consume(self, instructions):
+            self.produce(instructions)
+
+    class Emergency(Pipeline):
+        name = 'emergency'
+        steps = [Urgent]
+
+    manager = Emergency(JSONRedisBackend)
+    manager.input.should.be.a(PriorityQueue)
+    manager.output.should_not.be.a(PriorityQueue)
+
+    manager.input.put({'n': 'later'}, priority=1)
+    manager.input.put({'n': 'now'}, priority=0)
+    manager.run_daemon()
+
+    results = [manager.get_result() for n in range(2)]
+    manager.stop()
+
+    results.should.equal([{'n': 'now'}, {'n': 'later'}])
+
+
+@redis_test
+def test_queue_delayed_delivery(context):
+    ("Queue#put with a delay should only deliver the item once due")
+
+    queue = Queue('test-delayed', backend_class=JSONRedisBackend)
+    queue.put({'n': 'later'}, delay=0.3)
+    queue.put_many([{'n': 'same'}, {'n': 'same'}], delay=0)
+    queue.put({'n': 'now'})
+
+    queue.promote().should.equal(2)
+    queue.get_many(10).should.equal([
+        {'n': 'now'}, {'n': 'same'}, {'n': 'same'}])
+
+    time.sleep(0.3)
+    queue.promote().should.equal(1)
+    queue.get().should.equal({'n': 'later'})
+
+
+@redis_test
+def test_pipeline_delayed_produce(context):
+    ("Pipeline should deliver items produced with a delay")
+
+    class Snooze(Step):
+        def consume(self, instructions):
+            self.produce(instructions, delay=0.2)
+
+    class Snoozer(Pipeline):
+        name = 'snoozer'
+        housekeeping_interval = 0.05
+        steps = [Snooze]
+
+    manager = Snoozer(JSONRedisBackend)
+    manager.run_daemon()
+
+    started = time.time()
+    manager.feed({'wake': 'up'})
+    result = manager.get_result()
+    manager.stop()
+
+    result.should.equal({'wake': 'up'})
+    (time.time() - started).should.be.greater_than(0.2)
+
+
+@redis_test
+def test_sharded_queue(context):
+    ("ShardedQueue should deliver every item put in any of its shards")
+
+    queue = ShardedQueue('test-sharded', backend_class=JSONRedisBackend,
+                         shards=3, partition=lambda payload: payload['n'])
+    for key, backend in queue.shards:
+        backend.redis.delete(key)
+
+    queue.put_many([{'n': n} for n in range(9)])
+    queue.get_size().should.equal(9)
+
+    results = queue.get_many(9) + queue.get_many(9) + queue.get_many(9)
+    sorted(item['n'] for item in results).should.equal(range(9))
+
+    Timer(0.2, queue.put, [{'n': 'late'}]).start()
+    queue.get(wait=True, timeout=2).should.equal({'n': 'late'})
+
+
+@redis_test
+def test_queue_prefetch(context):
+    ("Queue#stop_prefetch should put the unconsumed items back")
+
+    queue = Queue('test-prefetch', backend_class=JSONRedisBackend)
+    queue.put_many([{'n': n} for n in range(5)])
+
+    queue.start_prefetch(4)
+    queue.get(wait=True, timeout=1).should.equal({'n': 0})
+    queue.stop_prefetch()
+
+    queue.get_many(10).should.equal([{'n': n} for n in range(1, 5)])
+
+
+@redis_test
+def test_pipeline_prefetch(context):
+    ("Pipeline should deliver everything through steps that prefetch")
+
+    class Eager(Step):
+        prefetch = 8
+
+        def consume(self, instructions):
+            self.produce(instructions)
+
+    class Prefetching(Pipeline):
+        name = 'prefetching'
+        steps = [Eager]
+
+    manager = Prefetching(JSONRedisBackend)
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(20)])
+
+    results = [manager.get_result() for n in range(20)]
+    manager.stop()
+
+    results.should.equal([{'n': n} for n in range(20)])
+
+
+@redis_test
+def test_stream_queue_claims_stuck_items(context):
+    ("StreamQueue should hand the items a consumer never acked to "
+     "another consumer once they're idle for too long")
+
+    queue = StreamQueue('test-stream', StreamsRedisBackend,
+                        visibility_timeout=0.1)
+    queue.backend.redis.delete(queue.name)
+    queue.put_many([{'n': 1}, {'n': 2}])
+
+    lost = queue.consumer_class(queue, 'lost')
+    queue.get_reliable(lost, 2).should.equal([{'n': 1}, {'n': 2}])
+
+    time.sleep(0.2)
+    queue.get_many(2).should.equal([{'n': 1}, {'n': 2}])
+    queue.ack(2)
+    queue.flush_acks()
+
+    pending = queue.backend.redis.xpending(queue.name, queue.group)
+    pending['pending'].should.equal(0)
+
+
+@redis_test
+def test_pipeline_streams(context):
+    ("Pipeline should run unchanged on top of redis streams")
+
+    class Streams(Pipeline):
+        name = 'streams'
+        steps = [DummyStep]
+
+    manager = Streams(StreamsRedisBackend)
+    for queue in manager.queues:
+        queue.backend.redis.delete(queue.name)
+
+    manager.input.should.be.a(StreamQueue)
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(5)])
+
+    results = [manager.get_result() for n in range(5)]
+    manager.stop()
+
+    results.should.equal([{'yay': {'n': n}} for n in range(5)])
+
+
+@redis_test
+def test_queue_dedup(context):
+    ("Queue with dedup should drop the items it already saw")
+
+    for dedup_filter in ('set', 'bloom'):
+        queue = Queue('test-dedup', backend_class=JSONRedisBackend,
+                      dedup='url', dedup_ttl=60, dedup_filter=dedup_filter)
+        redis = queue.backend.redis
+        redis.delete(queue.name, *redis.keys(queue.seen + ':*'))
+
+        queue.put({'url': 'a'}).should.equal(1)
+        queue.put_many([{'url': 'a'}, {'url': 'b'}, {'url': 'b'}])\
+            .should.equal(1)
+        queue.put({'url': 'c'}, delay=0).should.equal(1)
+        queue.put({'url': 'c'}).should.equal(0)
+
+        queue.promote()
+        queue.get_many(10).should.equal([
+            {'url': 'a'}, {'url': 'b'}, {'url': 'c'}])
+
+
+@redis_test
+def test_pipeline_dead_letter(context):
+    ("Pipeline should retry a failing item and then send it to the "
+     "dead-letter queue")
+
+    class Flaky(Step):
+        max_attempts = 3
+        backoff = 0.05
+
+        def consume(self, instructions):
+            raise ValueError('poison')
+
+    class Poisoned(Pipeline):
+        name = 'poisoned'
+        housekeeping_interval = 0.05
+        steps = [Flaky]
+
+    manager = Poisoned(JSONRedisBackend)
+    manager.dead_letter.backend.redis.delete(manager.dead_letter.name)
+    manager.run_daemon()
+    manager.feed({'n': 1})
+
+    item = manager.dead_letter.get(wait=True, timeout=5)
+    manager.stop()
+
+    item['n'].should.equal(1)
+    item['__lineup__retry__']['attempts'].should.equal(3)
+    item['__lineup__retry__']['error'].should.contain('poison')
+
+
+@redis_test
+def test_queue_snapshot_restore(context):
+    ("snapshot_queue and restore_queue should move every item")
+
+    queue = Queue('test-snapshot', backend_class=JSONRedisBackend)
+    queue.backend.redis.delete(queue.name)
+    queue.put_many([{'n': n} for n in range(2500)])
+
+    directory = tempfile.mkdtemp()
+    try:
+        snapshot_queue(queue, directory, drain=True, show_progress=False)
+        queue.get_size().should.equal(0)
+
+        restore_queue(queue, directory, show_progress=False)\
+            .should.equal(2500)
+    finally:
+        shutil.rmtree(directory)
+
+    queue.get_many(2500).should.equal([{'n': n} for n in range(2500)])
+
+
+@redis_test
+def test_reliable_queue_hand_off(context):
+    ("Queue#hand_off should ack, push, log and count in one go")
+
+    # Given a reliable queue with an item taken
+    queue = Queue('test-handoff', backend_class=JSONRedisBackend,
+                  reliable=True)
+    output = Queue('test-handoff-output', backend_class=JSONRedisBackend)
+    queue.put({'n': 1})
+    queue.get().should.equal({'n': 1})
+    queue.ack()
+
+    queue.can_hand_off(output, context.backend).should.be.true
+
+    # When it is handed off
+    queue.hand_off(output, [{'n': 2}, {'n': 3}], 'test-handoff:logging',
+                   [context.backend.serialize({'message': 'done'})],
+                   'test-handoff:stats', {'consumed': 1, 'produced': 2})
+
+    # Then the item should be acked
+    processing = queue.get_consumer().processing
+    context.redis.exists(processing).should.be.false
+    context.redis.zcard(queue.leases).should.equal(0)
+
+    # And its outputs, log and counters should be there
+    output.get_many(10).should.equal([{'n': 2}, {'n': 3}])
+    context.redis.lrange('test-handoff:logging', 0, -1).should.equal(
+        ['{"message": "done"}'])
+    context.redis.hgetall('test-handoff:stats').should.equal(
+        {'consumed': '1', 'produced': '2'})
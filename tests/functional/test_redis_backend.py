@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 
 
 from lineup.backends.redis import JSONRedisBackend
+from lineup.backends.blobs import make_blob_store
 from .base import redis_test
 
 
@@ -78,3 +79,67 @@ def test_backend_lpush(context):
 
     context.redis.lrange("FOO", 0, -1).should.equal(
         ['{"a dict,": "how convenient !"}'])
+
+
+@redis_test
+def test_backend_rpush_many(context):
+    ("JSONRedisBackend#rpush_many should serialize every value")
+
+    backend = JSONRedisBackend()
+    backend.rpush_many("FOO", [{'one': 1}, {'two': 2}])
+
+    context.redis.lrange("FOO", 0, -1).should.equal(
+        ['{"one": 1}', '{"two": 2}'])
+
+
+@redis_test
+def test_backend_lpop_many(context):
+    ("JSONRedisBackend#lpop_many should pop from the head in order")
+
+    context.redis.rpush("FOO", '{"one": 1}', '{"two": 2}', '{"three": 3}')
+
+    backend = JSONRedisBackend()
+    backend.lpop_many("FOO", 2).should.equal([{'one': 1}, {'two': 2}])
+    backend.lpop_many("FOO", 2).should.equal([{'three': 3}])
+    backend.lpop_many("FOO", 2).should.equal([])
+
+
+@redis_test
+def test_backend_bounded_rpush(context):
+    ("JSONRedisBackend#bounded_rpush should refuse values "
+     "that don't fit")
+
+    backend = JSONRedisBackend()
+    backend.bounded_rpush("FOO", [1, 2], 3, 'reject').should.equal(2)
+    backend.bounded_rpush("FOO", [3, 4], 3, 'reject').should.equal(-1)
+    backend.bounded_rpush("FOO", [3], 3, 'block').should.equal(3)
+
+    context.redis.lrange("FOO", 0, -1).should.equal(['1', '2', '3'])
+
+
+@redis_test
+def test_backend_bounded_rpush_drop_oldest(context):
+    ("JSONRedisBackend#bounded_rpush should drop the oldest "
+     "values when asked to")
+
+    backend = JSONRedisBackend()
+    backend.bounded_rpush("FOO", [1, 2, 3], 3, 'drop-oldest')
+    backend.bounded_rpush("FOO", [4, 5], 3, 'drop-oldest').should.equal(3)
+
+    context.redis.lrange("FOO", 0, -1).should.equal(['3', '4', '5'])
+
+
+@redis_test
+def test_claim_check(context):
+    ("JSONRedisBackend should keep large fields out of the queue")
+
+    backend = JSONRedisBackend()
+    backend.blobs = make_blob_store('redis', backend.redis, ttl=60)
+    backend.redis.delete('test-claim-check')
+
+    backend.rpush('test-claim-check', {'content': 'x' * 100000})
+    stored = backend.redis.lindex('test-claim-check', 0)
+    (len(stored) < 100).should.be.true
+
+    payload = backend.lpop('test-claim-check')
+    payload['content'].should.equal('x' * 100000)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from threading import Thread
+
+from nose import SkipTest
+
+from lineup import Step, Pipeline
+from lineup.backends import zmq as zmq_backend
+from lineup.backends.zmq import ZMQBackend
+from .base import redis_test
+
+
+def setup():
+    if zmq_backend.zmq is None:
+        raise SkipTest('pyzmq is not installed')
+
+
+@redis_test
+def test_channel(context):
+    ("ZMQBackend should hand the items over a zmq channel, not redis")
+
+    backend = ZMQBackend()
+    received = []
+    consumer = Thread(target=lambda: received.extend(
+        [backend.blpop('channel', timeout=5) for n in range(3)]))
+    consumer.start()
+
+    backend.rpush_many('channel', [{'n': 1}, {'n': 2}, {'n': 3}])
+    consumer.join()
+
+    received.should.equal([{'n': 1}, {'n': 2}, {'n': 3}])
+    context.redis.exists('channel').should.be.false
+    context.redis.zcard('lineup:zmq:channel').should.equal(1)
+
+
+@redis_test
+def test_control_plane(context):
+    ("ZMQBackend should keep the step logs in redis")
+
+    backend = ZMQBackend()
+    backend.rpush('lineup:step:logging', {'message': 'hello'})
+
+    context.redis.llen('lineup:step:logging').should.equal(1)
+    backend.lpop('lineup:step:logging').should.equal({'message': 'hello'})
+
+
+@redis_test
+def test_tcp(context):
+    ("ZMQBackend should also work over tcp")
+
+    backend = ZMQBackend(transport='tcp')
+    received = []
+    consumer = Thread(target=lambda: received.append(
+        backend.blpop('tcp', timeout=5)))
+    consumer.start()
+
+    backend.rpush('tcp', 'item')
+    consumer.join()
+
+    received.should.equal(['item'])
+
+
+@redis_test
+def test_close(context):
+    ("ZMQBackend#close should withdraw the consumers of the thread")
+
+    backend = ZMQBackend()
+    backend.lpop('closing').should.be.none
+    context.redis.zcard('lineup:zmq:closing').should.equal(1)
+
+    backend.close()
+    context.redis.zcard('lineup:zmq:closing').should.equal(0)
+
+
+@redis_test
+def test_pipeline(context):
+    ("Pipeline should run on top of the ZMQBackend")
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'n': instructions['n'] * 2})
+
+    class Channels(Pipeline):
+        name = 'zmq'
+        steps = [Double, Double]
+        timeout = 0.05
+
+    manager = Channels(ZMQBackend)
+    manager.run_daemon()
+    manager.output.get(timeout=0.05)
+    manager.feed_many([{'n': n} for n in range(10)])
+
+    results = [manager.output.get(wait=True, timeout=5) for n in range(10)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    sorted(results).should.equal([{'n': n * 4} for n in range(10)])
+
+    # And the items went over zmq, not through redis
+    context.redis.llen(manager.input.name).should.equal(0)
+    context.redis.llen(manager.output.name).should.equal(0)
+    context.redis.zcard(
+        'lineup:zmq:' + manager.output.name).should.be.greater_than(0)
@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 #
 from __future__ import unicode_literals
-from mock import patch, Mock
+from threading import Thread
+from mock import Mock
 from lineup.backends.base import BaseBackend, io_operation
 
 
@@ -37,8 +38,7 @@ def test_repr():
     result.should.equal("<MyBackend>")
 
 
-@patch('lineup.backends.base.time')
-def test_io_operation(time):
+def test_io_operation():
     ("@io_operation should acquire lock")
 
     stack = []
@@ -46,9 +46,8 @@ def test_io_operation(time):
     register = lambda name: lambda *args: stack.append(name)
     lock = Mock(name='FakeBackend.lock')
 
-    lock.acquire.side_effect = register('lock.acquire')
-    time.sleep.side_effect = register('time.sleep')
-    lock.release.side_effect = register('lock.release')
+    lock.__enter__ = register('lock.acquire')
+    lock.__exit__ = register('lock.release')
     lock.foo.side_effect = register('lock.foo')
 
 
@@ -70,6 +69,43 @@ def test_io_operation(time):
     stack.should.equal([
         'lock.acquire',
         'lock.foo',
-        'time.sleep',
         'lock.release'
     ])
+
+
+def test_io_operation_releases_the_lock_upon_error():
+    ("@io_operation should release the lock when the operation fails")
+
+    class FakeBackend(BaseBackend):
+        @io_operation
+        def foo(self):
+            raise ValueError('boom')
+
+    backend = FakeBackend()
+
+    backend.foo.when.called_with().should.throw(ValueError, 'boom')
+
+    # Then another thread can take the lock
+    acquired = []
+    thread = Thread(target=lambda: acquired.append(
+        backend.lock.acquire(blocking=False)))
+    thread.start()
+    thread.join()
+    acquired.should.equal([True])
+
+
+def test_io_operation_thread_safe():
+    ("@io_operation should not lock a thread safe backend")
+
+    class FakeBackend(BaseBackend):
+        thread_safe = True
+
+        @io_operation
+        def foo(self):
+            return 'YAY'
+
+    backend = FakeBackend()
+    backend.lock = Mock(name='FakeBackend.lock')
+
+    backend.foo().should.equal('YAY')
+    backend.lock.method_calls.should.be.empty
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import shutil
+import tempfile
+from mock import Mock, patch
+from lineup.backends.blobs import (
+    RedisBlobStore, FileBlobStore, make_blob_store,
+)
+
+
+@patch('lineup.backends.blobs.uuid')
+def test_redis_blob_store(uuid):
+    ("RedisBlobStore should keep blobs in expiring keys")
+
+    uuid.uuid4.return_value.hex = 'abc'
+    redis = Mock(name='redis')
+
+    store = RedisBlobStore(redis, ttl=60)
+
+    store.put('the content').should.equal('abc')
+    redis.set.assert_called_once_with(
+        'lineup:blob:abc', 'the content', ex=60)
+
+    store.get('abc').should.equal(redis.get.return_value)
+    redis.get.assert_called_once_with('lineup:blob:abc')
+
+
+def test_file_blob_store():
+    ("FileBlobStore should keep blobs in files of its directory")
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = FileBlobStore(directory + '/blobs')
+        id = store.put(b'the content')
+
+        store.get(id).should.equal(b'the content')
+        FileBlobStore(directory + '/blobs').get(id).should.equal(
+            b'the content')
+    finally:
+        shutil.rmtree(directory)
+
+
+@patch('lineup.backends.blobs.pools')
+@patch('lineup.backends.blobs.StrictRedis')
+def test_make_blob_store(StrictRedis, pools):
+    ("make_blob_store should pick the store from the uri")
+
+    redis = Mock(name='redis')
+
+    store = make_blob_store('redis', redis, 60)
+    store.should.be.a(RedisBlobStore)
+    store.redis.should.equal(redis)
+
+    store = make_blob_store('redis://1@otherhost:6380', redis)
+    store.redis.should.equal(StrictRedis.return_value)
+    pools.get.assert_called_once_with('redis://1@otherhost:6380')
+    StrictRedis.assert_called_once_with(
+        connection_pool=pools.get.return_value)
+
+    with patch('lineup.backends.blobs.os.makedirs'):
+        store = make_blob_store('file:///var/lineup/blobs')
+
+    store.should.be.a(FileBlobStore)
+    store.directory.should.equal('/var/lineup/blobs')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import time
+from mock import Mock, call
+
+from lineup.backends.coalescer import WriteCoalescer, WriteCoalescers
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+
+    return condition()
+
+
+def test_flush():
+    ("WriteCoalescer#flush should send the pending writes in a "
+     "single transaction, in order")
+
+    # Given a coalescer that lingers for long
+    redis = Mock(name='redis')
+    pipeline = redis.pipeline.return_value
+    coalescer = WriteCoalescer(redis, linger=60, batch_size=100)
+
+    # When a few writes are queued, each telling how many items of its
+    # list are pending
+    coalescer.rpush('a', ['"1"']).should.equal(1)
+    coalescer.rpush('b', ['"2"', '"3"']).should.equal(2)
+    coalescer.rpush('a', []).should.equal(1)
+
+    # And flushed
+    coalescer.flush().should.equal(2)
+
+    # Then they should have gone out at once
+    redis.pipeline.assert_called_once_with(transaction=True)
+    pipeline.rpush.assert_has_calls([
+        call('a', '"1"'),
+        call('b', '"2"', '"3"'),
+    ])
+    pipeline.execute.assert_called_once_with()
+
+    # And there should be nothing left
+    coalescer.flush().should.equal(0)
+    coalescer.rpush('a', ['"4"']).should.equal(1)
+    coalescer.close()
+
+
+def test_batch_size():
+    ("WriteCoalescer should flush as soon as batch_size writes wait")
+
+    redis = Mock(name='redis')
+    pipeline = redis.pipeline.return_value
+    coalescer = WriteCoalescer(redis, linger=60, batch_size=3)
+
+    for n in range(3):
+        coalescer.rpush('a', ['"{0}"'.format(n)])
+
+    wait_for(lambda: pipeline.execute.called).should.be.true
+    pipeline.rpush.call_count.should.equal(3)
+    coalescer.close()
+
+
+def test_linger():
+    ("WriteCoalescer should flush a lone write once it lingered")
+
+    redis = Mock(name='redis')
+    pipeline = redis.pipeline.return_value
+    coalescer = WriteCoalescer(redis, linger=0.005, batch_size=100)
+
+    coalescer.rpush('a', ['"1"'])
+
+    wait_for(lambda: pipeline.execute.called).should.be.true
+    pipeline.rpush.assert_called_once_with('a', '"1"')
+    coalescer.close()
+
+
+def test_flush_failure():
+    ("WriteCoalescer should keep a batch that failed, ahead of the "
+     "newer writes")
+
+    # Given a redis that fails once
+    redis = Mock(name='redis')
+    pipeline = redis.pipeline.return_value
+    pipeline.execute.side_effect = [IOError('down'), None]
+    coalescer = WriteCoalescer(redis, linger=60, batch_size=100)
+
+    # When a flush fails
+    coalescer.rpush('a', ['"1"'])
+    coalescer.flush.when.called_with().should.throw(IOError, 'down')
+
+    # Then the write should be sent along with the next ones
+    coalescer.rpush('a', ['"2"']).should.equal(2)
+    coalescer.flush().should.equal(2)
+    pipeline.rpush.call_args_list[-2:].should.equal([
+        call('a', '"1"'),
+        call('a', '"2"'),
+    ])
+    coalescer.close()
+
+
+def test_backpressure():
+    ("WriteCoalescer should make the writers flush when too many "
+     "writes wait")
+
+    redis = Mock(name='redis')
+    coalescer = WriteCoalescer(redis, linger=60, batch_size=100)
+    coalescer.max_batches = 0
+    coalescer.flush = Mock(name='flush')
+
+    coalescer.rpush('a', ['"1"'])
+
+    coalescer.flush.assert_called_once_with()
+    del coalescer.flush
+    coalescer.close()
+
+
+def test_close():
+    ("WriteCoalescer#close should send what is pending and stop")
+
+    redis = Mock(name='redis')
+    pipeline = redis.pipeline.return_value
+    coalescer = WriteCoalescer(redis, linger=60, batch_size=100)
+    coalescer.rpush('a', ['"1"'])
+
+    coalescer.close()
+
+    coalescer.is_alive().should.be.false
+    pipeline.rpush.assert_called_once_with('a', '"1"')
+
+    # And the writes that come later go out right away
+    coalescer.rpush('a', ['"2"'])
+    pipeline.rpush.assert_called_with('a', '"2"')
+
+
+def test_coalescers():
+    ("WriteCoalescers should share a coalescer per uri and settings")
+
+    redis = Mock(name='redis')
+    coalescers = WriteCoalescers()
+
+    first = coalescers.get('redis://a', redis, 0.005, 100)
+    coalescers.get('redis://a', redis, 0.005, 100).should.be(first)
+    coalescers.get('redis://b', redis, 0.005, 100).should_not.be(first)
+
+    coalescers.close()
+    first.is_alive().should.be.false
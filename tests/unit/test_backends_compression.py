@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import json
+from nose import SkipTest
+
+from lineup.backends import compression
+from lineup.backends.compression import (
+    Compression, decompress, is_compressed, make_compression,
+)
+
+HTML = json.dumps({
+    'url': 'http://example.com/',
+    'body': '<html><body>{0}</body></html>'.format('<p>lineup</p>' * 500),
+})
+
+
+def test_compress_round_trip():
+    ("Compression should compress the long items behind a header")
+
+    zlib = Compression('zlib', threshold=100)
+
+    product = zlib.compress(HTML)
+
+    is_compressed(product).should.be.true
+    product[:2].should.equal(b'\x00Z')
+    len(product).should.be.lower_than(len(HTML) // 10)
+    decompress(product).should.equal(HTML)
+
+
+def test_compress_bz2():
+    ("Compression should compress with bz2 at the given level")
+
+    bz2 = Compression('bz2', level=1, threshold=100)
+
+    product = bz2.compress(HTML)
+
+    product[:2].should.equal(b'\x00B')
+    bz2.decompress(product).should.equal(HTML)
+
+
+def test_compress_lzma():
+    ("Compression should compress with lzma when it is installed")
+
+    if compression.lzma is None:
+        Compression.when.called_with('lzma').should.throw(
+            RuntimeError, 'the lzma compressor requires lzma, '
+            'run: pip install backports.lzma')
+        raise SkipTest('lzma is not installed')
+
+    product = Compression('lzma', threshold=100).compress(HTML)
+
+    product[:2].should.equal(b'\x00X')
+    decompress(product).should.equal(HTML)
+
+
+def test_compress_below_threshold():
+    ("Compression should leave the short items as they are")
+
+    product = Compression('zlib', threshold=1024).compress('"short"')
+
+    product.should.equal('"short"')
+    is_compressed(product).should.be.false
+
+
+def test_compress_incompressible():
+    ("Compression should leave the items that wouldn't shrink as they are")
+
+    product = '"abcdefghijklmnop"'
+
+    Compression('zlib', threshold=10).compress(product).should.equal(
+        product)
+
+
+def test_compression_stats():
+    ("Compression should count the bytes it saved and the time it took")
+
+    # Given a compression
+    zlib = Compression('zlib', level=9, threshold=100)
+
+    # When it compresses a long item and a short one
+    product = zlib.compress(HTML)
+    zlib.compress('"short"')
+    zlib.decompress(product)
+
+    # Then its stats should say so
+    stats = zlib.get_stats()
+    stats['compression'].should.equal('zlib')
+    stats['level'].should.equal(9)
+    stats['items'].should.equal(2)
+    stats['compressed'].should.equal(1)
+    stats['decompressed'].should.equal(1)
+    stats['bytes_in'].should.equal(len(HTML) + 7)
+    stats['bytes_out'].should.equal(len(product) + 7)
+    stats['ratio'].should.equal(float(len(HTML) + 7) / (len(product) + 7))
+    stats['compress_seconds'].should.be.greater_than(0)
+
+
+def test_unknown_compression():
+    ("Compression should refuse compressors it doesn't know")
+
+    Compression.when.called_with('snappy').should.throw(
+        ValueError, 'compression must be one of bz2, lzma, zlib, '
+        'got snappy')
+
+    decompress.when.called_with(b'\x00Qdata').should.throw(
+        ValueError, "unknown compressor code 'Q'")
+
+
+def test_make_compression():
+    ("make_compression should make a compression of its own per queue")
+
+    shared = Compression('bz2', level=3, threshold=10)
+
+    made = make_compression(shared)
+
+    made.should_not.be(shared)
+    (made.name, made.level, made.threshold).should.equal(('bz2', 3, 10))
+    make_compression('zlib').level.should.equal(6)
+    make_compression(None).should.be.none
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+
+from lineup import Step, Pipeline
+from lineup.backends.log import LogBackend
+
+DIRECTORY = None
+
+
+def setup():
+    global DIRECTORY
+    DIRECTORY = tempfile.mkdtemp()
+
+
+def teardown():
+    shutil.rmtree(DIRECTORY)
+
+
+def make_backend(name, group=None, **attributes):
+    backend = LogBackend(os.path.join(DIRECTORY, name), group)
+    backend.__dict__.update(attributes)
+    return backend
+
+
+def get_segments(backend, key):
+    return sorted(name for name in os.listdir(
+        backend.get_path(key, '.log')) if name.endswith('.segment'))
+
+
+def test_lists():
+    ("LogBackend should pop the items in the order they were pushed")
+
+    backend = make_backend('lists')
+    item = {'some': 'item'}
+
+    backend.rpush('q', item).should.equal(1)
+    backend.rpush_many('q', ['two', 'three']).should.equal(3)
+    backend.lpush('q', 'back').should.equal(4)
+
+    backend.llen('q').should.equal(4)
+    backend.lrange('q', 0, 1).should.equal([item, 'two'])
+    backend.lrange('q', 1, -1).should.equal(['two', 'three', 'back'])
+    backend.key_type('q').should.equal('list')
+
+    backend.lpop('q').should.equal(item)
+    backend.lpop_many('q', 10).should.equal(['two', 'three', 'back'])
+    backend.lpop('q').should.be.none
+    backend.llen('q').should.equal(0)
+
+
+def test_resumes_after_a_restart():
+    ("LogBackend should resume right after the last item popped")
+
+    backend = make_backend('restart')
+    backend.rpush_many('q', list('abcde'))
+    backend.lpop_many('q', 2).should.equal(['a', 'b'])
+
+    # forgets everything this process knows about the logs
+    LogBackend.logs.clear()
+
+    make_backend('restart').lpop_many('q', 10).should.equal(['c', 'd', 'e'])
+
+
+def test_consumer_groups():
+    ("LogBackend should hand every item to each consumer group")
+
+    first = make_backend('groups', 'first')
+    second = make_backend('groups', 'second')
+    first.rpush_many('q', ['a', 'b'])
+
+    first.lpop_many('q', 10).should.equal(['a', 'b'])
+    second.llen('q').should.equal(2)
+    second.lpop_many('q', 10).should.equal(['a', 'b'])
+
+
+def test_segments():
+    ("LogBackend should delete the segments every group is past")
+
+    first = make_backend('segments', 'first', segment_size=40)
+    second = make_backend('segments', 'second', segment_size=40)
+    second.llen('q')
+    for n in range(4):
+        first.rpush_many('q', ['x' * 40])
+
+    get_segments(first, 'q').should.have.length_of(4)
+
+    first.lpop_many('q', 3).should.have.length_of(3)
+    get_segments(first, 'q').should.have.length_of(4)
+
+    second.lpop_many('q', 3).should.have.length_of(3)
+    get_segments(first, 'q').should.have.length_of(1)
+
+    first.lpop_many('q', 10).should.equal(['x' * 40])
+    second.lpop_many('q', 10).should.equal(['x' * 40])
+
+
+def test_step_logs_retention():
+    ("LogBackend should only keep the newest segments of the step logs")
+
+    class SmallLogs(LogBackend):
+        log_segment_size = 1024
+
+    class Chatty(Step):
+        pass
+
+    class Logging(Pipeline):
+        name = 'logging'
+        steps = [Chatty]
+
+    os.environ['LINEUP_LOG_DIRECTORY'] = os.path.join(DIRECTORY, 'chatty')
+    try:
+        manager = Logging(SmallLogs)
+    finally:
+        del os.environ['LINEUP_LOG_DIRECTORY']
+
+    # When a step logs a lot more than a segment holds
+    step = manager.workers[0]
+    for n in range(1000):
+        step.log("line %s", n)
+
+    # Then only the newest segments are kept on disk
+    directory = step.backend.get_path(step.key.logging, '.log')
+    sizes = [os.path.getsize(os.path.join(directory, name))
+             for name in get_segments(step.backend, step.key.logging)]
+    len(sizes).should.equal(2)
+    sum(sizes).should.be.lower_than(3 * 1024)
+
+    # And they still read from the oldest line left
+    lines = step.backend.lrange(step.key.logging, 0, -1)
+    lines[-1]['message'].should.equal('line 999')
+    step.backend.llen(step.key.logging).should.equal(len(lines))
+    step.backend.lpop_many(step.key.logging, 1).should.equal(lines[:1])
+
+
+def test_values():
+    ("LogBackend should keep values")
+
+    backend = make_backend('values')
+    backend.get('k').should.be.none
+    backend.set('k', 'open')
+    backend.get('k').should.equal('open')
+    backend.key_type('k').should.equal('string')
+    backend.key_type('nothing').should.equal('none')
+
+
+def test_pipeline():
+    ("Pipeline should run on top of the LogBackend")
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'n': instructions['n'] * 2})
+
+    class Logged(Pipeline):
+        name = 'log'
+        steps = [Double, Double]
+        timeout = 0.05
+
+    os.environ['LINEUP_LOG_DIRECTORY'] = os.path.join(DIRECTORY, 'pipe')
+    try:
+        manager = Logged(LogBackend)
+    finally:
+        del os.environ['LINEUP_LOG_DIRECTORY']
+
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(10)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(10)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    results.should.equal([{'n': n * 4} for n in range(10)])
+
+
+def test_pipeline_retries():
+    ("Pipeline should retry the items that failed right away, since the "
+     "LogBackend has no delayed delivery")
+
+    class Flaky(Step):
+        max_attempts = 3
+
+        def consume(self, instructions):
+            retry = instructions.get('__lineup__retry__') or {}
+            if not retry:
+                raise ValueError('first attempt')
+
+            self.produce({'n': instructions['n'],
+                          'attempts': retry['attempts'] + 1})
+
+    class Retrying(Pipeline):
+        name = 'log-retries'
+        steps = [Flaky]
+        timeout = 0.05
+
+    os.environ['LINEUP_LOG_DIRECTORY'] = os.path.join(DIRECTORY, 'retries')
+    try:
+        manager = Retrying(LogBackend)
+    finally:
+        del os.environ['LINEUP_LOG_DIRECTORY']
+
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(3)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(3)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    results.should.equal([{'n': n, 'attempts': 2} for n in range(3)])
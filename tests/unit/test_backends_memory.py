@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import time
+from threading import Thread, Timer
+from lineup import Step, ConcurrentStep, Pipeline
+from lineup.backends.memory import MemoryBackend
+
+
+def setup():
+    MemoryBackend.store.clear()
+
+
+def test_lists():
+    ("MemoryBackend should push and pop the very same objects")
+
+    backend = MemoryBackend()
+    item = {'some': 'item'}
+
+    backend.rpush('q', item).should.equal(1)
+    backend.rpush_many('q', ['two', 'three']).should.equal(3)
+    backend.lpush('q', 'zero').should.equal(4)
+
+    backend.llen('q').should.equal(4)
+    backend.lrange('q', 0, 1).should.equal(['zero', item])
+    backend.lrange('q', 1, -1).should.equal([item, 'two', 'three'])
+
+    backend.lpop('q').should.equal('zero')
+    backend.lpop('q').should.be(item)
+    backend.rpop('q').should.equal('three')
+    backend.lpop_many('q', 10).should.equal(['two'])
+    backend.lpop('q').should.be.none
+
+
+def test_shared_between_instances():
+    ("MemoryBackend instances should share their lists")
+
+    MemoryBackend().rpush('shared', 'item')
+    MemoryBackend().lpop('shared').should.equal('item')
+
+
+def test_values():
+    ("MemoryBackend should keep values")
+
+    backend = MemoryBackend()
+    backend.get('k').should.be.none
+    backend.set('k', 'open')
+    backend.get('k').should.equal('open')
+    backend.key_type('k').should.equal('string')
+    backend.key_type('nothing').should.equal('none')
+
+
+def test_blpop():
+    ("MemoryBackend#blpop should wait for an item")
+
+    backend = MemoryBackend()
+    Timer(0.05, backend.rpush, ['later', 'item']).start()
+
+    backend.blpop(['empty', 'later'], timeout=2).should.equal('item')
+
+
+def test_blpop_timeout():
+    ("MemoryBackend#blpop should give up after the timeout")
+
+    backend = MemoryBackend()
+    started = time.time()
+
+    backend.blpop('empty', timeout=0.05).should.be.none
+    (time.time() - started).should.be.lower_than(1)
+
+
+def test_bounded_rpush():
+    ("MemoryBackend#bounded_rpush should follow the overflow policy")
+
+    backend = MemoryBackend()
+    backend.bounded_rpush('b', [1, 2], 3, 'block').should.equal(2)
+    backend.bounded_rpush('b', [3, 4], 3, 'reject').should.equal(-1)
+    backend.bounded_rpush('b', [3, 4], 3, 'drop-oldest').should.equal(3)
+    backend.lrange('b', 0, -1).should.equal([2, 3, 4])
+
+
+def test_schedule_promote():
+    ("MemoryBackend#promote should move the due items in order")
+
+    backend = MemoryBackend()
+    backend.schedule('d', ['later'], 200)
+    backend.schedule('d', ['soon', 'sooner'], 100)
+
+    backend.promote('d', 'q', 150, 10).should.equal(2)
+    backend.lrange('q', 0, -1).should.equal(['soon', 'sooner'])
+    backend.promote('d', 'q', 250, 10).should.equal(1)
+    backend.lpop_many('q', 10).should.equal(['soon', 'sooner', 'later'])
+
+
+def test_report_steps():
+    ("MemoryBackend#report_steps should gather every step ever seen")
+
+    backend = MemoryBackend()
+    backend.report_steps('q', ['c1'], ['p1'])
+    backend.report_steps('q', ['c2'], []).should.equal(
+        (set(['c1', 'c2']), set(['p1'])))
+
+
+def test_step_logs_are_capped():
+    ("MemoryBackend should only keep the latest step logs")
+
+    backend = MemoryBackend()
+    backend.log_length = 2
+    for n in range(5):
+        backend.rpush('lineup:step:logging', n)
+
+    backend.lrange('lineup:step:logging', 0, -1).should.equal([3, 4])
+
+
+def wait_for_waiters(key, count):
+    deadline = time.time() + 2
+    while len(MemoryBackend.store.waiters.get(key, ())) < count:
+        if time.time() > deadline:
+            raise AssertionError('nobody waits on {0}'.format(key))
+
+        time.sleep(0.001)
+
+
+def test_blpop_wakes_the_waiters_of_the_key():
+    ("MemoryBackend should only wake up as many waiters of a key as "
+     "items were pushed to it")
+
+    backend = MemoryBackend()
+    results = []
+
+    def pop(keys):
+        results.append(backend.blpop(keys, timeout=5))
+
+    # Given two threads waiting on a key, and one on that key and
+    # another one
+    threads = [Thread(target=pop, args=(keys,)) for keys in [
+        'wake-a', 'wake-a', ['wake-b', 'wake-a']]]
+    for index, thread in enumerate(threads):
+        thread.start()
+        wait_for_waiters('wake-a', index + 1)
+
+    # When an item is pushed to some other key
+    backend.rpush('wake-c', 'ignored')
+
+    # Then nobody is woken up
+    len(MemoryBackend.store.waiters['wake-a']).should.equal(3)
+
+    # And when two items are pushed to the key, two waiters are
+    backend.rpush_many('wake-a', ['one', 'two'])
+    len(MemoryBackend.store.waiters['wake-a']).should.equal(1)
+
+    # And an item pushed to the other key wakes up the last one
+    backend.rpush('wake-b', 'three')
+    for thread in threads:
+        thread.join(2)
+
+    sorted(results).should.equal(['one', 'three', 'two'])
+    MemoryBackend.store.waiters.should.be.empty
+
+
+def test_pipeline():
+    ("Pipeline should run on top of the MemoryBackend")
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'n': instructions['n'] * 2})
+
+    class InMemory(Pipeline):
+        name = 'in-memory'
+        steps = [Double, Double]
+        timeout = 0.05
+
+    manager = InMemory(MemoryBackend)
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(10)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(10)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    results.should.equal([{'n': n * 4} for n in range(10)])
+
+
+def test_pipeline_concurrent_step():
+    ("ConcurrentStep should consume many items at once, next to "
+     "thread based steps")
+
+    class Wait(ConcurrentStep):
+        concurrency = 20
+
+        def consume(self, instructions):
+            time.sleep(0.2)
+            self.produce(instructions)
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'n': instructions['n'] * 2})
+
+    class Mixed(Pipeline):
+        name = 'mixed'
+        steps = [Wait, Double]
+        timeout = 0.05
+
+    manager = Mixed(MemoryBackend)
+    manager.run_daemon()
+    started = time.time()
+    manager.feed_many([{'n': n} for n in range(20)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(20)]
+    elapsed = time.time() - started
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    sorted(result['n'] for result in results).should.equal(
+        [n * 2 for n in range(20)])
+    elapsed.should.be.lower_than(1)
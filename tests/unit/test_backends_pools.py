@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+from mock import patch
+from redis.connection import (
+    ConnectionPool, BlockingConnectionPool, UnixDomainSocketConnection,
+)
+
+from lineup.backends.pools import ConnectionPools
+from lineup.backends.redis import JSONRedisBackend
+
+
+def test_one_pool_per_uri():
+    ("ConnectionPools#get should return the same pool for the same uri")
+
+    pools = ConnectionPools()
+
+    pool = pools.get('redis://0@localhost:6379')
+    pool.should.be.a(ConnectionPool)
+    pools.get('redis://0@localhost:6379').should.be(pool)
+    pools.get('redis://1@localhost:6379').should_not.be(pool)
+
+
+def test_backends_share_the_pool():
+    ("JSONRedisBackend instances should share the pool of their uri")
+
+    first = JSONRedisBackend('redis://3@localhost:6379')
+    second = JSONRedisBackend('redis://3@localhost:6379')
+
+    first.redis.connection_pool.should.be(second.redis.connection_pool)
+
+
+def test_tcp_connection_kwargs():
+    ("ConnectionPools should parse the redis uris of lineup")
+
+    pools = ConnectionPools()
+    kwargs = pools.get_connection_kwargs('redis://2@otherhost:6380/secret')
+
+    kwargs.should.have.key('db').being.equal('2')
+    kwargs.should.have.key('host').being.equal('otherhost')
+    kwargs.should.have.key('port').being.equal(6380)
+    kwargs.should.have.key('password').being.equal('/secret')
+    kwargs.should.have.key('socket_keepalive').being.true
+
+
+def test_unix_socket():
+    ("ConnectionPools should connect to unix sockets")
+
+    pools = ConnectionPools()
+    pool = pools.get('unix:///var/run/redis.sock?db=4')
+
+    pool.connection_class.should.equal(UnixDomainSocketConnection)
+    pool.connection_kwargs['path'].should.equal('/var/run/redis.sock')
+    pool.connection_kwargs['db'].should.equal('4')
+
+
+@patch.dict('os.environ', {'LINEUP_REDIS_MAX_CONNECTIONS': '8',
+                           'LINEUP_REDIS_POOL_TIMEOUT': '5'})
+def test_max_connections():
+    ("ConnectionPools should cap the connections when asked to")
+
+    pools = ConnectionPools()
+    pool = pools.get('redis://0@localhost:6379')
+
+    pool.should.be.a(BlockingConnectionPool)
+    pool.max_connections.should.equal(8)
+    pool.timeout.should.equal(5)
+
+    pools.get_stats().should.equal({
+        'redis://0@localhost:6379': {
+            'created': 0,
+            'in_use': 0,
+            'idle': 0,
+            'max_connections': 8,
+        }
+    })
+
+
+def test_stats():
+    ("ConnectionPools#get_stats should count the connections of each pool")
+
+    pools = ConnectionPools()
+    pool = pools.get('redis://0@localhost:6379')
+
+    # Given two connections taken and one of them given back
+    with patch.object(pool.connection_class, 'connect'):
+        connection = pool.get_connection('GET')
+        pool.get_connection('GET')
+
+    pool.release(connection)
+
+    pools.get_stats()['redis://0@localhost:6379'].should.equal({
+        'created': 2,
+        'in_use': 1,
+        'idle': 1,
+        'max_connections': pool.max_connections,
+    })
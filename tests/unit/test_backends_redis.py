@@ -3,15 +3,23 @@
 #
 from __future__ import unicode_literals
 from mock import MagicMock, patch, call
-from lineup.backends.redis import JSONRedisBackend
+from lineup.backends import lua
+from redis import ResponseError
+from lineup.core import BlobReference, LineUpPayloadDict
+from lineup.backends.redis import JSONRedisBackend, StreamsRedisBackend
+from lineup.backends.serializers import get_serializer
+from lineup.backends.compression import Compression
 
 operation_test = patch('lineup.backends.redis.io_operation', lambda x: x)
 
 
 class IsolatedTestBackend(JSONRedisBackend):
+    fractional_timeouts = False
+
     def initialize(self):
         self.redis = MagicMock(name='IsolatedTestBackend.redis')
         self.json = MagicMock(name='IsolatedTestBackend.json')
+        self.scripts = {}
 
     def serialize(self, value):
         self.json.serialize(value)
@@ -22,6 +30,10 @@ class IsolatedTestBackend(JSONRedisBackend):
         return {'deserialized': value}
 
 
+class IsolatedStreamsBackend(IsolatedTestBackend, StreamsRedisBackend):
+    pass
+
+
 @patch('lineup.backends.redis.StrictRedis')
 def test_redis_instance(StrictRedis):
     ("JSONRedisBackend should create a redis instance "
@@ -34,6 +46,23 @@ def test_redis_instance(StrictRedis):
     instance.redis.should.equal(StrictRedis.return_value)
 
 
+@patch('lineup.backends.redis.pools')
+@patch('lineup.backends.redis.StrictRedis')
+def test_redis_instance_uri(StrictRedis, pools):
+    ("JSONRedisBackend should connect to the given uri")
+
+    # Given I create an instance of JSONRedisBackend with a uri
+    instance = JSONRedisBackend('redis://2@otherhost:6380')
+
+    # Then it should keep the uri
+    instance.uri.should.equal('redis://2@otherhost:6380')
+
+    # And it should use the connection pool of that uri
+    pools.get.assert_called_once_with('redis://2@otherhost:6380')
+    StrictRedis.assert_called_once_with(
+        connection_pool=pools.get.return_value)
+
+
 @patch('lineup.backends.redis.json')
 def test_serialize(json):
     ("JSONRedisBackend#serialize should return the content json serialized")
@@ -87,6 +116,194 @@ def test_get():
     backend.redis.get.assert_called_once_with("some-key")
 
 
+@operation_test
+def test_lpop_many():
+    ("JSONRedisBackend#lpop_many should atomically take "
+     "the head of the list and deserialize it")
+
+    # Given an instance of a backend that mocks the redis pipeline
+    backend = IsolatedTestBackend()
+    pipeline = backend.redis.pipeline.return_value
+    pipeline.execute.return_value = [["v1", "v2"], True]
+
+    # When I call lpop_many()
+    result = backend.lpop_many("some-key", 3)
+
+    # Then it should return the values deserialized
+    result.should.equal([{"deserialized": "v1"}, {"deserialized": "v2"}])
+
+    # And the pipeline should have read and trimmed the list
+    pipeline.lrange.assert_called_once_with("some-key", 0, 2)
+    pipeline.ltrim.assert_called_once_with("some-key", 3, -1)
+
+
+@operation_test
+def test_lpop_many_nothing():
+    ("JSONRedisBackend#lpop_many should not touch redis "
+     "when asked for no items")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+
+    # When I call lpop_many() with zero items
+    result = backend.lpop_many("some-key", 0)
+
+    # Then it should return an empty list
+    result.should.equal([])
+
+    # And redis should not have been called
+    backend.redis.pipeline.called.should.be.false
+
+
+@operation_test
+def test_reliable_pop():
+    ("JSONRedisBackend#reliable_pop should run the lua script "
+     "and deserialize what it moved")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    script = backend.redis.register_script.return_value
+    script.return_value = ["v1"]
+
+    # When I call reliable_pop()
+    result = backend.reliable_pop("q", "q:processing:c", "q:leases", 2, 1, 99)
+
+    # Then it should return the values deserialized
+    result.should.equal([{"deserialized": "v1"}])
+
+    # And the script should have been called appropriately
+    script.assert_called_once_with(
+        keys=["q", "q:processing:c", "q:leases"], args=[2, 1, 99])
+
+
+def test_hand_off():
+    ("JSONRedisBackend#hand_off should run the lua script with the "
+     "items, the log records and the counters")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    script = backend.redis.register_script.return_value
+
+    # When I call hand_off()
+    result = backend.hand_off(
+        "q", "q:leases", 1, 99, "out", ["i1", "i2"], "log", ["r1"],
+        "stats", {"produced": 2, "consumed": 1})
+
+    # Then it should return what the script returned
+    result.should.equal(script.return_value)
+
+    # And the script should have been called appropriately
+    script.assert_called_once_with(
+        keys=["q", "q:leases", "out", "log", "stats"],
+        args=[1, 99, 2, 1, "i1", "i2", "r1", "consumed", 1,
+              "produced", 2])
+
+
+def test_reliable_bpop():
+    ("JSONRedisBackend#reliable_bpop should renew the lease and "
+     "block on BLMOVE in the same round trip")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    pipeline = backend.redis.pipeline.return_value
+    pipeline.execute.return_value = [1, "v1"]
+
+    # When I call reliable_bpop()
+    result = backend.reliable_bpop("q", "q:processing:c", "q:leases", 5, 99)
+
+    # Then it should return the value deserialized
+    result.should.equal({"deserialized": "v1"})
+
+    # And the pipeline should not be a transaction
+    backend.redis.pipeline.assert_called_once_with(transaction=False)
+
+    # And it should have renewed the lease before blocking
+    pipeline.execute_command.assert_has_calls([
+        call('ZADD', "q:leases", 99, "q:processing:c"),
+        call('BLMOVE', "q", "q:processing:c", 'LEFT', 'RIGHT', 5),
+    ])
+
+
+@operation_test
+def test_reclaim():
+    ("JSONRedisBackend#reclaim should run the lua script")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    script = backend.redis.register_script.return_value
+
+    # When I call reclaim()
+    result = backend.reclaim("q", "q:leases", 1000, 10)
+
+    # Then it should return the result of the script
+    result.should.equal(script.return_value)
+    script.assert_called_once_with(keys=["q", "q:leases"], args=[1000, 10])
+
+
+@operation_test
+def test_zpopmin():
+    ("JSONRedisBackend#zpopmin should strip the sequence off "
+     "the members and deserialize them")
+
+    # Given an instance of a backend that mocks ZPOPMIN
+    backend = IsolatedTestBackend()
+    backend.redis.execute_command.return_value = [
+        "0000000000000001v1", "1",
+        "0000000000000002v2", "2",
+    ]
+
+    # When I call zpopmin()
+    result = backend.zpopmin("some-key", 2)
+
+    # Then it should return the values deserialized
+    result.should.equal([{"deserialized": "v1"}, {"deserialized": "v2"}])
+
+    # And redis should have been called appropriately
+    backend.redis.execute_command.assert_called_once_with(
+        'ZPOPMIN', "some-key", 2)
+
+
+def test_bzpopmin():
+    ("JSONRedisBackend#bzpopmin should block in redis and "
+     "strip the sequence off the member")
+
+    # Given an instance of a backend that mocks BZPOPMIN
+    backend = IsolatedTestBackend()
+    backend.redis.execute_command.return_value = [
+        "some-key", "0000000000000001v1", "1"]
+
+    # When I call bzpopmin()
+    result = backend.bzpopmin("some-key", timeout=3)
+
+    # Then it should return the value deserialized
+    result.should.equal({"deserialized": "v1"})
+
+    # And redis should have been called appropriately
+    backend.redis.execute_command.assert_called_once_with(
+        'BZPOPMIN', "some-key", 3)
+
+
+@operation_test
+def test_zpush():
+    ("JSONRedisBackend#zpush should run the lua script "
+     "with the serialized values")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    script = backend.redis.register_script.return_value
+
+    # When I call zpush()
+    result = backend.zpush("q", "q:sequence", ["v1"], 5, None, 'block')
+
+    # Then it should return the result of the script
+    result.should.equal(script.return_value)
+
+    # And the script should have been called with an unbounded size
+    script.assert_called_once_with(
+        keys=["q", "q:sequence"],
+        args=[5, 0, 'block', {'serialized': 'v1'}])
+
+
 @operation_test
 def test_rpop():
     ("JSONRedisBackend#rpop should return the content json deserialized")
@@ -123,6 +340,99 @@ def test_lpop():
     backend.redis.lpop.assert_called_once_with("some-key")
 
 
+def test_blpop():
+    ("JSONRedisBackend#blpop should block in redis and "
+     "return the content json deserialized")
+
+    # Given an instance of a backend that mocks redis.blpop
+    backend = IsolatedTestBackend()
+    backend.redis.blpop.return_value = ("some-key", "COMING FROM redis.blpop")
+
+    # When I call blpop()
+    result = backend.blpop("some-key", timeout=1.5)
+
+    # Then it should return the value deserialized
+    result.should.equal({'deserialized': 'COMING FROM redis.blpop'})
+
+    # And redis.blpop should have been called with whole seconds
+    backend.redis.blpop.assert_called_once_with("some-key", timeout=2)
+
+
+def test_blpop_timeout():
+    ("JSONRedisBackend#blpop should return None when redis times out")
+
+    # Given an instance of a backend whose redis.blpop times out
+    backend = IsolatedTestBackend()
+    backend.redis.blpop.return_value = None
+
+    # When I call blpop() with a negative timeout
+    result = backend.blpop("some-key", timeout=-1)
+
+    # Then it should return None
+    result.should.be.none
+
+    # And redis should have been told to block forever
+    backend.redis.blpop.assert_called_once_with("some-key", timeout=0)
+
+
+def test_blpop_fractional_timeout():
+    ("JSONRedisBackend#blpop should block for fractions of a second "
+     "on redis 6.0 and newer")
+
+    # Given a backend talking to redis 6.2
+    backend = IsolatedTestBackend()
+    backend.fractional_timeouts = None
+    backend.redis.info.return_value = {'redis_version': '6.2.14'}
+    backend.redis.blpop.return_value = None
+
+    # When I call blpop() twice with less than a second
+    backend.blpop("some-key", timeout=0.25)
+    backend.blpop("some-key", timeout=0.0001)
+
+    # Then redis should have blocked for that long, never 0
+    backend.redis.blpop.call_args_list.should.equal([
+        call("some-key", timeout=0.25),
+        call("some-key", timeout=0.001),
+    ])
+
+    # And the version of the server should have been asked once
+    backend.redis.info.assert_called_once_with('server')
+
+
+def test_blpop_whole_seconds_before_redis_6():
+    ("JSONRedisBackend#blpop should round up to whole seconds "
+     "before redis 6.0")
+
+    # Given a backend talking to redis 5.0
+    backend = IsolatedTestBackend()
+    backend.fractional_timeouts = None
+    backend.redis.info.return_value = {'redis_version': '5.0.14'}
+
+    # When I call blpop() with less than a second
+    backend.blpop("some-key", timeout=0.25)
+
+    # Then redis should have blocked for a second
+    backend.redis.blpop.assert_called_once_with("some-key", timeout=1)
+
+
+def test_brpop():
+    ("JSONRedisBackend#brpop should block in redis and "
+     "return the content json deserialized")
+
+    # Given an instance of a backend that mocks redis.brpop
+    backend = IsolatedTestBackend()
+    backend.redis.brpop.return_value = ("some-key", "COMING FROM redis.brpop")
+
+    # When I call brpop()
+    result = backend.brpop("some-key")
+
+    # Then it should return the value deserialized
+    result.should.equal({'deserialized': 'COMING FROM redis.brpop'})
+
+    # And redis.brpop should have been called to block forever
+    backend.redis.brpop.assert_called_once_with("some-key", timeout=0)
+
+
 @operation_test
 def test_llen():
     ("JSONRedisBackend#llen should return the content json deserialized")
@@ -182,6 +492,187 @@ def test_rpush():
     })
 
 
+@operation_test
+def test_rpush_many():
+    ("JSONRedisBackend#rpush_many should send all the "
+     "serialized values in a single rpush")
+
+    # Given an instance of a backend that mocks redis.rpush
+    backend = IsolatedTestBackend()
+
+    # When I call rpush_many()
+    result = backend.rpush_many("some-key", ["v1", "v2"])
+
+    # Then it should return the result from redis.rpush
+    result.should.equal(backend.redis.rpush.return_value)
+
+    # And redis.rpush should have been called once with every value
+    backend.redis.rpush.assert_called_once_with(
+        "some-key",
+        {'serialized': 'v1'},
+        {'serialized': 'v2'},
+    )
+
+
+def test_get_script():
+    ("JSONRedisBackend#get_script should register the lua "
+     "script once and reuse it")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+
+    # When I get the same script twice
+    first = backend.get_script('bounded_rpush')
+    second = backend.get_script('bounded_rpush')
+
+    # Then it should be the registered script
+    first.should.equal(backend.redis.register_script.return_value)
+    second.should.equal(first)
+
+    # And it should have been registered only once
+    backend.redis.register_script.assert_called_once_with(
+        lua.BOUNDED_RPUSH)
+
+
+@operation_test
+def test_bounded_rpush():
+    ("JSONRedisBackend#bounded_rpush should run the lua "
+     "script with the serialized values")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    script = backend.redis.register_script.return_value
+    script.return_value = 3
+
+    # When I call bounded_rpush()
+    result = backend.bounded_rpush("some-key", ["v1", "v2"], 10, 'reject')
+
+    # Then it should return the size from the script
+    result.should.equal(3)
+
+    # And the script should have been called appropriately
+    script.assert_called_once_with(
+        keys=["some-key"],
+        args=[10, 'reject', {'serialized': 'v1'}, {'serialized': 'v2'}],
+    )
+
+
+@operation_test
+@patch('lineup.backends.redis.uuid')
+def test_schedule(uuid):
+    ("JSONRedisBackend#schedule should add the serialized values "
+     "to the zset under unique members")
+
+    uuid.uuid4.return_value.hex = 'f' * 32
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    backend.serialize = lambda value: value
+
+    # When I call schedule()
+    result = backend.schedule("q:delayed", ["v1", "v2"], 1000)
+
+    # Then it should return the result of ZADD
+    result.should.equal(backend.redis.execute_command.return_value)
+
+    # And every member should have been scored with the due time
+    backend.redis.execute_command.assert_called_once_with(
+        'ZADD', "q:delayed",
+        1000, 'f' * 32 + "v1",
+        1000, 'f' * 32 + "v2",
+    )
+
+
+@operation_test
+def test_dedup_push():
+    ("JSONRedisBackend#dedup_push should run the lua script with one "
+     "marker per value")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    backend.serialize = lambda value: value
+    script = backend.redis.register_script.return_value
+
+    # When I call dedup_push()
+    result = backend.dedup_push("q", ["q:seen:a", "q:seen:b"],
+                                ["v1", "v2"], 0.5)
+
+    # Then it should return how many values the script pushed
+    result.should.equal(script.return_value)
+
+    # And the ttl should have been rounded up to whole seconds
+    script.assert_called_once_with(
+        keys=["q", "q:seen:a", "q:seen:b"], args=[1, '', "v1", "v2"])
+
+
+@operation_test
+@patch('lineup.backends.redis.uuid')
+def test_dedup_push_delayed(uuid):
+    ("JSONRedisBackend#dedup_push should add unique members to the "
+     "zset of delayed items when given a due time")
+
+    uuid.uuid4.return_value.hex = 'f' * 32
+
+    backend = IsolatedTestBackend()
+    backend.serialize = lambda value: value
+    script = backend.redis.register_script.return_value
+
+    backend.dedup_push("q:delayed", ["q:seen:a"], ["v1"], 60, 1000)
+
+    script.assert_called_once_with(
+        keys=["q:delayed", "q:seen:a"], args=[60, 1000, 'f' * 32 + "v1"])
+
+
+@operation_test
+def test_bloom_push():
+    ("JSONRedisBackend#bloom_push should pass the bit offsets of each "
+     "value to the lua script")
+
+    # Given an instance of a backend
+    backend = IsolatedTestBackend()
+    backend.serialize = lambda value: value
+    backend.get_bloom_offsets = lambda id, bits, hashes: [id] * hashes
+    script = backend.redis.register_script.return_value
+
+    # When I call bloom_push()
+    result = backend.bloom_push("q", ["q:seen:10", "q:seen:9"],
+                                ["a", "b"], ["v1", "v2"], 120, 1024, 2)
+
+    # Then it should return how many values the script pushed
+    result.should.equal(script.return_value)
+    script.assert_called_once_with(
+        keys=["q", "q:seen:10", "q:seen:9"],
+        args=[120, '', 2, "a", "a", "v1", "b", "b", "v2"])
+
+
+def test_get_bloom_offsets():
+    ("JSONRedisBackend#get_bloom_offsets should spread a key over "
+     "the filter, always the same way")
+
+    backend = IsolatedTestBackend()
+
+    offsets = backend.get_bloom_offsets(b'http://example.com', 1024, 7)
+    offsets.should.have.length_of(7)
+    offsets.should.equal(
+        backend.get_bloom_offsets(b'http://example.com', 1024, 7))
+    all(0 <= offset < 1024 for offset in offsets).should.be.true
+    offsets.should_not.equal(
+        backend.get_bloom_offsets(b'http://example.org', 1024, 7))
+
+
+@operation_test
+def test_promote():
+    ("JSONRedisBackend#promote should run the lua script")
+
+    backend = IsolatedTestBackend()
+    script = backend.redis.register_script.return_value
+
+    result = backend.promote("q:delayed", "q", 1000, 50)
+
+    result.should.equal(script.return_value)
+    script.assert_called_once_with(keys=["q:delayed", "q"], args=[1000, 50])
+
+
 @operation_test
 def test_lpush():
     ("JSONRedisBackend#lpush should send the serialized data to redis")
@@ -254,3 +745,399 @@ def test_report_steps():
         call(u'some-name:producers', u'p1'),
         call(u'some-name:producers', u'p2')
     ])
+
+
+@operation_test
+def test_xadd_many():
+    ("StreamsRedisBackend#xadd_many should add every value to the "
+     "stream in a single round trip, trimming it")
+
+    # Given an instance of a backend
+    backend = IsolatedStreamsBackend()
+    pipeline = backend.redis.pipeline.return_value
+
+    # When I call xadd_many()
+    result = backend.xadd_many("q", ["v1", "v2"], 1000)
+
+    # Then it should return the ids
+    result.should.equal(pipeline.execute.return_value)
+
+    # And the values should have been added to the stream
+    pipeline.xadd.assert_has_calls([
+        call("q", {'payload': {'serialized': "v1"}},
+             maxlen=1000, approximate=True),
+        call("q", {'payload': {'serialized': "v2"}},
+             maxlen=1000, approximate=True),
+    ])
+
+
+@operation_test
+def test_xgroup_create_existing():
+    ("StreamsRedisBackend#xgroup_create should ignore existing groups")
+
+    # Given an instance of a backend whose group already exists
+    backend = IsolatedStreamsBackend()
+    backend.redis.xgroup_create.side_effect = ResponseError(
+        'BUSYGROUP Consumer Group name already exists')
+
+    # When I call xgroup_create()
+    backend.xgroup_create("q", "g")
+
+    # Then it should have created the group from the start
+    backend.redis.xgroup_create.assert_called_once_with(
+        "q", "g", id='0', mkstream=True)
+
+
+@operation_test
+def test_xgroup_create_error():
+    ("StreamsRedisBackend#xgroup_create should raise other errors")
+
+    backend = IsolatedStreamsBackend()
+    backend.redis.xgroup_create.side_effect = ResponseError('WRONGTYPE')
+
+    backend.xgroup_create.when.called_with("q", "g").should.throw(
+        ResponseError)
+
+
+@operation_test
+def test_xreadgroup():
+    ("StreamsRedisBackend#xreadgroup should ack and read in the same "
+     "round trip")
+
+    # Given an instance of a backend
+    backend = IsolatedStreamsBackend()
+    pipeline = backend.redis.pipeline.return_value
+    pipeline.execute.return_value = [2, [
+        ["q", [("1-0", {'payload': "v1"}), ("2-0", None)]],
+    ]]
+
+    # When I call xreadgroup()
+    result = backend.xreadgroup("q", "g", "c", ["0-1", "0-2"], 10)
+
+    # Then it should return the ids and values deserialized, skipping
+    # the deleted entries
+    result.should.equal([("1-0", {"deserialized": "v1"})])
+
+    # And it should have acked and read
+    pipeline.xack.assert_called_once_with("q", "g", "0-1", "0-2")
+    pipeline.xreadgroup.assert_called_once_with(
+        "g", "c", {"q": '>'}, count=10)
+
+
+@operation_test
+def test_xautoclaim():
+    ("StreamsRedisBackend#xautoclaim should claim the stuck entries")
+
+    # Given an instance of a backend
+    backend = IsolatedStreamsBackend()
+    pipeline = backend.redis.pipeline.return_value
+    pipeline.execute.return_value = [
+        ["0-0", [["1-0", ['payload', "v1"]], None], []],
+    ]
+
+    # When I call xautoclaim() without acks
+    result = backend.xautoclaim("q", "g", "c", [], 30000, 10)
+
+    # Then it should return the claimed entries
+    result.should.equal([("1-0", {"deserialized": "v1"})])
+
+    # And it should not have acked anything
+    pipeline.xack.called.should.be.false
+    pipeline.execute_command.assert_called_once_with(
+        'XAUTOCLAIM', "q", "g", "c", 30000, '0-0', 'COUNT', 10)
+
+
+def test_bxreadgroup():
+    ("StreamsRedisBackend#bxreadgroup should block in milliseconds")
+
+    # Given an instance of a backend
+    backend = IsolatedStreamsBackend()
+    backend.redis.xreadgroup.return_value = [
+        ["q", [("1-0", {'payload': "v1"})]],
+    ]
+
+    # When I call bxreadgroup()
+    result = backend.bxreadgroup("q", "g", "c", 10, timeout=1.5)
+
+    # Then it should return the entries
+    result.should.equal([("1-0", {"deserialized": "v1"})])
+    backend.redis.xreadgroup.assert_called_once_with(
+        "g", "c", {"q": '>'}, count=10, block=2000)
+
+
+def test_bxreadgroup_timeout():
+    ("StreamsRedisBackend#bxreadgroup should return nothing on timeout")
+
+    backend = IsolatedStreamsBackend()
+    backend.redis.xreadgroup.return_value = None
+
+    backend.bxreadgroup("q", "g", "c", 10).should.equal([])
+
+
+class FakeBlobStore(dict):
+    def put(self, value):
+        id = 'blob{0}'.format(len(self))
+        self[id] = value
+        return id
+
+
+@patch('lineup.backends.redis.StrictRedis')
+def test_claim_check(StrictRedis):
+    ("JSONRedisBackend should keep the long fields in the blob store "
+     "and only fetch them when read")
+
+    # Given a backend with a blob store
+    backend = JSONRedisBackend()
+    backend.blobs = FakeBlobStore()
+    backend.blob_threshold = 20
+
+    # When I serialize a payload with a long nested field
+    product = backend.serialize({
+        'url': 'http://example.com',
+        'download': {'content': 'x' * 30, 'status_code': 200},
+    })
+
+    # Then the field should have gone to the blob store
+    dict(backend.blobs).should.equal({'blob0': '"{0}"'.format('x' * 30)})
+    product.should_not.contain('x' * 30)
+
+    # When I deserialize it
+    payload = backend.deserialize(product)
+
+    # Then the field should be a reference that resolves when read
+    download = payload['download']
+    download.should.be.a(LineUpPayloadDict)
+    dict.get(download, 'content').should.be.a(BlobReference)
+    download['content'].should.equal('x' * 30)
+
+    # And passing it along should not store it again
+    backend.serialize(payload)
+    backend.blobs.should.have.length_of(1)
+
+
+@patch('lineup.backends.redis.StrictRedis')
+def test_serializer(StrictRedis):
+    ("JSONRedisBackend should write with its serializer and read the "
+     "items of any serializer")
+
+    # Given a backend that pickles and one that writes plain JSON
+    pickling = JSONRedisBackend()
+    pickling.serializer = get_serializer('pickle')
+    plain = JSONRedisBackend()
+
+    payload = {'content': b'\x89PNG\x00', 'status_code': 200}
+
+    # When the pickling one writes an item
+    product = pickling.serialize(payload)
+
+    # Then it should be framed
+    product[:2].should.equal(b'\x00p')
+
+    # And it should read it, and the plain JSON items too
+    pickling.deserialize(product).should.equal(payload)
+    pickling.deserialize(plain.serialize({'a': 1})).should.equal({'a': 1})
+
+    # But the plain JSON one should refuse to unpickle it
+    plain.deserialize.when.called_with(product).should.throw(
+        ValueError, 'refusing an item of the pickle serializer, '
+        'the queue reads json')
+
+
+@patch('lineup.backends.redis.StrictRedis')
+def test_compression(StrictRedis):
+    ("JSONRedisBackend should compress the long items it writes and "
+     "read compressed items either way")
+
+    # Given a backend that compresses and one that doesn't
+    compressing = JSONRedisBackend()
+    compressing.serializer = get_serializer('pickle')
+    compressing.compression = Compression('zlib', threshold=100)
+    plain = JSONRedisBackend()
+    plain.serializer = get_serializer('pickle')
+
+    payload = {'body': '<p>lineup</p>' * 100}
+
+    # When the compressing one writes an item
+    product = compressing.serialize(payload)
+
+    # Then it should be compressed
+    product[:2].should.equal(b'\x00Z')
+
+    # And both should read it
+    plain.deserialize(product).should.equal(payload)
+    compressing.deserialize(product).should.equal(payload)
+    compressing.compression.get_stats()['decompressed'].should.equal(1)
+
+
+@patch('lineup.backends.redis.StrictRedis')
+def test_serializer_claim_check(StrictRedis):
+    ("JSONRedisBackend should keep the blobs with its serializer")
+
+    backend = JSONRedisBackend()
+    backend.serializer = get_serializer('pickle')
+    backend.blobs = FakeBlobStore()
+    backend.blob_threshold = 5
+
+    payload = backend.deserialize(backend.serialize({
+        'content': b'\x00' * 10}))
+
+    backend.blobs['blob0'][:2].should.equal(b'\x00p')
+    payload['content'].should.equal(b'\x00' * 10)
+
+    # When a step passes the payload along without reading it
+    first = LineUpPayloadDict(backend.deserialize(backend.serialize({
+        'content': b'\x00' * 10})))
+    second = LineUpPayloadDict(backend.deserialize(backend.serialize(
+        first)))
+
+    # And the next one reads it before passing it along
+    second['content'].should.equal(b'\x00' * 10)
+    third = backend.deserialize(backend.serialize(second))
+
+    # Then the references travel without the blob, stored only once
+    third['content'].should.equal(b'\x00' * 10)
+    sorted(backend.blobs).should.equal(['blob0', 'blob1'])
+    len(backend.serialize(second)).should.be.lower_than(100)
+
+
+@patch('lineup.backends.redis.StrictRedis')
+@patch('lineup.backends.redis.make_blob_store')
+def test_blob_store_from_environment(make_blob_store, StrictRedis):
+    ("JSONRedisBackend should make its blob store from "
+     "LINEUP_BLOB_STORE")
+
+    with patch.dict('os.environ', {'LINEUP_BLOB_STORE': 'redis'}):
+        backend = JSONRedisBackend()
+
+    backend.blobs.should.equal(make_blob_store.return_value)
+    make_blob_store.assert_called_once_with(
+        'redis', StrictRedis.return_value, 86400)
+
+
+@patch('lineup.backends.redis.StrictRedis')
+@patch('lineup.backends.redis.coalescers')
+def test_write_behind_from_environment(coalescers, StrictRedis):
+    ("JSONRedisBackend should hold its pushes back in a write "
+     "coalescer when LINEUP_REDIS_LINGER is set")
+
+    # Given a backend configured to linger
+    with patch.dict('os.environ', {'LINEUP_REDIS_LINGER': '0.005',
+                                   'LINEUP_REDIS_BATCH_SIZE': '50'}):
+        backend = JSONRedisBackend('redis://0@localhost:6379')
+
+    coalescer = coalescers.get.return_value
+    backend.coalescer.should.equal(coalescer)
+    coalescers.get.assert_called_once_with(
+        'redis://0@localhost:6379', StrictRedis.return_value, 0.005, 50)
+
+    # When it pushes
+    backend.rpush('q', {'n': 1})
+    backend.rpush_many('q', [{'n': 2}, {'n': 3}])
+    backend.flush()
+
+    # Then the pushes should go through the coalescer
+    coalescer.rpush.assert_has_calls([
+        call('q', ['{"n": 1}']),
+        call('q', ['{"n": 2}', '{"n": 3}']),
+    ])
+    coalescer.flush.assert_called_once_with()
+    StrictRedis.return_value.rpush.called.should.be.false
+
+
+@patch('lineup.backends.redis.StrictRedis')
+def test_write_behind_off(StrictRedis):
+    ("JSONRedisBackend should push right away by default")
+
+    backend = JSONRedisBackend()
+
+    backend.coalescer.should.be.none
+    backend.flush()
+
+
+@operation_test
+def test_lpop_many_raw():
+    ("JSONRedisBackend#lpop_many_raw should take the values as stored")
+
+    backend = IsolatedTestBackend()
+    pipeline = backend.redis.pipeline.return_value
+    pipeline.execute.return_value = [["v1", "v2"], True]
+
+    backend.lpop_many_raw("q", 2).should.equal(["v1", "v2"])
+
+    pipeline.lrange.assert_called_once_with("q", 0, 1)
+    pipeline.ltrim.assert_called_once_with("q", 2, -1)
+    backend.json.deserialize.called.should.be.false
+
+
+@operation_test
+def test_lrange_raw():
+    ("JSONRedisBackend#lrange_raw should read a window of the list")
+
+    backend = IsolatedTestBackend()
+
+    backend.lrange_raw("q", 10, 5).should.equal(
+        backend.redis.lrange.return_value)
+    backend.redis.lrange.assert_called_once_with("q", 10, 14)
+
+
+@operation_test
+def test_rpush_raw():
+    ("JSONRedisBackend#rpush_raw should push every batch in a single "
+     "round trip")
+
+    backend = IsolatedTestBackend()
+    pipeline = backend.redis.pipeline.return_value
+
+    backend.rpush_raw("q", [["v1", "v2"], ["v3"]])
+
+    backend.redis.pipeline.assert_called_once_with(transaction=False)
+    pipeline.rpush.assert_has_calls([
+        call("q", "v1", "v2"),
+        call("q", "v3"),
+    ])
+    pipeline.execute.assert_called_once_with()
+
+
+@operation_test
+def test_zpop_many_raw():
+    ("JSONRedisBackend#zpop_many_raw should take the members with "
+     "their scores")
+
+    backend = IsolatedTestBackend()
+    pipeline = backend.redis.pipeline.return_value
+    pipeline.execute.return_value = [[("m1", 1.0), ("m2", 2.5)], 2]
+
+    backend.zpop_many_raw("z", 2).should.equal([("m1", 1.0), ("m2", 2.5)])
+
+    pipeline.zrange.assert_called_once_with("z", 0, 1, withscores=True)
+    pipeline.zremrangebyrank.assert_called_once_with("z", 0, 1)
+
+
+@operation_test
+def test_zrange_raw():
+    ("JSONRedisBackend#zrange_raw should read a window of the zset")
+
+    backend = IsolatedTestBackend()
+
+    backend.zrange_raw("z", 10, 5).should.equal(
+        backend.redis.zrange.return_value)
+    backend.redis.zrange.assert_called_once_with(
+        "z", 10, 14, withscores=True)
+
+
+@operation_test
+def test_zadd_raw():
+    ("JSONRedisBackend#zadd_raw should add every batch in a single "
+     "round trip")
+
+    backend = IsolatedTestBackend()
+    pipeline = backend.redis.pipeline.return_value
+
+    backend.zadd_raw("z", [[("m1", 1.0), ("m2", 2.5)], [("m3", 3.0)]])
+
+    backend.redis.pipeline.assert_called_once_with(transaction=False)
+    pipeline.execute_command.assert_has_calls([
+        call('ZADD', "z", 1.0, "m1", 2.5, "m2"),
+        call('ZADD', "z", 3.0, "m3"),
+    ])
+    pipeline.execute.assert_called_once_with()
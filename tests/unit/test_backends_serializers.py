@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+from mock import patch
+from nose import SkipTest
+
+from lineup.backends import serializers
+from lineup.backends.serializers import (
+    get_serializer, decode, is_framed, Serializer, JSONSerializer,
+    PickleSerializer,
+)
+
+PAYLOAD = {'url': 'http://example.com/', 'attempts': [1, 2]}
+
+
+def test_json_is_not_framed():
+    ("the json serializer should write plain JSON, for older consumers")
+
+    product = get_serializer('json').encode(PAYLOAD)
+
+    is_framed(product).should.be.false
+    product.should.equal(JSONSerializer().dumps(PAYLOAD))
+
+
+def test_serializer_is_abstract():
+    ("a serializer should implement dumps and loads")
+
+    class Incomplete(Serializer):
+        name = 'incomplete'
+        code = b'i'
+
+        def dumps(self, value):
+            return b''
+
+    Incomplete.when.called_with().should.throw(TypeError)
+
+
+def test_pickle_round_trip():
+    ("the pickle serializer should round-trip binary content")
+
+    payload = {'content': b'\x89PNG\r\n\x00\xff'}
+    product = get_serializer('pickle').encode(payload)
+
+    is_framed(product).should.be.true
+    product[:2].should.equal(b'\x00p')
+    decode(product, get_serializer('pickle')).should.equal(payload)
+
+
+def test_pickle_opt_in():
+    ("decode should only unpickle the items of queues that use pickle")
+
+    product = get_serializer('pickle').encode({'a': 1})
+
+    decode.when.called_with(product).should.throw(
+        ValueError, 'refusing an item of the pickle serializer, '
+        'the queue reads json')
+    decode.when.called_with(
+        product, get_serializer('json')).should.throw(
+        ValueError, 'refusing an item of the pickle serializer, '
+        'the queue reads json')
+
+
+def test_msgpack_round_trip():
+    ("the msgpack serializer should round-trip text and binary content")
+
+    if serializers.msgpack is None:
+        raise SkipTest('msgpack is not installed')
+
+    payload = {'url': 'http://example.com/', 'content': b'\x00\xff'}
+    decode(get_serializer('msgpack').encode(payload)).should.equal(payload)
+
+
+def test_msgpack_missing():
+    ("the msgpack serializer should tell when msgpack isn't installed")
+
+    with patch.object(serializers, 'msgpack', None):
+        serializers.MsgpackSerializer.when.called_with().should.throw(
+            RuntimeError, 'the msgpack serializer requires msgpack, '
+            'run: pip install msgpack')
+
+
+def test_get_serializer():
+    ("get_serializer should know the registered serializers by name")
+
+    get_serializer('pickle').should.be.a(PickleSerializer)
+    get_serializer('pickle').should.be(get_serializer('pickle'))
+
+    serializer = PickleSerializer()
+    get_serializer(serializer).should.be(serializer)
+
+    get_serializer.when.called_with('yaml').should.throw(
+        ValueError, 'serializer must be one of json, msgpack, pickle, '
+        'got yaml')
+
+
+def test_unknown_code():
+    ("decode should refuse the items of an unknown serializer")
+
+    decode.when.called_with(b'\x00zdata').should.throw(
+        ValueError, "unknown serializer code 'z'")
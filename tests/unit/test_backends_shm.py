@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import os
+import fcntl
+import shutil
+import tempfile
+from multiprocessing import Process
+from threading import Timer
+
+from lineup import Step, Pipeline
+from lineup.core import LineUpQueueFull
+from lineup.backends.shm import SharedMemoryBackend, RingBuffer
+
+DIRECTORY = None
+
+
+def setup():
+    global DIRECTORY
+    DIRECTORY = tempfile.mkdtemp()
+
+
+def teardown():
+    shutil.rmtree(DIRECTORY)
+
+
+def make_backend(name, **attributes):
+    directory = os.path.join(DIRECTORY, name)
+    backend = SharedMemoryBackend(directory)
+    backend.__dict__.update(attributes)
+    return backend
+
+
+def test_lists():
+    ("SharedMemoryBackend should push and pop copies of the items")
+
+    backend = make_backend('lists')
+    item = {'some': 'item'}
+
+    backend.rpush('q', item).should.equal(1)
+    backend.rpush_many('q', ['two', 'three']).should.equal(3)
+    backend.lpush('q', 'zero').should.equal(4)
+
+    backend.llen('q').should.equal(4)
+    backend.lrange('q', 0, 1).should.equal(['zero', item])
+    backend.lrange('q', 1, -1).should.equal([item, 'two', 'three'])
+    backend.key_type('q').should.equal('list')
+
+    backend.lpop('q').should.equal('zero')
+    backend.lpop('q').should.equal(item)
+    backend.lpop_many('q', 10).should.equal(['two', 'three'])
+    backend.lpop('q').should.be.none
+
+
+def test_ring_wraps_around():
+    ("RingBuffer should keep the frames that wrap around its end")
+
+    path = os.path.join(DIRECTORY, 'small.ring')
+    ring = RingBuffer(path, 64)
+
+    for n in range(20):
+        ring.push([b'abcdefghij', b'%d' % n]).should.equal(2)
+        ring.pop(2).should.equal([b'abcdefghij', b'%d' % n])
+
+    len(ring).should.equal(0)
+
+
+def test_ring_full():
+    ("RingBuffer should refuse what doesn't fit")
+
+    ring = RingBuffer(os.path.join(DIRECTORY, 'full.ring'), 32)
+
+    ring.push([b'a' * 10, b'b' * 10]).should.equal(2)
+    ring.push([b'c' * 10]).should.equal(-1)
+    ring.push.when.called_with([b'd' * 40]).should.throw(LineUpQueueFull)
+    ring.pop(10).should.equal([b'a' * 10, b'b' * 10])
+
+
+def test_ring_nested_locks():
+    ("RingBuffer should hold its flock until the outermost block exits")
+
+    path = os.path.join(DIRECTORY, 'nested.ring')
+    ring = RingBuffer(path, 64)
+    other = os.open(path, os.O_RDWR)
+
+    def held():
+        # a second open file description competes for the flock like
+        # another process would
+        try:
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return True
+
+        fcntl.flock(other, fcntl.LOCK_UN)
+        return False
+
+    # When a push and a pop nest in a locked block
+    with ring.locked():
+        ring.push([b'a', b'b'])
+        ring.pop(1)
+
+        # Then the flock is still held
+        held().should.be.true
+
+    # And released afterwards
+    held().should.be.false
+    os.close(other)
+
+
+def test_push_timeout():
+    ("SharedMemoryBackend#rpush should give up on a ring that stays full")
+
+    backend = make_backend('timeout', ring_size=32, push_timeout=0.05)
+    backend.rpush('q', 'a' * 20)
+
+    backend.rpush.when.called_with('q', 'b' * 20).should.throw(
+        LineUpQueueFull)
+
+
+def test_values():
+    ("SharedMemoryBackend should keep values")
+
+    backend = make_backend('values')
+    backend.get('k').should.be.none
+    backend.set('k', 'open')
+    backend.get('k').should.equal('open')
+    backend.key_type('k').should.equal('string')
+    backend.key_type('nothing').should.equal('none')
+
+
+def test_blpop():
+    ("SharedMemoryBackend#blpop should wait for an item")
+
+    backend = make_backend('blpop')
+    Timer(0.05, backend.rpush, ['later', 'item']).start()
+
+    backend.blpop(['empty', 'later'], timeout=2).should.equal('item')
+    backend.blpop('empty', timeout=0.05).should.be.none
+
+
+def test_bounded_rpush():
+    ("SharedMemoryBackend#bounded_rpush should follow the overflow policy")
+
+    backend = make_backend('bounded')
+    backend.bounded_rpush('b', [1, 2], 3, 'block').should.equal(2)
+    backend.bounded_rpush('b', [3, 4], 3, 'reject').should.equal(-1)
+    backend.bounded_rpush('b', [3, 4], 3, 'drop-oldest').should.equal(3)
+    backend.lrange('b', 0, -1).should.equal([2, 3, 4])
+
+
+def test_log_length():
+    ("SharedMemoryBackend should only keep the latest step logs")
+
+    backend = make_backend('logs', ring_size=64, push_timeout=0.05)
+
+    # When more logs are pushed than the ring can hold
+    for n in range(100):
+        backend.rpush('lineup:step:logging', n)
+
+    # Then the oldest make room for the latest
+    backend.lrange('lineup:step:logging', 0, -1).should.equal(
+        range(100)[-backend.llen('lineup:step:logging'):])
+    backend.llen('lineup:step:logging').should.be.greater_than(0)
+
+    # And no more than log_length of them are kept
+    backend.log_length = 2
+    backend.rpush_many('lineup:step:logging', ['a', 'b', 'c'])
+    backend.lrange('lineup:step:logging', 0, -1).should.equal(['b', 'c'])
+
+
+def test_report_steps():
+    ("SharedMemoryBackend#report_steps should gather every step ever seen")
+
+    backend = make_backend('steps')
+    backend.report_steps('q', ['c1'], ['p1'])
+    backend.report_steps('q', ['c2'], []).should.equal(
+        (set(['c1', 'c2']), set(['p1'])))
+
+
+def produce(directory, count):
+    backend = SharedMemoryBackend(directory)
+    for n in range(count):
+        backend.rpush('between', {'n': n})
+
+
+def test_between_processes():
+    ("SharedMemoryBackend should hand items over to other processes")
+
+    directory = os.path.join(DIRECTORY, 'processes')
+    producers = [Process(target=produce, args=(directory, 50))
+                 for n in range(2)]
+    for producer in producers:
+        producer.start()
+
+    backend = SharedMemoryBackend(directory)
+    received = [backend.blpop('between', timeout=5) for n in range(100)]
+    for producer in producers:
+        producer.join()
+
+    sorted(item['n'] for item in received).should.equal(
+        sorted(range(50) * 2))
+
+
+def test_pipeline():
+    ("Pipeline should run on top of the SharedMemoryBackend")
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'n': instructions['n'] * 2})
+
+    class Shared(Pipeline):
+        name = 'shared-memory'
+        steps = [Double, Double]
+        timeout = 0.05
+
+    os.environ['LINEUP_SHM_DIRECTORY'] = os.path.join(DIRECTORY, 'pipe')
+    try:
+        manager = Shared(SharedMemoryBackend)
+    finally:
+        del os.environ['LINEUP_SHM_DIRECTORY']
+
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(10)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(10)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    results.should.equal([{'n': n * 4} for n in range(10)])
+
+
+def test_pipeline_retries():
+    ("Pipeline should retry the items that failed right away, since the "
+     "SharedMemoryBackend has no delayed delivery")
+
+    class Flaky(Step):
+        max_attempts = 3
+
+        def consume(self, instructions):
+            retry = instructions.get('__lineup__retry__') or {}
+            if not retry:
+                raise ValueError('first attempt')
+
+            self.produce({'n': instructions['n'],
+                          'attempts': retry['attempts'] + 1})
+
+    class Retrying(Pipeline):
+        name = 'shared-memory-retries'
+        steps = [Flaky]
+        timeout = 0.05
+
+    os.environ['LINEUP_SHM_DIRECTORY'] = os.path.join(DIRECTORY, 'retries')
+    try:
+        manager = Retrying(SharedMemoryBackend)
+    finally:
+        del os.environ['LINEUP_SHM_DIRECTORY']
+
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(3)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(3)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    results.should.equal([{'n': n, 'attempts': 2} for n in range(3)])
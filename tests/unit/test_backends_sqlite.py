@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+from threading import Timer, Thread
+
+from lineup import Step, Pipeline
+from lineup.backends.sqlite import SQLiteBackend
+
+DIRECTORY = None
+
+
+def setup():
+    global DIRECTORY
+    DIRECTORY = tempfile.mkdtemp()
+
+
+def teardown():
+    shutil.rmtree(DIRECTORY)
+
+
+def make_backend(name, **kwargs):
+    return SQLiteBackend(os.path.join(DIRECTORY, name + '.db'), **kwargs)
+
+
+def test_lists():
+    ("SQLiteBackend should push and pop the items in order")
+
+    backend = make_backend('lists')
+    item = {'some': 'item'}
+
+    backend.rpush('q', item).should.equal(1)
+    backend.rpush_many('q', ['two', 'three']).should.equal(3)
+    backend.lpush('q', 'zero').should.equal(4)
+    backend.rpush('other', 'elsewhere')
+
+    backend.llen('q').should.equal(4)
+    backend.lrange('q', 0, 1).should.equal(['zero', item])
+    backend.lrange('q', 1, -1).should.equal([item, 'two', 'three'])
+
+    backend.lpop('q').should.equal('zero')
+    backend.lpop('q').should.equal(item)
+    backend.rpop('q').should.equal('three')
+    backend.lpop_many('q', 10).should.equal(['two'])
+    backend.lpop('q').should.be.none
+    backend.lpop('other').should.equal('elsewhere')
+
+
+def test_survives_a_restart():
+    ("SQLiteBackend should find the items of a previous instance")
+
+    make_backend('restart').rpush_many('q', [1, 2])
+    make_backend('restart').lpop_many('q', 10).should.equal([1, 2])
+
+
+def test_synchronous():
+    ("SQLiteBackend should set the synchronous mode of its connections")
+
+    backend = make_backend('full', synchronous='full')
+    backend.synchronous.should.equal('FULL')
+    backend.connection.execute(
+        'PRAGMA synchronous').fetchone()[0].should.equal(2)
+    backend.connection.execute(
+        'PRAGMA journal_mode').fetchone()[0].should.equal('wal')
+
+    make_backend.when.called_with('bad', synchronous='sometimes').should.throw(
+        ValueError)
+
+
+def test_connection_per_thread():
+    ("SQLiteBackend should open a connection per thread")
+
+    backend = make_backend('threads')
+    connections = []
+    thread = Thread(target=lambda: connections.append(backend.connection))
+    thread.start()
+    thread.join()
+
+    connections[0].should_not.be(backend.connection)
+
+
+def test_values():
+    ("SQLiteBackend should keep values")
+
+    backend = make_backend('values')
+    backend.get('k').should.be.none
+    backend.set('k', 'open')
+    backend.set('k', 'closed')
+    backend.get('k').should.equal('closed')
+    backend.key_type('k').should.equal('string')
+    backend.key_type('nothing').should.equal('none')
+
+
+def test_blpop():
+    ("SQLiteBackend#blpop should wait for an item")
+
+    backend = make_backend('blpop')
+    Timer(0.05, backend.rpush, ['later', 'item']).start()
+
+    backend.blpop(['empty', 'later'], timeout=2).should.equal('item')
+    backend.blpop('empty', timeout=0.05).should.be.none
+
+
+def test_bounded_rpush():
+    ("SQLiteBackend#bounded_rpush should follow the overflow policy")
+
+    backend = make_backend('bounded')
+    backend.bounded_rpush('b', [1, 2], 3, 'block').should.equal(2)
+    backend.bounded_rpush('b', [3, 4], 3, 'reject').should.equal(-1)
+    backend.bounded_rpush('b', [3, 4], 3, 'drop-oldest').should.equal(3)
+    backend.lrange('b', 0, -1).should.equal([2, 3, 4])
+
+
+def test_schedule_promote():
+    ("SQLiteBackend#promote should move the due items in order")
+
+    backend = make_backend('delayed')
+    backend.schedule('d', ['later'], 200)
+    backend.schedule('d', ['soon', 'sooner'], 100)
+
+    backend.promote('d', 'q', 150, 10).should.equal(2)
+    backend.lrange('q', 0, -1).should.equal(['soon', 'sooner'])
+    backend.promote('d', 'q', 250, 10).should.equal(1)
+    backend.lpop_many('q', 10).should.equal(['soon', 'sooner', 'later'])
+
+
+def test_promote_nothing_due():
+    ("SQLiteBackend#promote shouldn't take the write lock when nothing "
+     "is due")
+
+    backend = make_backend('nothing-due')
+    backend.schedule('d', ['later'], 200)
+
+    # Given another connection holding the write lock
+    other = make_backend('nothing-due')
+    with other.transaction():
+        # Then a promote with nothing due doesn't wait for it
+        backend.promote('d', 'q', 150, 10).should.equal(0)
+
+    backend.promote('d', 'q', 250, 10).should.equal(1)
+
+
+def test_log_length():
+    ("SQLiteBackend should only keep the latest step logs")
+
+    backend = make_backend('logs')
+    backend.log_length = 2
+    for n in range(5):
+        backend.rpush('lineup:step:logging', n)
+
+    backend.lrange('lineup:step:logging', 0, -1).should.equal([3, 4])
+    backend.llen('lineup:step:logging').should.equal(2)
+
+
+def test_report_steps():
+    ("SQLiteBackend#report_steps should gather every step ever seen")
+
+    backend = make_backend('steps')
+    backend.report_steps('q', ['c1'], ['p1'])
+    backend.report_steps('q', ['c2'], []).should.equal(
+        (set(['c1', 'c2']), set(['p1'])))
+
+
+def test_pipeline():
+    ("Pipeline should run on top of the SQLiteBackend")
+
+    class Double(Step):
+        def consume(self, instructions):
+            self.produce({'n': instructions['n'] * 2})
+
+    class Durable(Pipeline):
+        name = 'sqlite'
+        steps = [Double, Double]
+        timeout = 0.05
+
+    os.environ['LINEUP_SQLITE_PATH'] = os.path.join(DIRECTORY, 'pipe.db')
+    try:
+        manager = Durable(SQLiteBackend)
+    finally:
+        del os.environ['LINEUP_SQLITE_PATH']
+
+    manager.run_daemon()
+    manager.feed_many([{'n': n} for n in range(10)])
+
+    results = [manager.output.get(wait=True, timeout=2) for n in range(10)]
+    manager.stop()
+    for worker in manager.workers:
+        worker.join(1)
+
+    results.should.equal([{'n': n * 4} for n in range(10)])
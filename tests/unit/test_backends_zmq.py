@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+from mock import Mock, patch
+
+from lineup import Step, Pipeline, MemoryBackend
+from lineup.core import LineUpQueueFull
+from lineup.steps import KeyMaker
+from lineup.backends.redis import JSONRedisBackend
+from lineup.backends.zmq import ZMQBackend
+
+
+def make_backend():
+    # is_control only needs the class, so pyzmq doesn't have to be
+    # installed
+    return object.__new__(ZMQBackend)
+
+
+def test_is_control_pipeline_keys():
+    ("ZMQBackend#is_control should send the queues of a pipeline over "
+     "zmq and keep the keys of its steps in redis")
+
+    class Double(Step):
+        pass
+
+    class Channels(Pipeline):
+        name = 'zmq-routing'
+        steps = [Double, Double]
+
+    backend = make_backend()
+    manager = Channels(MemoryBackend)
+
+    # Then the queues, all prefixed with lineup:, should go over zmq
+    for queue in manager.queues:
+        queue.name.should.match(r'^lineup:')
+        backend.is_control(queue.name).should.be.false
+
+    # And the step keys, the registry, the delayed items and the
+    # dead-letter queue, which no step consumes, stay in redis
+    keys = KeyMaker(Double(manager.queues[0], manager.queues[1], manager))
+    for key in [keys.logging, keys.alive, keys.error, keys.stats,
+                backend.get_registry_key(manager.input.name),
+                manager.input.delayed, manager.dead_letter.name]:
+        backend.is_control(key).should.be.true
+
+
+@patch.object(JSONRedisBackend, 'blpop')
+def test_blpop_control(blpop):
+    ("ZMQBackend#blpop should block in redis on the control keys")
+
+    backend = make_backend()
+
+    result = backend.blpop('lineup:step:logging', timeout=2)
+
+    result.should.equal(blpop.return_value)
+    blpop.assert_called_once_with('lineup:step:logging', 2)
+
+
+@patch.object(JSONRedisBackend, 'lrange')
+@patch.object(JSONRedisBackend, 'promote')
+def test_promote_keeps_what_was_not_sent(promote, lrange):
+    ("ZMQBackend#promote should keep the due items that the channel "
+     "refused in redis")
+
+    # Given two items due, the second of which finds the channel full
+    backend = make_backend()
+    backend.redis = Mock(name='redis')
+    backend.rpush_many = Mock(name='rpush_many', side_effect=[
+        1, LineUpQueueFull('full')])
+    promote.return_value = 2
+    lrange.return_value = ['one', 'two']
+
+    # When I promote them
+    backend.promote.when.called_with(
+        'q:delayed', 'q', 1000, 10).should.throw(LineUpQueueFull)
+
+    # Then they should have gone through the staging list
+    promote.assert_called_once_with('q:delayed', 'q:due', 1000, 10)
+    lrange.assert_called_once_with('q:due', 0, -1)
+
+    # And only the one that was sent should have left it
+    backend.redis.ltrim.assert_called_once_with('q:due', 1, -1)
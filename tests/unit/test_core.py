@@ -3,8 +3,9 @@
 #
 from __future__ import unicode_literals
 from lineup import Pipeline
+from mock import Mock
 from lineup.core import (
-    Registry, LineUpPayloadDict, LineUpKeyError)
+    Registry, LineUpPayloadDict, LineUpKeyError, BlobReference)
 
 
 def test_registry_missing_name():
@@ -55,3 +56,36 @@ def test_lineuppayloaddict_error():
 def test_lineuppayloaddict_getitem():
     data = LineUpPayloadDict({'foo': "bar"})
     data['foo'].should.equal("bar")
+
+
+def test_blob_reference_resolve():
+    ("BlobReference#resolve should fetch the blob only once")
+
+    resolver = Mock(name='resolver')
+    reference = BlobReference({'__lineup__blob__': 'abc'}, resolver)
+
+    reference.resolve().should.equal(resolver.return_value)
+    reference.resolve().should.equal(resolver.return_value)
+
+    resolver.assert_called_once_with('abc')
+
+    # And it should still look like the reference
+    reference.should.equal({'__lineup__blob__': 'abc'})
+
+
+def test_payload_dict_resolves_blobs():
+    ("LineUpPayloadDict should resolve the blob references it holds "
+     "when they're read")
+
+    resolver = Mock(name='resolver', return_value='the content')
+    data = LineUpPayloadDict({
+        'url': 'http://example.com',
+        'content': BlobReference({'__lineup__blob__': 'abc'}, resolver),
+    })
+
+    data['url'].should.equal('http://example.com')
+    resolver.called.should.be.false
+
+    data['content'].should.equal('the content')
+    data.get('content').should.equal('the content')
+    data.get('missing', 'fallback').should.equal('fallback')
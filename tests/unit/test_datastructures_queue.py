@@ -2,8 +2,14 @@
 # -*- coding: utf-8 -*-
 #
 from __future__ import unicode_literals
-from mock import Mock, call
-from lineup.datastructures import Queue
+import os
+from mock import Mock, call, patch
+from lineup.core import LineUpQueueFull
+from lineup.backends.serializers import get_serializer
+from lineup.datastructures import (
+    Queue, PriorityQueue, ShardedQueue, StreamQueue, Consumer,
+    StreamConsumer, Housekeeper, Prefetcher,
+)
 
 
 def test_backend():
@@ -145,13 +151,232 @@ def test_put_waits_for_queue_to_change():
         "lineup:some-name", "SOMETHING")
 
 
+def test_put_many():
+    ("Queue#put_many pushes all the items at once")
+
+    # Given a fake backend
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    # When I create a Queue
+    queue = Queue("some-name", Backend)
+
+    # And call put_many with a generator
+    queue.put_many(x for x in ["one", "two"])
+
+    # Then it should have pushed them to redis at once
+    backend.rpush_many.assert_called_once_with(
+        "lineup:some-name", ["one", "two"])
+
+
+def test_put_many_empty():
+    ("Queue#put_many does nothing without items")
+
+    # Given a fake backend
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    # When I create a Queue
+    queue = Queue("some-name", Backend)
+
+    # And call put_many without items
+    queue.put_many([])
+
+    # Then it should not have called redis
+    backend.rpush_many.called.should.be.false
+
+
+def test_invalid_overflow():
+    ("Queue should only accept known overflow policies")
+
+    Backend = Mock(name='Backend')
+    Queue.when.called_with(
+        "some-name", Backend, overflow='explode').should.throw(ValueError)
+
+
+def test_put_bounded():
+    ("Queue#put pushes through the bounded push when it has a maxsize")
+
+    # Given a fake backend that has room
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.bounded_rpush.return_value = 1
+
+    # When I create a bounded Queue
+    queue = Queue("some-name", Backend, maxsize=10)
+
+    # And call put
+    queue.put("SOMETHING").should.equal(1)
+
+    # Then it should have pushed it with the size check
+    backend.bounded_rpush.assert_called_once_with(
+        "lineup:some-name", ["SOMETHING"], 10, 'block')
+    backend.rpush.called.should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_put_bounded_blocks(time):
+    ("Queue#put blocks until there is room in the queue")
+
+    # Given a fake backend that is full twice
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.bounded_rpush.side_effect = [-1, -1, 5]
+
+    # When I create a bounded Queue
+    queue = Queue("some-name", Backend, maxsize=5)
+
+    # And call put
+    queue.put("SOMETHING").should.equal(5)
+
+    # Then it should have backed off between attempts
+    time.sleep.assert_has_calls([call(0.001), call(0.002)])
+
+
+@patch('lineup.datastructures.time')
+def test_put_bounded_block_timeout(time):
+    ("Queue#put gives up blocking after the timeout")
+
+    # Given a fake backend that is always full
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.bounded_rpush.return_value = -1
+
+    # And a clock that moves a second at a time
+    time.time.side_effect = [0, 1, 2, 3]
+
+    # When I create a bounded Queue
+    queue = Queue("some-name", Backend, maxsize=5, timeout=2)
+
+    # Then put should raise
+    queue.put.when.called_with("SOMETHING").should.throw(
+        LineUpQueueFull, 'lineup:some-name is full (maxsize=5)')
+
+
+def test_put_bounded_reject():
+    ("Queue#put raises right away when rejecting overflow")
+
+    # Given a fake backend that is full
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.bounded_rpush.return_value = -1
+
+    # When I create a bounded Queue that rejects overflow
+    queue = Queue("some-name", Backend, maxsize=5, overflow='reject')
+
+    # Then put should raise
+    queue.put.when.called_with("SOMETHING").should.throw(LineUpQueueFull)
+    backend.bounded_rpush.call_count.should.equal(1)
+
+
+def test_put_many_bounded_too_many():
+    ("Queue#put_many refuses batches larger than maxsize when rejecting "
+     "overflow")
+
+    Backend = Mock(name='Backend')
+    queue = Queue("some-name", Backend, maxsize=1, overflow='reject')
+
+    queue.put_many.when.called_with(["one", "two"]).should.throw(
+        LineUpQueueFull, '2 items can never fit in lineup:some-name '
+        '(maxsize=1)')
+    Backend.return_value.bounded_rpush.called.should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_put_many_bounded_chunks(time):
+    ("Queue#put_many pushes batches larger than maxsize in chunks, "
+     "each waiting for room")
+
+    # Given a fake backend that is full once
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.bounded_rpush.side_effect = [2, -1, 2, 1]
+
+    # When I put many payloads into a queue of 2 items
+    queue = Queue("some-name", Backend, maxsize=2)
+    queue.put_many(["one", "two", "three", "four", "five"]).should.equal(1)
+
+    # Then they should have gone in chunks of 2 items
+    backend.bounded_rpush.call_args_list.should.equal([
+        call("lineup:some-name", ["one", "two"], 2, 'block'),
+        call("lineup:some-name", ["three", "four"], 2, 'block'),
+        call("lineup:some-name", ["three", "four"], 2, 'block'),
+        call("lineup:some-name", ["five"], 2, 'block'),
+    ])
+    time.sleep.assert_called_once_with(0.001)
+
+
+def test_put_many_bounded_drop_oldest():
+    ("Queue#put_many pushes through the bounded push when it has a maxsize")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.bounded_rpush.return_value = 1
+
+    queue = Queue("some-name", Backend, maxsize=1, overflow='drop-oldest')
+    queue.put_many(["one", "two"])
+
+    backend.bounded_rpush.assert_called_once_with(
+        "lineup:some-name", ["one", "two"], 1, 'drop-oldest')
+
+
+def test_put_back():
+    ("Queue#put_back pushes to the head of the queue")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, maxsize=1)
+    queue.put_back("SOMETHING")
+
+    backend.lpush.assert_called_once_with("lineup:some-name", "SOMETHING")
+
+
+def test_wait_for_room_unbounded():
+    ("Queue#wait_for_room returns right away for unbounded queues")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend)
+    queue.wait_for_room().should.be.true
+
+    backend.llen.called.should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_wait_for_room(time):
+    ("Queue#wait_for_room polls until the queue has room")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.llen.side_effect = [2, 2, 1]
+
+    queue = Queue("some-name", Backend, maxsize=2)
+    queue.wait_for_room().should.be.true
+
+    backend.llen.call_count.should.equal(3)
+
+
+@patch('lineup.datastructures.time')
+def test_wait_for_room_timeout(time):
+    ("Queue#wait_for_room gives up after the timeout")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.llen.return_value = 2
+    time.time.side_effect = [0, 1, 2]
+
+    queue = Queue("some-name", Backend, maxsize=2)
+    queue.wait_for_room(timeout=1).should.be.false
+
+
 def test_get_wait():
-    ("Queue#get when waiting pops an item")
+    ("Queue#get when waiting blocks in the backend")
 
     # Given a fake backend
     Backend = Mock(name='Backend')
     backend = Backend.return_value
-    backend.lpop.side_effect = [None,  "COOL"]
 
     # When I create a Queue
     queue = Queue("some-name", Backend)
@@ -159,15 +384,38 @@ def test_get_wait():
     # And call get
     result = queue.get(True)
 
-    # Then it should have popped from the redis list
-    backend.lpop.assert_has_calls([
-        call("lineup:some-name"),
-        call("lineup:some-name"),
-    ])
+    # Then it should have blocked on the redis list forever
+    backend.blpop.assert_called_once_with(
+        "lineup:some-name", timeout=-1)
 
+    # And it should not have polled it
+    backend.lpop.called.should.be.false
 
     # And the result should have come from the backend
-    result.should.equal("COOL")
+    result.should.equal(backend.blpop.return_value)
+
+
+def test_get_wait_timeout():
+    ("Queue#get when waiting honors the timeout of the queue")
+
+    # Given a fake backend
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    # And a Queue with a timeout
+    queue = Queue("some-name", Backend, timeout=5)
+
+    # When I call get without a timeout
+    queue.get(wait=True)
+
+    # And call it again with an explicit timeout
+    queue.get(wait=True, timeout=0.5)
+
+    # Then both calls should have blocked with the right timeout
+    backend.blpop.assert_has_calls([
+        call("lineup:some-name", timeout=5),
+        call("lineup:some-name", timeout=0.5),
+    ])
 
 
 def test_get_nowait():
@@ -191,6 +439,72 @@ def test_get_nowait():
     result.should.equal(backend.lpop.return_value)
 
 
+def test_get_many():
+    ("Queue#get_many pops many items at once")
+
+    # Given a fake backend
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.lpop_many.return_value = ["one", "two"]
+
+    # When I create a Queue
+    queue = Queue("some-name", Backend)
+
+    # And call get_many
+    result = queue.get_many(10, wait=True)
+
+    # Then it should have popped them from redis
+    result.should.equal(["one", "two"])
+    backend.lpop_many.assert_called_once_with("lineup:some-name", 10)
+
+    # And it should not have blocked
+    backend.blpop.called.should.be.false
+
+
+def test_get_many_wait():
+    ("Queue#get_many blocks for the first item when the queue is empty")
+
+    # Given a fake backend whose queue is empty at first
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.lpop_many.side_effect = [[], ["two", "three"]]
+    backend.blpop.return_value = "one"
+
+    # When I create a Queue
+    queue = Queue("some-name", Backend)
+
+    # And call get_many
+    result = queue.get_many(3, wait=True, timeout=2)
+
+    # Then it should have the blocking item first
+    result.should.equal(["one", "two", "three"])
+
+    # And it should have blocked with the given timeout
+    backend.blpop.assert_called_once_with("lineup:some-name", timeout=2)
+
+    # And taken the remaining items after that
+    backend.lpop_many.assert_has_calls([
+        call("lineup:some-name", 3),
+        call("lineup:some-name", 2),
+    ])
+
+
+def test_get_many_wait_timeout():
+    ("Queue#get_many returns nothing when the wait times out")
+
+    # Given a fake backend whose queue stays empty
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.lpop_many.return_value = []
+    backend.blpop.return_value = None
+
+    # When I create a Queue
+    queue = Queue("some-name", Backend)
+
+    # Then get_many should return an empty list
+    queue.get_many(3, wait=True, timeout=1).should.equal([])
+
+
 def test_get_size():
     ("Queue#get_size returns the length")
 
@@ -208,3 +522,1234 @@ def test_get_size():
     # Then it should have pushed it to redis
     backend.llen.assert_called_once_with(
         "lineup:some-name")
+
+
+def test_consumer():
+    ("Consumer should know its processing list and count acks")
+
+    # Given a queue
+    queue = Queue("some-name", Mock(name='Backend'))
+
+    # When I create a consumer
+    consumer = Consumer(queue, 'host|1|2')
+
+    # Then it should have a processing list
+    consumer.processing.should.equal('lineup:some-name:processing:host|1|2')
+
+    # And it should hand its acks over only once
+    consumer.ack()
+    consumer.ack(2)
+    consumer.take_acks().should.equal(3)
+    consumer.take_acks().should.equal(0)
+
+
+@patch('lineup.datastructures.os')
+@patch('lineup.datastructures.socket')
+def test_get_consumer(socket, os):
+    ("Queue#get_consumer should return the same consumer per thread")
+
+    socket.gethostname.return_value = 'localhost'
+    os.getpid.return_value = 123
+
+    queue = Queue("some-name", Mock(name='Backend'))
+
+    consumer = queue.get_consumer()
+    consumer.name.should.match(r'^localhost[|]123[|]\d+$')
+    queue.get_consumer().should.be(consumer)
+
+
+@patch('lineup.datastructures.time')
+def test_get_reliable(time):
+    ("Queue#get in reliable mode moves the item to a processing "
+     "list along with the pending acks")
+
+    time.time.return_value = 1000
+
+    # Given a fake backend
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.reliable_pop.return_value = ["SOMETHING"]
+
+    # And a reliable queue
+    queue = Queue("some-name", Backend, reliable=True, visibility_timeout=30)
+    consumer = queue.get_consumer()
+
+    # That acked an item before
+    queue.ack()
+
+    # When I call get
+    result = queue.get(wait=True)
+
+    # Then it should be the item moved by the backend
+    result.should.equal("SOMETHING")
+
+    # And the move should have carried the ack and a lease
+    backend.reliable_pop.assert_called_once_with(
+        "lineup:some-name", consumer.processing,
+        "lineup:some-name:leases", 1, 1, 1030)
+
+    # And it should not have needed to block
+    backend.reliable_bpop.called.should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_get_reliable_wait(time):
+    ("Queue#get in reliable mode blocks one visibility timeout "
+     "at a time")
+
+    time.time.return_value = 1000
+
+    # Given a fake backend whose queue is empty for a while
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.reliable_pop.return_value = []
+    backend.reliable_bpop.side_effect = [None, "SOMETHING"]
+
+    # And a reliable queue
+    queue = Queue("some-name", Backend, reliable=True, visibility_timeout=30)
+    consumer = queue.get_consumer()
+
+    # When I call get
+    result = queue.get(wait=True)
+
+    # Then it should be the item from the blocking move
+    result.should.equal("SOMETHING")
+
+    # And each blocking move should have renewed the lease
+    backend.reliable_bpop.assert_has_calls([
+        call("lineup:some-name", consumer.processing,
+             "lineup:some-name:leases", 30, 1060),
+        call("lineup:some-name", consumer.processing,
+             "lineup:some-name:leases", 30, 1060),
+    ])
+
+
+@patch('lineup.datastructures.time')
+def test_get_many_reliable_timeout(time):
+    ("Queue#get_many in reliable mode gives up after the timeout")
+
+    time.time.side_effect = [1000, 1000, 1000, 1000, 1002]
+
+    # Given a fake backend whose queue stays empty
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.reliable_pop.return_value = []
+    backend.reliable_bpop.return_value = None
+
+    # And a reliable queue
+    queue = Queue("some-name", Backend, reliable=True, visibility_timeout=30)
+
+    # When I call get_many with a timeout
+    result = queue.get_many(10, wait=True, timeout=2)
+
+    # Then it should return nothing
+    result.should.equal([])
+
+    # And it should have blocked only for the timeout
+    backend.reliable_bpop.call_count.should.equal(1)
+    backend.reliable_bpop.call_args[0][3].should.equal(2)
+
+
+def test_ack_unreliable():
+    ("Queue#ack and flush_acks do nothing when the queue isn't reliable")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend)
+    queue.ack()
+    queue.flush_acks()
+
+    backend.method_calls.should.equal([])
+
+
+@patch('lineup.datastructures.time')
+def test_flush_acks(time):
+    ("Queue#flush_acks sends the pending acks without taking items")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, reliable=True, visibility_timeout=30)
+    consumer = queue.get_consumer()
+
+    # Nothing to flush at first
+    queue.flush_acks()
+    backend.reliable_pop.called.should.be.false
+
+    # And then two acks
+    queue.ack()
+    queue.ack()
+    queue.flush_acks()
+
+    backend.reliable_pop.assert_called_once_with(
+        "lineup:some-name", consumer.processing,
+        "lineup:some-name:leases", 2, 0, 1030)
+
+
+@patch('lineup.datastructures.time')
+def test_hand_off(time):
+    ("Queue#hand_off sends the acks, the items, the logs and the "
+     "counters to the backend at once")
+
+    time.time.return_value = 1000
+
+    # Given a reliable queue that acked an item
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.serialize.side_effect = lambda value: 'serialized:' + value
+
+    queue = Queue("some-name", Backend, reliable=True, visibility_timeout=30)
+    consumer = queue.get_consumer()
+    queue.ack()
+
+    # When it hands an item off to another queue
+    downstream = Queue("other", Backend)
+    queue.hand_off(downstream, ['item'], 'log', ['record'], 'stats',
+                   {'consumed': 1})
+
+    # Then the backend should have got everything in one call
+    backend.hand_off.assert_called_once_with(
+        consumer.processing, "lineup:some-name:leases", 1, 1030,
+        "lineup:other", ['serialized:item'], 'log', ['record'], 'stats',
+        {'consumed': 1})
+
+    # And the ack should not be sent again
+    consumer.pending_acks.should.equal(0)
+
+
+def test_can_hand_off():
+    ("Queue#can_hand_off only when both queues are plain lists of the "
+     "same redis server")
+
+    def Backend(uri='redis://a', atomic_handoff=True, coalescer=None):
+        return lambda: Mock(uri=uri, atomic_handoff=atomic_handoff,
+                            coalescer=coalescer)
+
+    backend = Backend()()
+    queue = Queue("input", Backend(), reliable=True)
+
+    queue.can_hand_off(Queue("output", Backend()), backend).should.be.true
+    queue.can_hand_off(
+        Queue("output", Backend(), maxsize=10), backend).should.be.false
+    queue.can_hand_off(
+        Queue("output", Backend(), dedup=True), backend).should.be.false
+    queue.can_hand_off(
+        PriorityQueue("output", Backend()), backend).should.be.false
+    queue.can_hand_off(
+        Queue("output", Backend('redis://b')), backend).should.be.false
+    queue.can_hand_off(
+        Queue("output", Backend(atomic_handoff=False)), backend)\
+        .should.be.false
+
+    # With write-behind only the reliable queues hand off
+    lingering = Backend(coalescer=Mock(name='coalescer'))
+    queue.can_hand_off(Queue("output", lingering), backend).should.be.true
+    Queue("input", Backend()).can_hand_off(
+        Queue("output", lingering), backend).should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_reclaim(time):
+    ("Queue#reclaim asks the backend to reclaim expired leases")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, reliable=True)
+    queue.reclaim(limit=10).should.equal(backend.reclaim.return_value)
+
+    backend.reclaim.assert_called_once_with(
+        "lineup:some-name", "lineup:some-name:leases", 1000, 10)
+
+
+def test_housekeeping():
+    ("Queue#housekeeping promotes due items and reclaims only "
+     "when reliable")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.promote.return_value = 0
+
+    Queue("some-name", Backend).housekeeping()
+    backend.promote.called.should.be.true
+    backend.reclaim.called.should.be.false
+
+    Queue("some-name", Backend, reliable=True).housekeeping()
+    backend.reclaim.called.should.be.true
+
+
+@patch('lineup.datastructures.time')
+def test_put_delay(time):
+    ("Queue#put with a delay schedules the item for later")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, maxsize=1)
+    queue.put("later", delay=30)
+    queue.put("much later", eta=5000)
+
+    backend.schedule.assert_has_calls([
+        call("lineup:some-name:delayed", ["later"], 1030),
+        call("lineup:some-name:delayed", ["much later"], 5000),
+    ])
+    backend.rpush.called.should.be.false
+    backend.bounded_rpush.called.should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_put_many_delay(time):
+    ("Queue#put_many with a delay schedules all the items at once")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend)
+    queue.put_many(["one", "two"], delay=0)
+
+    backend.schedule.assert_called_once_with(
+        "lineup:some-name:delayed", ["one", "two"], 1000)
+    backend.rpush_many.called.should.be.false
+
+
+def test_schedule_wakes_housekeeper():
+    ("Queue#schedule should wake up the housekeeper of the queue")
+
+    Backend = Mock(name='Backend')
+    queue = Queue("some-name", Backend)
+    queue.housekeeper = Mock(name='housekeeper')
+
+    queue.put("now")
+    queue.housekeeper.wake.called.should.be.false
+
+    queue.put("later", delay=30)
+    queue.housekeeper.wake.assert_called_once_with()
+
+
+@patch('lineup.datastructures.time')
+def test_promote(time):
+    ("Queue#promote moves due items in batches until done")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.promote.side_effect = [10, 10, 3]
+
+    queue = Queue("some-name", Backend)
+    queue.promote(limit=10).should.equal(23)
+
+    backend.promote.assert_has_calls([
+        call("lineup:some-name:delayed", "lineup:some-name", 1000, 10),
+    ] * 3)
+
+
+def test_priority_queue_housekeeping():
+    ("PriorityQueue#housekeeping has nothing to promote")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    PriorityQueue("some-name", Backend).housekeeping()
+    backend.method_calls.should.equal([])
+
+
+@patch('lineup.datastructures.logger')
+def test_housekeeper_sweep(logger):
+    ("Housekeeper#sweep should run the housekeeping of every queue")
+
+    q1 = Mock(name='q1')
+    q2 = Mock(name='q2')
+    q1.housekeeping.side_effect = ValueError('boom')
+
+    keeper = Housekeeper([q1, q2])
+    keeper.sweep()
+
+    q1.housekeeping.assert_called_once_with()
+    q2.housekeeping.assert_called_once_with()
+    logger.exception.assert_called_once_with(
+        "housekeeping of %s failed", q1)
+
+
+def test_housekeeper_stop():
+    ("Housekeeper should stop looping when stopped")
+
+    queue = Mock(name='queue')
+
+    keeper = Housekeeper([queue], interval=0.01)
+    keeper.start()
+    keeper.stop()
+    keeper.join(1)
+
+    keeper.is_alive().should.be.false
+
+
+def test_housekeeper_wake():
+    ("Housekeeper#wake should start the thread once, and not once "
+     "stopped")
+
+    queue = Mock(name='queue')
+    keeper = Housekeeper([queue], interval=0.01)
+    queue.housekeeper.should.equal(keeper)
+
+    keeper.wake()
+    keeper.wake()
+    keeper.is_alive().should.be.true
+    keeper.stop()
+    keeper.join(1)
+
+    stopped = Housekeeper([Mock(name='queue')], interval=0.01)
+    stopped.stop()
+    stopped.wake()
+    stopped.ident.should.be.none
+
+
+def test_priority_queue_reliable():
+    ("PriorityQueue can't be reliable")
+
+    Backend = Mock(name='Backend')
+    PriorityQueue.when.called_with(
+        "some-name", Backend, reliable=True).should.throw(ValueError)
+
+
+def test_priority_queue_put():
+    ("PriorityQueue#put pushes to the zset with a priority")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpush.return_value = 1
+
+    queue = PriorityQueue("some-name", Backend)
+    queue.put("urgent", priority=-1).should.equal(1)
+    queue.put("whenever")
+
+    backend.zpush.assert_has_calls([
+        call("lineup:some-name", "lineup:some-name:sequence",
+             ["urgent"], -1, None, 'block'),
+        call("lineup:some-name", "lineup:some-name:sequence",
+             ["whenever"], 0, None, 'block'),
+    ])
+
+
+def test_priority_queue_put_many():
+    ("PriorityQueue#put_many pushes all the items with one priority")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpush.return_value = 2
+
+    queue = PriorityQueue("some-name", Backend, maxsize=5)
+    queue.put_many(["one", "two"], priority=3)
+    queue.put_many([])
+
+    backend.zpush.assert_called_once_with(
+        "lineup:some-name", "lineup:some-name:sequence",
+        ["one", "two"], 3, 5, 'block')
+
+
+def test_priority_queue_put_timeout():
+    ("PriorityQueue#put and put_many take the timeout second, like "
+     "Queue#put")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpush.return_value = -1
+
+    # Given a full priority queue that would block for long
+    queue = PriorityQueue("some-name", Backend, maxsize=1, timeout=60)
+
+    # Then a positional timeout gives up that soon
+    queue.put.when.called_with("late", 0.01).should.throw(LineUpQueueFull)
+    queue.put_many.when.called_with(["late"], 0.01, 3).should.throw(
+        LineUpQueueFull)
+    backend.zpush.call_args[0][3].should.equal(3)
+
+
+def test_priority_queue_put_back():
+    ("PriorityQueue#put_back pushes ahead of everything else, "
+     "whatever the bound of the queue")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpush.return_value = -1
+
+    queue = PriorityQueue("some-name", Backend, maxsize=1,
+                          overflow='reject')
+    queue.put_back("again")
+
+    backend.zpush.assert_called_once_with(
+        "lineup:some-name", "lineup:some-name:sequence",
+        ["again"], -2 ** 20, None, 'reject')
+
+
+def test_priority_queue_get():
+    ("PriorityQueue#get pops the most urgent item")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpopmin.side_effect = [["urgent"], []]
+
+    queue = PriorityQueue("some-name", Backend)
+    queue.get().should.equal("urgent")
+    queue.get().should.be.none
+
+    backend.zpopmin.assert_has_calls([
+        call("lineup:some-name", 1),
+        call("lineup:some-name", 1),
+    ])
+
+
+def test_priority_queue_get_wait():
+    ("PriorityQueue#get when waiting blocks in the backend")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = PriorityQueue("some-name", Backend, timeout=5)
+    queue.get(wait=True).should.equal(backend.bzpopmin.return_value)
+
+    backend.bzpopmin.assert_called_once_with("lineup:some-name", timeout=5)
+
+
+def test_priority_queue_get_many_wait():
+    ("PriorityQueue#get_many blocks for the first item when empty")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpopmin.side_effect = [[], ["two"]]
+    backend.bzpopmin.return_value = "one"
+
+    queue = PriorityQueue("some-name", Backend)
+    queue.get_many(2, wait=True).should.equal(["one", "two"])
+
+    backend.zpopmin.assert_has_calls([
+        call("lineup:some-name", 2),
+        call("lineup:some-name", 1),
+    ])
+
+
+def test_priority_queue_get_size():
+    ("PriorityQueue#get_size returns the size of the zset")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = PriorityQueue("some-name", Backend)
+    queue.get_size().should.equal(backend.zcard.return_value)
+    backend.zcard.assert_called_once_with("lineup:some-name")
+
+
+def make_servers():
+    servers = {}
+
+    def Backend(uri=None):
+        return servers.setdefault(uri, Mock(name='Backend({0})'.format(uri)))
+
+    return Backend, servers
+
+
+def test_sharded_queue_shards():
+    ("ShardedQueue should spread its shards over the servers")
+
+    Backend, servers = make_servers()
+
+    queue = ShardedQueue("some-name", Backend, shards=3,
+                         uris=['redis://a', 'redis://b'])
+
+    queue.shards.should.equal([
+        ('lineup:some-name:shard:0', servers['redis://a']),
+        ('lineup:some-name:shard:1', servers['redis://b']),
+        ('lineup:some-name:shard:2', servers['redis://a']),
+    ])
+
+
+def test_queue_serializer():
+    ("Queue should hand its serializer to its backends")
+
+    Backend, servers = make_servers()
+
+    queue = ShardedQueue("some-name", Backend, serializer='pickle',
+                         uris=['redis://a', 'redis://b'])
+
+    queue.serializer.should.equal(get_serializer('pickle'))
+    queue.backend.serializer.should.equal(get_serializer('pickle'))
+    servers['redis://a'].serializer.should.equal(get_serializer('pickle'))
+    servers['redis://b'].serializer.should.equal(get_serializer('pickle'))
+
+
+def test_queue_compression():
+    ("Queue should hand a compression of its own to its backends")
+
+    Backend, servers = make_servers()
+
+    queue = ShardedQueue("some-name", Backend, compression='zlib',
+                         uris=['redis://a', 'redis://b'])
+
+    queue.compression.name.should.equal('zlib')
+    servers['redis://a'].compression.should.be(queue.compression)
+    servers['redis://b'].compression.should.be(queue.compression)
+    queue.get_compression_stats().should.equal(
+        queue.compression.get_stats())
+
+    Queue("other", Backend).get_compression_stats().should.be.none
+
+
+def test_queue_flush():
+    ("Queue#flush should flush the backend of every server")
+
+    Backend, servers = make_servers()
+
+    Queue("some-name", Backend).flush()
+    servers[None].flush.assert_called_once_with()
+
+    ShardedQueue("other", Backend, uris=['redis://a', 'redis://b']).flush()
+    servers['redis://a'].flush.assert_called_once_with()
+    servers['redis://b'].flush.assert_called_once_with()
+
+
+@patch.dict(os.environ, {'LINEUP_REDIS_SHARDS': 'redis://a,redis://b'})
+def test_sharded_queue_shards_from_environment():
+    ("ShardedQueue should take its servers from LINEUP_REDIS_SHARDS")
+
+    Backend, servers = make_servers()
+
+    queue = ShardedQueue("some-name", Backend)
+
+    queue.shards.should.equal([
+        ('lineup:some-name:shard:0', servers['redis://a']),
+        ('lineup:some-name:shard:1', servers['redis://b']),
+    ])
+
+
+def test_sharded_queue_unsupported():
+    ("ShardedQueue can't be reliable nor bounded")
+
+    Backend, servers = make_servers()
+
+    ShardedQueue.when.called_with(
+        "some-name", Backend, reliable=True).should.throw(ValueError)
+    ShardedQueue.when.called_with(
+        "some-name", Backend, maxsize=10).should.throw(ValueError)
+
+
+def test_sharded_queue_put_round_robin():
+    ("ShardedQueue#put should go round-robin over the shards")
+
+    Backend, servers = make_servers()
+    queue = ShardedQueue("some-name", Backend, uris=['redis://a', 'redis://b'])
+
+    queue.put("one")
+    queue.put("two")
+    queue.put("three")
+
+    servers['redis://a'].rpush_many.assert_has_calls([
+        call('lineup:some-name:shard:0', ["one"]),
+        call('lineup:some-name:shard:0', ["three"]),
+    ])
+    servers['redis://b'].rpush_many.assert_called_once_with(
+        'lineup:some-name:shard:1', ["two"])
+
+
+def test_sharded_queue_put_many_partition():
+    ("ShardedQueue#put_many should keep payloads of the same partition "
+     "key together, one push per shard")
+
+    Backend, servers = make_servers()
+    queue = ShardedQueue("some-name", Backend, shards=4,
+                         partition=lambda payload: payload['user'])
+
+    queue.put_many([{'user': 'a'}, {'user': 'b'}, {'user': 'a'}])
+
+    pushes = servers[None].rpush_many.call_args_list
+    pushes.should.have.length_of(2)
+
+    groups = sorted(payloads for (key, payloads), kw in pushes)
+    groups.should.equal([[{'user': 'a'}, {'user': 'a'}], [{'user': 'b'}]])
+
+
+@patch('lineup.datastructures.time')
+def test_sharded_queue_put_delay(time):
+    ("ShardedQueue#put with a delay schedules in the shard")
+
+    time.time.return_value = 1000
+
+    Backend, servers = make_servers()
+    queue = ShardedQueue("some-name", Backend)
+
+    queue.put("later", delay=5)
+
+    servers[None].schedule.assert_called_once_with(
+        'lineup:some-name:shard:0:delayed', ["later"], 1005)
+
+
+def test_sharded_queue_get_rotates():
+    ("ShardedQueue#get should start from a different shard each time")
+
+    Backend, servers = make_servers()
+    backend = servers.setdefault(None, Mock(name='Backend'))
+    backend.lpop_many.side_effect = lambda key, count: [key]
+
+    queue = ShardedQueue("some-name", Backend, shards=3)
+
+    queue.get().should.equal('lineup:some-name:shard:0')
+    queue.get().should.equal('lineup:some-name:shard:1')
+    queue.get().should.equal('lineup:some-name:shard:2')
+    queue.get().should.equal('lineup:some-name:shard:0')
+
+
+def test_sharded_queue_get_nowait_empty():
+    ("ShardedQueue#get_many should try every shard before giving up")
+
+    Backend, servers = make_servers()
+    backend = servers.setdefault(None, Mock(name='Backend'))
+    backend.lpop_many.return_value = []
+
+    queue = ShardedQueue("some-name", Backend, shards=2)
+
+    queue.get_many(5).should.equal([])
+    backend.lpop_many.assert_has_calls([
+        call('lineup:some-name:shard:0', 5),
+        call('lineup:some-name:shard:1', 5),
+    ])
+    backend.blpop.called.should.be.false
+
+
+def test_sharded_queue_get_wait():
+    ("ShardedQueue#get should block on all the shards of one server "
+     "at a time, a short slice each")
+
+    Backend, servers = make_servers()
+    a = servers.setdefault('redis://a', Mock(name='a'))
+    b = servers.setdefault('redis://b', Mock(name='b'))
+    a.lpop_many.return_value = b.lpop_many.return_value = []
+    a.blpop.return_value = "SOMETHING"
+    b.blpop.return_value = None
+
+    queue = ShardedQueue("some-name", Backend, shards=4,
+                         uris=['redis://a', 'redis://b'])
+
+    queue.get(wait=True).should.equal("SOMETHING")
+
+    b.blpop.assert_called_once_with(
+        ['lineup:some-name:shard:1', 'lineup:some-name:shard:3'],
+        timeout=0.1)
+    a.blpop.assert_called_once_with(
+        ['lineup:some-name:shard:2', 'lineup:some-name:shard:0'],
+        timeout=0.1)
+
+
+@patch('lineup.datastructures.time')
+def test_sharded_queue_get_wait_remaining_timeout(time):
+    ("ShardedQueue#get should never block past its timeout")
+
+    time.time.side_effect = [1000, 1000, 1000.125, 1000.1875, 1000.25]
+    Backend, servers = make_servers()
+    a = servers.setdefault('redis://a', Mock(name='a'))
+    b = servers.setdefault('redis://b', Mock(name='b'))
+    a.lpop_many.return_value = b.lpop_many.return_value = []
+    a.blpop.return_value = b.blpop.return_value = None
+
+    queue = ShardedQueue("some-name", Backend, shards=2,
+                         uris=['redis://a', 'redis://b'])
+
+    queue.get(wait=True, timeout=0.25).should.be.none
+
+    a.blpop.call_args_list.should.equal([
+        call(['lineup:some-name:shard:0'], timeout=0.1),
+        call(['lineup:some-name:shard:0'], timeout=0.0625),
+    ])
+    b.blpop.call_args_list.should.equal([
+        call(['lineup:some-name:shard:1'], timeout=0.1),
+    ])
+
+
+def test_sharded_queue_get_wait_single_server():
+    ("ShardedQueue#get should block with the whole timeout when "
+     "there is only one server")
+
+    Backend, servers = make_servers()
+    backend = servers.setdefault(None, Mock(name='Backend'))
+    backend.lpop_many.return_value = []
+
+    queue = ShardedQueue("some-name", Backend, shards=2)
+
+    queue.get(wait=True).should.equal(backend.blpop.return_value)
+    backend.blpop.assert_called_once_with(
+        ['lineup:some-name:shard:1', 'lineup:some-name:shard:0'], timeout=-1)
+
+
+@patch('lineup.datastructures.time')
+def test_sharded_queue_promote(time):
+    ("ShardedQueue#promote should promote every shard")
+
+    time.time.return_value = 1000
+
+    Backend, servers = make_servers()
+    backend = servers.setdefault(None, Mock(name='Backend'))
+    backend.promote.return_value = 2
+
+    queue = ShardedQueue("some-name", Backend, shards=2)
+
+    queue.promote().should.equal(4)
+    backend.promote.assert_has_calls([
+        call('lineup:some-name:shard:0:delayed',
+             'lineup:some-name:shard:0', 1000, 1000),
+        call('lineup:some-name:shard:1:delayed',
+             'lineup:some-name:shard:1', 1000, 1000),
+    ])
+
+
+def test_sharded_queue_get_size():
+    ("ShardedQueue#get_size should add up the size of every shard")
+
+    Backend, servers = make_servers()
+    backend = servers.setdefault(None, Mock(name='Backend'))
+    backend.llen.side_effect = [3, 4]
+
+    queue = ShardedQueue("some-name", Backend, shards=2)
+
+    queue.get_size().should.equal(7)
+
+
+def test_prefetcher_refills_in_batches():
+    ("Prefetcher should fill its buffer up to the depth")
+
+    queue = Mock(name='queue', timeout=-1)
+    queue.get_many.side_effect = lambda count, **kw: range(count)
+
+    prefetcher = Prefetcher(queue, 4)
+    prefetcher.start()
+
+    prefetcher.get_many(10, wait=True).should.equal([0, 1, 2, 3])
+    prefetcher.stop()
+
+    queue.get_many.call_args_list[0].should.equal(
+        call(4, wait=True, timeout=1))
+
+
+def test_prefetcher_reliable():
+    ("Prefetcher should take the items into the processing list "
+     "of the consumer it was given")
+
+    queue = Mock(name='queue', timeout=-1)
+    queue.get_reliable.side_effect = [['one', 'two'], []]
+    consumer = Mock(name='consumer')
+
+    prefetcher = Prefetcher(queue, 2, consumer)
+    prefetcher.start()
+
+    prefetcher.get_many(2, wait=True).should.equal(['one', 'two'])
+    prefetcher.stop()
+
+    queue.get_reliable.call_args_list[0].should.equal(
+        call(consumer, 2, True, 1))
+
+
+def test_prefetcher_get_timeout():
+    ("Prefetcher#get_many should give up waiting after the timeout")
+
+    queue = Mock(name='queue', timeout=-1)
+    prefetcher = Prefetcher(queue, 2)
+
+    prefetcher.get_many(1, wait=True, timeout=0.01).should.equal([])
+    prefetcher.get_many(1).should.equal([])
+
+
+def test_prefetcher_stop():
+    ("Prefetcher#stop should return the buffered items")
+
+    queue = Mock(name='queue', timeout=-1)
+    prefetcher = Prefetcher(queue, 4)
+    prefetcher.buffer.extend(['one', 'two'])
+
+    prefetcher.stop().should.equal(['one', 'two'])
+    prefetcher.buffer.should.be.empty
+
+
+@patch('lineup.datastructures.Prefetcher')
+def test_queue_start_prefetch(Prefetcher):
+    ("Queue#start_prefetch should serve the gets of the current "
+     "thread from a prefetcher")
+
+    Backend = Mock(name='Backend')
+    queue = Queue("some-name", Backend)
+    prefetcher = Prefetcher.return_value
+    prefetcher.get_many.return_value = ['SOMETHING']
+
+    queue.start_prefetch(10).should.equal(prefetcher)
+
+    Prefetcher.assert_called_once_with(queue, 10, None)
+    prefetcher.start.assert_called_once_with()
+
+    queue.get(wait=True).should.equal('SOMETHING')
+    prefetcher.get_many.assert_called_once_with(1, True, None)
+    Backend.return_value.blpop.called.should.be.false
+
+
+@patch('lineup.datastructures.Prefetcher')
+def test_queue_start_prefetch_reliable(Prefetcher):
+    ("Queue#start_prefetch should prefetch on behalf of the consumer "
+     "of the current thread when reliable")
+
+    Backend = Mock(name='Backend')
+    queue = Queue("some-name", Backend, reliable=True)
+
+    queue.start_prefetch(10)
+
+    Prefetcher.assert_called_once_with(queue, 10, queue.get_consumer())
+
+
+@patch('lineup.datastructures.Prefetcher')
+def test_queue_stop_prefetch(Prefetcher):
+    ("Queue#stop_prefetch should put the buffered items back in order")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    queue = Queue("some-name", Backend)
+    Prefetcher.return_value.stop.return_value = ['one', 'two']
+
+    queue.start_prefetch(10)
+    queue.stop_prefetch()
+
+    backend.lpush.assert_has_calls([
+        call('lineup:some-name', 'two'),
+        call('lineup:some-name', 'one'),
+    ])
+    queue.get_prefetcher().should.be.none
+
+
+@patch('lineup.datastructures.time')
+@patch('lineup.datastructures.Prefetcher')
+def test_queue_stop_prefetch_reliable(Prefetcher, time):
+    ("Queue#stop_prefetch should expire the lease of the processing "
+     "list and reclaim it when reliable")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    queue = Queue("some-name", Backend, reliable=True)
+    consumer = queue.get_consumer()
+    consumer.ack(2)
+    Prefetcher.return_value.stop.return_value = ['one']
+    Prefetcher.return_value.consumer = consumer
+
+    queue.start_prefetch(10)
+    queue.stop_prefetch()
+
+    backend.reliable_pop.assert_called_once_with(
+        'lineup:some-name', consumer.processing, 'lineup:some-name:leases',
+        2, 0, 0)
+    backend.reclaim.assert_called_once_with(
+        'lineup:some-name', 'lineup:some-name:leases', 1000, 100)
+    backend.lpush.called.should.be.false
+
+
+def test_priority_queue_put_back_many():
+    ("PriorityQueue#put_back_many should put the payloads ahead of "
+     "everything else, in order")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpush.return_value = 2
+
+    queue = PriorityQueue("some-name", Backend)
+    queue.put_back_many(['one', 'two'])
+
+    backend.zpush.assert_called_once_with(
+        'lineup:some-name', 'lineup:some-name:sequence', ['one', 'two'],
+        -2 ** 20, None, 'block')
+
+
+def test_stream_consumer_acks():
+    ("StreamConsumer#take_acks should return the ids of the oldest "
+     "delivered entries that were acked")
+
+    consumer = StreamConsumer(Queue('q', Mock(name='Backend')), 'c')
+
+    consumer.deliver([('1-0', 'one'), ('2-0', 'two'), ('3-0', 'three')])\
+        .should.equal(['one', 'two', 'three'])
+    consumer.ack(2)
+
+    consumer.take_acks().should.equal(['1-0', '2-0'])
+    consumer.take_acks().should.equal([])
+    list(consumer.delivered).should.equal(['3-0'])
+
+
+def test_stream_queue_unsupported():
+    ("StreamQueue can't be bounded")
+
+    Backend = Mock(name='Backend')
+    StreamQueue.when.called_with(
+        "some-name", Backend, maxsize=10).should.throw(ValueError)
+
+
+def test_stream_queue_group():
+    ("StreamQueue should read through the group of the step that "
+     "consumes it")
+
+    Backend = Mock(name='Backend')
+    queue = StreamQueue("some-name", Backend)
+    queue.reliable.should.be.true
+    queue.group.should.equal('lineup')
+
+    step = Mock(name='step')
+    step.get_name.return_value = 'my.Step'
+    queue.adopt_consumer(step)
+
+    queue.group.should.equal('my.Step')
+
+
+def test_stream_queue_put_many():
+    ("StreamQueue#put_many should add to the stream, trimming it")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    queue = StreamQueue("some-name", Backend, maxlen=500)
+
+    queue.put_many(['one', 'two'])
+    queue.put('three')
+
+    backend.xadd_many.assert_has_calls([
+        call('lineup:some-name', ['one', 'two'], 500),
+        call('lineup:some-name', ['three'], 500),
+    ])
+
+
+@patch('lineup.datastructures.time')
+def test_stream_queue_get_many_claims(time):
+    ("StreamQueue#get_many should first claim the stuck items, "
+     "sending the pending acks along")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.xautoclaim.return_value = [('1-0', 'stuck')]
+
+    queue = StreamQueue("some-name", Backend, visibility_timeout=30)
+    consumer = queue.get_consumer()
+    consumer.deliver([('0-1', 'done')])
+    queue.ack()
+
+    queue.get_many(10).should.equal(['stuck'])
+
+    backend.xgroup_create.assert_called_once_with(
+        'lineup:some-name', 'lineup')
+    backend.xautoclaim.assert_called_once_with(
+        'lineup:some-name', 'lineup', consumer.name, ['0-1'], 30000, 10)
+    backend.xreadgroup.called.should.be.false
+    consumer.next_claim.should.equal(1030)
+
+
+@patch('lineup.datastructures.time')
+def test_stream_queue_get_many_reads(time):
+    ("StreamQueue#get_many should read new items when there is "
+     "nothing to claim")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.xreadgroup.return_value = [('1-0', 'one'), ('2-0', 'two')]
+
+    queue = StreamQueue("some-name", Backend)
+    consumer = queue.get_consumer()
+    consumer.next_claim = 2000
+    consumer.deliver([('0-1', 'done')])
+    queue.ack()
+
+    queue.get_many(10).should.equal(['one', 'two'])
+
+    backend.xautoclaim.called.should.be.false
+    backend.xreadgroup.assert_called_once_with(
+        'lineup:some-name', 'lineup', consumer.name, ['0-1'], 10)
+    list(consumer.delivered).should.equal(['1-0', '2-0'])
+
+
+def test_stream_queue_get_wait():
+    ("StreamQueue#get should block for the next item")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.xautoclaim.return_value = []
+    backend.xreadgroup.return_value = []
+    backend.bxreadgroup.return_value = [('1-0', 'one')]
+
+    queue = StreamQueue("some-name", Backend, visibility_timeout=30)
+
+    queue.get(wait=True).should.equal('one')
+
+    backend.bxreadgroup.assert_called_once_with(
+        'lineup:some-name', 'lineup', queue.get_consumer().name, 1, 30)
+
+
+def test_stream_queue_flush_acks():
+    ("StreamQueue#flush_acks should ack the consumed entries")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    queue = StreamQueue("some-name", Backend)
+    queue.get_consumer().deliver([('1-0', 'one'), ('2-0', 'two')])
+    queue.ack()
+
+    queue.flush_acks()
+
+    backend.xack.assert_called_once_with(
+        'lineup:some-name', 'lineup', ['1-0'])
+
+
+def test_stream_queue_get_size():
+    ("StreamQueue#get_size should return the length of the stream")
+
+    Backend = Mock(name='Backend')
+    queue = StreamQueue("some-name", Backend)
+
+    queue.get_size().should.equal(Backend.return_value.xlen.return_value)
+
+
+def test_queue_dedup_unsupported():
+    ("Queue can't deduplicate and be bounded at the same time")
+
+    Backend = Mock(name='Backend')
+    Queue.when.called_with(
+        "some-name", Backend, dedup='url', maxsize=10).should.throw(
+            ValueError)
+    Queue.when.called_with(
+        "some-name", Backend, dedup_filter='cuckoo').should.throw(
+            ValueError)
+    PriorityQueue.when.called_with(
+        "some-name", Backend, dedup='url').should.throw(ValueError)
+
+
+def test_queue_get_idempotency_key():
+    ("Queue#get_idempotency_key should take a field, a callable or "
+     "the whole payload")
+
+    Backend = Mock(name='Backend')
+    payload = {'url': 'http://example.com', 'n': 1}
+
+    Queue("q", Backend, dedup='url').get_idempotency_key(payload)\
+        .should.equal(b'http://example.com')
+    Queue("q", Backend, dedup=lambda p: p['n']).get_idempotency_key(
+        payload).should.equal(b'1')
+    Queue("q", Backend, dedup=True).get_idempotency_key(payload)\
+        .should.equal(b'{"n": 1, "url": "http://example.com"}')
+
+
+def test_queue_put_dedup():
+    ("Queue#put should leave a marker per idempotency key when "
+     "deduplicating")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.dedup_push.return_value = 1
+
+    queue = Queue("some-name", Backend, dedup='url', dedup_ttl=60)
+
+    queue.put_many([{'url': 'a'}, {'url': 'b'}]).should.equal(1)
+
+    backend.dedup_push.assert_called_once_with(
+        'lineup:some-name', [
+            'lineup:some-name:seen:86f7e437faa5a7fce15d1ddcb9eaeaea377667b8',
+            'lineup:some-name:seen:e9d71f5ee7c92d6dc9e92ffdad17b8bd49418f98',
+        ], [{'url': 'a'}, {'url': 'b'}], 60, None)
+    backend.rpush_many.called.should.be.false
+
+
+@patch('lineup.datastructures.time')
+def test_queue_put_dedup_delayed(time):
+    ("Queue#put with a delay should deduplicate into the delayed items")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, dedup='url')
+    queue.put({'url': 'a'}, delay=5)
+
+    backend.dedup_push.assert_called_once_with(
+        'lineup:some-name:delayed',
+        ['lineup:some-name:seen:86f7e437faa5a7fce15d1ddcb9eaeaea377667b8'],
+        [{'url': 'a'}], 3600, 1005)
+
+
+@patch('lineup.datastructures.time')
+def test_queue_put_dedup_bloom(time):
+    ("Queue#put should check the bloom filters of the current and "
+     "previous windows when deduplicating with bloom filters")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, dedup='url', dedup_ttl=60,
+                  dedup_filter='bloom')
+    queue.put({'url': 'a'})
+
+    backend.bloom_push.assert_called_once_with(
+        'lineup:some-name',
+        ['lineup:some-name:seen:16', 'lineup:some-name:seen:15'],
+        [b'a'], [{'url': 'a'}], 120, 2 ** 23, 7, None)
+
+
+@patch('lineup.datastructures.time')
+def test_queue_retry(time):
+    ("Queue#retry should schedule the payload, skipping dedup")
+
+    time.time.return_value = 1000
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+
+    queue = Queue("some-name", Backend, dedup='url')
+    queue.retry({'url': 'a'}, 2.5)
+
+    backend.schedule.assert_called_once_with(
+        'lineup:some-name:delayed', [{'url': 'a'}], 1002.5)
+    backend.dedup_push.called.should.be.false
+
+
+def test_queue_retry_without_delayed_delivery():
+    ("Queue#retry should push the payload right away when the backend "
+     "can't schedule it, whatever the bound of the queue")
+
+    # Given a full queue whose backend has no delayed delivery
+    backend = Mock(name='backend', spec=['rpush', 'bounded_rpush'])
+    backend.bounded_rpush.return_value = -1
+
+    queue = Queue("some-name", Mock(return_value=backend), maxsize=1,
+                  overflow='reject')
+
+    # When I retry a payload
+    queue.retry('one', 5)
+
+    # Then it should be pushed behind the others
+    backend.rpush.assert_called_once_with('lineup:some-name', 'one')
+    backend.bounded_rpush.called.should.be.false
+
+
+def test_priority_queue_retry():
+    ("PriorityQueue#retry should put the payload right away")
+
+    Backend = Mock(name='Backend')
+    backend = Backend.return_value
+    backend.zpush.return_value = 1
+
+    queue = PriorityQueue("some-name", Backend)
+    queue.retry('one', 5)
+
+    backend.zpush.assert_called_once_with(
+        'lineup:some-name', 'lineup:some-name:sequence', ['one'],
+        0, None, 'block')
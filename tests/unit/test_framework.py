@@ -4,6 +4,7 @@
 from __future__ import unicode_literals
 from mock import Mock, patch
 from lineup.framework import Node, Pipeline
+from lineup.datastructures import Queue
 
 
 class TestBackend(object):
@@ -123,6 +124,25 @@ def test_node_feed():
     node.input.put.assert_called_once_with({'an': 'item'})
 
 
+def test_node_feed_many():
+    ("Node#feed_many should put all the items at once")
+
+    # Given a fake backend
+    backend = Mock(name='backend')
+    Backend = lambda: backend
+
+    # And a node
+    node = Node(Backend)
+    node.input = Mock(name='node.input')
+
+    # When I feed many items
+    node.feed_many([{'an': 'item'}, {'another': 'item'}])
+
+    # Then it should have put them all in the input
+    node.input.put_many.assert_called_once_with(
+        [{'an': 'item'}, {'another': 'item'}])
+
+
 def test_node_stop():
     ("Node#stop should stop all workers")
 
@@ -180,7 +200,8 @@ def test_pipeline_initialize():
     # And a pipeline that mocks out get_queues and make_worker
     class MyPipe(Pipeline):
         name = 'mypipe1'
-        get_queues = Mock(name='MyPipe.get_queues')
+        get_queues = Mock(name='MyPipe.get_queues', return_value=[
+            Mock(name='q0'), Mock(name='q1')])
         make_worker = Mock(name='MyPipe.make_worker')
         steps = ['step1', 'step2']
 
@@ -202,6 +223,10 @@ def test_pipeline_initialize():
         {'worker': 1, 'class': 'step2'},
     ])
 
+    # And it should have a dead-letter queue
+    pipe.dead_letter.name.should.equal('lineup:mypipe1.dead-letter')
+    pipe.dead_letter.backend.should.equal(backend)
+
 
 def test_pipeline_input():
     ("Pipeline#input should return the first queue")
@@ -262,6 +287,9 @@ def test_pipeline_get_result():
     # And the call should have waited
     q2.get.assert_called_once_with(wait=True)
 
+    # And the result should have been acked
+    q2.ack.assert_called_once_with()
+
 
 @patch('lineup.framework.Queue')
 def test_pipeline_make_queue(Queue):
@@ -281,7 +309,105 @@ def test_pipeline_make_queue(Queue):
     Queue.assert_called_once_with(
         'test-pipeline.queue.42',
         backend_class=TestBackend,
-        timeout='forever')
+        maxsize=None,
+        overflow='block',
+        reliable=False,
+        visibility_timeout=300,
+        timeout='forever',
+        dedup=None,
+        dedup_ttl=3600,
+        dedup_filter='set',
+        serializer=None,
+        compression=None)
+
+
+@patch('lineup.framework.Queue')
+def test_pipeline_make_queue_dedup(Queue):
+    ("Pipeline#make_queue should deduplicate the queue of a step "
+     "that asks for it")
+
+    class Download(object):
+        dedup = 'url'
+        dedup_ttl = 60
+        dedup_filter = 'bloom'
+
+    class MyPipe(TestPipeline):
+        name = 'mypipe11'
+        steps = [Download]
+
+    pipe = MyPipe()
+    pipe.make_queue(0)
+
+    _, kwargs = Queue.call_args
+    kwargs['dedup'].should.equal('url')
+    kwargs['dedup_ttl'].should.equal(60)
+    kwargs['dedup_filter'].should.equal('bloom')
+
+
+@patch('lineup.framework.Queue')
+def test_pipeline_make_queue_serializer(Queue):
+    ("Pipeline#make_queue should use the serializer of the consumer "
+     "step, then the one of the pipeline")
+
+    class Download(object):
+        serializer = 'pickle'
+
+    class MyPipe(TestPipeline):
+        name = 'mypipe12'
+        serializer = 'msgpack'
+        steps = [Download]
+
+    pipe = MyPipe()
+
+    pipe.make_queue(0)
+    Queue.call_args[1]['serializer'].should.equal('pickle')
+
+    pipe.make_queue(1)
+    Queue.call_args[1]['serializer'].should.equal('msgpack')
+
+
+@patch('lineup.framework.Queue')
+def test_pipeline_make_queue_compression(Queue):
+    ("Pipeline#make_queue should use the compression of the consumer "
+     "step, then the one of the pipeline")
+
+    class Parse(object):
+        compression = 'bz2'
+
+    class MyPipe(TestPipeline):
+        name = 'mypipe13'
+        compression = 'zlib'
+        steps = [Parse]
+
+    pipe = MyPipe()
+
+    pipe.make_queue(0)
+    Queue.call_args[1]['compression'].should.equal('bz2')
+
+    pipe.make_queue(1)
+    Queue.call_args[1]['compression'].should.equal('zlib')
+
+
+def test_pipeline_get_compression_stats():
+    ("Pipeline#get_compression_stats should report the compressed "
+     "queues by name")
+
+    # Given a pipeline with a compressed and a plain queue
+    compressed = Mock(name='compressed', compression=Mock())
+    compressed.name = 'lineup:a'
+    plain = Mock(name='plain', compression=None)
+
+    pipe = TestPipeline()
+    pipe.queues = [compressed, plain]
+    pipe.dead_letter = plain
+
+    # When I ask for the stats
+    stats = pipe.get_compression_stats()
+
+    # Then only the compressed queue should be there
+    stats.should.equal({
+        'lineup:a': compressed.get_compression_stats.return_value,
+    })
 
 
 def test_pipeline_get_queues():
@@ -348,3 +474,118 @@ def test_pipeline_make_worker():
 
     # And its manager should be set
     result.manager.should.equal(pipe)
+
+
+@patch('lineup.framework.Housekeeper')
+def test_pipeline_housekeeper(Housekeeper):
+    ("Pipeline should have a housekeeper for its queues")
+
+    # Given a pipeline that mocks out get_queues and make_worker
+    queues = [Mock(name='q0', reliable=False),
+              Mock(name='q1', reliable=True)]
+
+    class MyPipe(Pipeline):
+        name = 'mypipe7'
+        housekeeping_interval = 5
+        get_queues = Mock(name='MyPipe.get_queues', return_value=queues)
+        make_worker = Mock(name='MyPipe.make_worker')
+        steps = ['step1']
+
+    # When I instantiate the Pipeline
+    pipe = MyPipe(TestBackend)
+
+    # Then it should have a housekeeper for its queues
+    housekeeper = Housekeeper.return_value
+    pipe.housekeeper.should.equal(housekeeper)
+    Housekeeper.assert_called_once_with(queues, 5.0)
+
+    # And wake it up along with the workers
+    pipe.run_daemon()
+    housekeeper.wake.assert_called_once_with()
+
+    # And stop it along with them
+    pipe.stop()
+    housekeeper.stop.assert_called_once_with()
+
+
+@patch('lineup.framework.Housekeeper')
+def test_pipeline_housekeeper_not_reliable(Housekeeper):
+    ("Pipeline should wake the housekeeper up even when no queue is "
+     "reliable, for the items other processes scheduled")
+
+    # Given a pipeline whose queues aren't reliable
+    class MyPipe(Pipeline):
+        name = 'mypipe8'
+        get_queues = Mock(name='MyPipe.get_queues', return_value=[
+            Mock(name='q0', reliable=False)])
+        make_worker = Mock(name='MyPipe.make_worker')
+        steps = ['step1']
+
+    # When it runs, with an interval from the environment
+    with patch.dict('os.environ', {'LINEUP_HOUSEKEEPING_INTERVAL': '2.5'}):
+        pipe = MyPipe(TestBackend)
+
+    pipe.run_daemon()
+    pipe.stop()
+
+    # Then the housekeeper is woken up along with the workers
+    Housekeeper.assert_called_once_with(MyPipe.get_queues.return_value, 2.5)
+    Housekeeper.return_value.wake.assert_called_once_with()
+
+
+def test_pipeline_stop_flushes_queues():
+    ("Pipeline#stop should flush the writes held back for its queues")
+
+    pipe = TestPipeline()
+    pipe.housekeeper = None
+    pipe.workers = []
+    pipe.queues = [Mock(name='q0'), Mock(name='q1')]
+    pipe.dead_letter = Mock(name='dead_letter')
+
+    pipe.stop()
+
+    pipe.queues[0].flush.assert_called_once_with()
+    pipe.queues[1].flush.assert_called_once_with()
+    pipe.dead_letter.flush.assert_called_once_with()
+
+
+def test_pipeline_get_queue_class():
+    ("Pipeline#get_queue_class should let each step choose its queue")
+
+    class Urgent(object):
+        consume_queue_class = 'PriorityQueue'
+
+    class MyPipe(TestPipeline):
+        name = 'mypipe9'
+        steps = ['step1', Urgent]
+
+    pipe = MyPipe()
+
+    pipe.get_queue_class(0).should.equal(Queue)
+    pipe.get_queue_class(1).should.equal('PriorityQueue')
+    pipe.get_queue_class(2).should.equal(Queue)
+
+
+def test_pipeline_get_queue_class_from_backend():
+    ("Pipeline#get_queue_class should fall back to the queue class "
+     "of the backend")
+
+    class StreamsBackend(object):
+        queue_class = 'StreamQueue'
+
+    class Urgent(object):
+        consume_queue_class = 'PriorityQueue'
+
+    class MyPipe(TestPipeline):
+        name = 'mypipe10'
+        steps = ['step1', Urgent]
+
+    pipe = MyPipe()
+    pipe.backend_class = StreamsBackend
+
+    pipe.get_queue_class(0).should.equal('StreamQueue')
+    pipe.get_queue_class(1).should.equal('PriorityQueue')
+
+    # And the queue class of the pipeline wins over the backend's
+    pipe.queue_class = 'ShardedQueue'
+    pipe.get_queue_class(0).should.equal('ShardedQueue')
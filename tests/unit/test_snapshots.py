@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+from __future__ import unicode_literals
+import base64
+import shutil
+import tempfile
+from io import BytesIO
+from mock import Mock, call, patch
+from nose import SkipTest
+from lineup.snapshots import (
+    dump_list, load_list, snapshot_queue, restore_queue, get_queue_keys,
+)
+
+
+class ListBackend(object):
+    """a backend that keeps its lists, sorted sets and strings in
+    memory"""
+
+    def __init__(self, **lists):
+        self.lists = lists
+        self.zsets = {}
+        self.strings = {}
+
+    def key_type(self, key):
+        if self.lists.get(key):
+            return 'list'
+
+        if self.zsets.get(key):
+            return 'zset'
+
+        return key in self.strings and 'string' or 'none'
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lrange_raw(self, key, start, count):
+        return self.lists.get(key, [])[start:start + count]
+
+    def lpop_many_raw(self, key, count):
+        products = self.lists.get(key, [])[:count]
+        self.lists[key] = self.lists.get(key, [])[count:]
+        return products
+
+    def rpush_raw(self, key, batches):
+        for products in batches:
+            self.lists.setdefault(key, []).extend(products)
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zrange_raw(self, key, start, count):
+        members = sorted(self.zsets.get(key, {}).items(),
+                         key=lambda item: (item[1], item[0]))
+        return members[start:start + count]
+
+    def zpop_many_raw(self, key, count):
+        members = self.zrange_raw(key, 0, count)
+        for member, score in members:
+            del self.zsets[key][member]
+
+        return members
+
+    def zadd_raw(self, key, batches):
+        for pairs in batches:
+            self.zsets.setdefault(key, {}).update(pairs)
+
+    def get_raw(self, key):
+        return self.strings.get(key)
+
+    def set_raw(self, key, value, only_missing=False):
+        if only_missing and key in self.strings:
+            return None
+
+        self.strings[key] = value
+        return True
+
+
+def snapshot_and_restore(backend, **kwargs):
+    # moves the queue q of the backend through a snapshot, returns the
+    # paths written, how many items were restored and what the
+    # backend held in between
+    queue = Mock(name='queue', shards=None, backend=backend)
+    queue.name = 'q'
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = snapshot_queue(queue, directory, drain=True,
+                               show_progress=False, **kwargs)
+        drained = (
+            dict((key, list(items)) for key, items in backend.lists.items()),
+            dict((key, dict(zset)) for key, zset in backend.zsets.items()))
+        restored = restore_queue(queue, directory, show_progress=False)
+        return [path[len(directory) + 1:] for path in paths], restored, \
+            drained
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_dump_list():
+    ("dump_list should write one item per line, in batches")
+
+    backend = Mock(wraps=ListBackend(q=[b'"a"', b'"b"', b'"c"']))
+    stream = BytesIO()
+    progress = Mock(name='progress')
+
+    dump_list(backend, 'q', stream, batch_size=2,
+              progress=progress).should.equal(3)
+
+    stream.getvalue().should.equal(b'"a"\n"b"\n"c"\n')
+    backend.lrange_raw.assert_has_calls([
+        call('q', 0, 2),
+        call('q', 2, 2),
+    ])
+    progress.assert_has_calls([call(2), call(3)])
+
+    # And the list should be left alone
+    backend.llen('q').should.equal(3)
+
+
+def test_dump_list_drain():
+    ("dump_list should remove the items it writes when draining")
+
+    backend = ListBackend(q=[b'"a"', b'"b"'])
+    stream = BytesIO()
+
+    dump_list(backend, 'q', stream, batch_size=2, drain=True)
+
+    stream.getvalue().should.equal(b'"a"\n"b"\n')
+    backend.llen('q').should.equal(0)
+
+
+def test_load_list():
+    ("load_list should push many batches per round trip")
+
+    backend = Mock(wraps=ListBackend())
+    stream = BytesIO(b'"a"\n"b"\n\n"c"\n"d"\n"e"\n')
+
+    load_list(backend, 'q', stream, batch_size=2, depth=2)\
+        .should.equal(5)
+
+    backend.rpush_raw.assert_has_calls([
+        call('q', [[b'"a"', b'"b"'], [b'"c"', b'"d"']]),
+        call('q', [[b'"e"']]),
+    ])
+
+
+def test_dump_and_load_framed_items():
+    ("dump_list should base64 encode the framed items and load_list "
+     "should decode them back")
+
+    # Given a pickled item holding a line break
+    framed = b'\x00p\x80\x02U\x01\nq\x00.'
+    backend = ListBackend(q=[framed, b'"b"'])
+    stream = BytesIO()
+
+    # When it is dumped
+    dump_list(backend, 'q', stream)
+
+    # Then it should take a single line
+    stream.getvalue().should.equal(
+        b'\x00' + base64.b64encode(framed) + b'\n"b"\n')
+
+    # And it should be loaded back as it was
+    stream.seek(0)
+    restored = ListBackend()
+    load_list(restored, 'q', stream).should.equal(2)
+    restored.lists['q'].should.equal([framed, b'"b"'])
+
+
+def test_get_queue_keys():
+    ("get_queue_keys should list the shards of a sharded queue")
+
+    queue = Mock(name='queue', shards=[('s0', 'b0'), ('s1', 'b1')])
+    get_queue_keys(queue).should.equal([('s0', 'b0'), ('s1', 'b1')])
+
+    queue = Mock(name='queue', shards=None)
+    get_queue_keys(queue).should.equal([(queue.name, queue.backend)])
+
+
+def test_snapshot_and_restore_queue():
+    ("snapshot_queue and restore_queue should move a queue through "
+     "a gzipped file")
+
+    backend = ListBackend(q=[b'"a"', b'"b"', b'"c"'])
+    queue = Mock(name='queue', shards=None, backend=backend)
+    queue.name = 'q'
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = snapshot_queue(queue, directory, batch_size=2, drain=True,
+                               show_progress=False)
+        paths.should.equal([directory + '/q.jsonl.gz'])
+        backend.llen('q').should.equal(0)
+
+        restore_queue(queue, directory, show_progress=False)\
+            .should.equal(3)
+        backend.lists['q'].should.equal([b'"a"', b'"b"', b'"c"'])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_snapshot_skips_other_types():
+    ("snapshot_queue should skip the queues that are neither lists nor "
+     "zsets")
+
+    backend = Mock(name='backend')
+    backend.key_type.return_value = 'stream'
+    queue = Mock(name='queue', shards=None, backend=backend)
+    queue.name = 'q'
+
+    snapshot_queue(queue, '/nowhere', show_progress=False)\
+        .should.equal([])
+
+
+def test_snapshot_delayed_items():
+    ("snapshot_queue should keep the delayed items of a queue with "
+     "their due time")
+
+    # Given a queue with delayed items, one of them pickled
+    pickled = b'f' * 32 + b'\x00p\x80\x02U\x01\nq\x00.'
+    backend = ListBackend(q=[b'"now"'])
+    later = b'a' * 32 + b'"later"'
+    backend.zsets['q:delayed'] = {later: 1500000000.25,
+                                  pickled: 1500000001.5}
+
+    # When it goes through a snapshot
+    paths, restored, drained = snapshot_and_restore(backend)
+
+    # Then the delayed items were saved next to the queue
+    paths.should.equal(['q.jsonl.gz', 'q:delayed.zset.gz'])
+    drained.should.equal(({'q': []}, {'q:delayed': {}}))
+
+    # And restored with their due time
+    restored.should.equal(3)
+    backend.lists['q'].should.equal([b'"now"'])
+    backend.zrange_raw('q:delayed', 0, 10).should.equal([
+        (later, 1500000000.25), (pickled, 1500000001.5)])
+
+
+def test_snapshot_reliable_queue():
+    ("snapshot_queue should keep the processing lists of a reliable "
+     "queue and their leases")
+
+    # Given a reliable queue with items taken by two consumers
+    backend = ListBackend(**{
+        'q': [b'"c"'],
+        'q:processing:one': [b'"a"'],
+        'q:processing:two': [b'"b"'],
+    })
+    backend.zsets['q:leases'] = {'q:processing:one': 1000.0,
+                                 'q:processing:two': 2000.0}
+
+    # When it goes through a snapshot
+    paths, restored, drained = snapshot_and_restore(backend)
+
+    # Then the processing lists and the leases were saved
+    paths.should.equal(['q.jsonl.gz', 'q:processing:one.jsonl.gz',
+                        'q:processing:two.jsonl.gz', 'q:leases.zset.gz'])
+    drained[1].should.equal({'q:leases': {}})
+
+    # And restored, so that the housekeeper reclaims the items once
+    # their lease expires
+    restored.should.equal(3)
+    backend.lists['q:processing:one'].should.equal([b'"a"'])
+    backend.lists['q:processing:two'].should.equal([b'"b"'])
+    backend.zsets['q:leases'].should.equal({
+        'q:processing:one': 1000.0, 'q:processing:two': 2000.0})
+
+
+def test_snapshot_priority_queue():
+    ("snapshot_queue should keep the items of a priority queue with "
+     "their priority, and its sequence")
+
+    # Given a priority queue
+    backend = ListBackend()
+    backend.zsets['q'] = {
+        '%016x"urgent"' % 2: -4294967294.0,
+        '%016x"whenever"' % 1: 4294967297.0,
+    }
+    backend.strings['q:sequence'] = b'2'
+
+    # When it goes through a snapshot
+    paths, restored, drained = snapshot_and_restore(backend)
+
+    # Then the zset and its sequence were saved
+    paths.should.equal(['q.zset.gz', 'q:sequence.string.gz'])
+    drained[1].should.equal({'q': {}})
+
+    # And restored with the same scores, leaving a sequence that moved
+    # on meanwhile alone
+    restored.should.equal(2)
+    backend.zrange_raw('q', 0, 10).should.equal([
+        ('%016x"urgent"' % 2, -4294967294.0),
+        ('%016x"whenever"' % 1, 4294967297.0),
+    ])
+    backend.strings['q:sequence'].should.equal(b'2')
+
+
+def test_snapshot_and_restore_commands():
+    ("lineup snapshot and lineup restore should go through the "
+     "dead-letter queue along with the queues of the pipeline")
+
+    try:
+        from lineup.shell import commands
+    except ImportError as e:
+        raise SkipTest('the shell requires its dependencies: {0}'.format(e))
+
+    # Given a pipeline with two queues and a dead-letter queue
+    pipeline = Mock(name='pipeline')
+    q0, q1, dead_letter = Mock(name='q0'), Mock(name='q1'), \
+        Mock(name='dead_letter')
+    pipeline.queues = [q0, q1]
+    pipeline.dead_letter = dead_letter
+    arguments = Mock(name='arguments', directory=tempfile.gettempdir())
+
+    # When I snapshot and restore it
+    with patch.object(commands, 'snapshot_queue', return_value=[]) as \
+            snapshot, patch.object(commands, 'restore_queue',
+                                   return_value=0) as restore:
+        for Command in (commands.SnapshotPipeline, commands.RestorePipeline):
+            command = object.__new__(Command)
+            command._pipeline = pipeline
+            command.when_executed(arguments, [])
+
+    # Then every queue should have been saved and restored
+    [args[0][0] for args in snapshot.call_args_list].should.equal(
+        [q0, q1, dead_letter])
+    [args[0][0] for args in restore.call_args_list].should.equal(
+        [q0, q1, dead_letter])
@@ -4,9 +4,11 @@
 from __future__ import unicode_literals
 import re
 import mock
+from collections import deque
+from threading import Condition
 from mock import Mock, patch, call
-from lineup.core import LineUpKeyError
-from lineup.steps import Step, KeyMaker
+from lineup.core import LineUpKeyError, LineUpQueueFull
+from lineup.steps import Step, ConcurrentStep, KeyMaker
 
 nopyc = lambda x:re.sub(r'py[cao]$', 'py', x)
 
@@ -19,6 +21,10 @@ class TestStep(Step):
         return self.__class__.__name__
 
 
+class TestConcurrentStep(ConcurrentStep, TestStep):
+    pass
+
+
 def test_key_maker():
     ("KeyMaker should make keys for logging, alive and error")
 
@@ -41,6 +47,10 @@ def test_key_maker():
     km.should.have.property("error").being.equal(
         'lineup:coolbabe:error')
 
+    # And it should have a key for stats
+    km.should.have.property("stats").being.equal(
+        'lineup:coolbabe:stats')
+
 
 @patch("lineup.steps.Event")
 @patch("lineup.steps.KeyMaker")
@@ -401,6 +411,7 @@ def test_step_run():
     ("Step#run should loop while active")
 
     class MyStep(TestStep):
+        consume_queue = Mock(name='consume_queue')
         is_active = Mock(name='MyStep.is_active')
         loop = Mock(name='MyStep.loop')
 
@@ -414,6 +425,30 @@ def test_step_run():
         call(),
     ])
 
+    # And it should flush the pending acks once it is done
+    MyStep.consume_queue.flush_acks.assert_called_once_with()
+    MyStep.consume_queue.start_prefetch.called.should.be.false
+
+
+def test_step_run_prefetch():
+    ("Step#run should prefetch from its queue when asked to")
+
+    class MyStep(TestStep):
+        prefetch = 10
+        consume_queue = Mock(name='consume_queue')
+        is_active = Mock(name='MyStep.is_active')
+        loop = Mock(name='MyStep.loop')
+
+    MyStep.is_active.side_effect = [True, False]
+
+    step = MyStep()
+    step.run()
+
+    MyStep.consume_queue.start_prefetch.assert_called_once_with(10)
+
+    # And it should give the unconsumed items back once it is done
+    MyStep.consume_queue.stop_prefetch.assert_called_once_with()
+
 
 def test_step_loop():
     ("Step#loop should trigger events of before/after "
@@ -426,6 +461,7 @@ def test_step_loop():
 
     class MyStep(TestStep):
         consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
         before_consume = register('before_consume')
         after_consume = register('after_consume')
         do_consume = Mock(name='MyStep.do_consume')
@@ -438,14 +474,137 @@ def test_step_loop():
     step.loop()
 
     MyStep.do_consume.assert_called_once_with('instructions')
+    MyStep.consume_queue.ack.assert_called_once_with()
 
+    # And a stop that came in meanwhile isn't cleared
     stack.should.equal([
         ('before_consume', (step,), {}),
-        ('ready.clear()', (), {}),
         ('after_consume', (step, 'instructions'), {})
     ])
 
 
+def test_step_loop_hand_off():
+    ("Step#loop should hand off what it produced and logged in a "
+     "single call when its queues can")
+
+    class MyStep(TestStep):
+        hands_off = True
+        consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
+        backend = Mock(name='backend')
+        ready = Mock(name='MyStep.ready')
+
+        def consume(self, instructions):
+            self.produce({'parsed': instructions['url']})
+
+    MyStep.backend.serialize.side_effect = lambda record: record['message']
+    MyStep.consume_queue.get.return_value = {'url': 'http://a/'}
+    # Given a step that produces an item per item
+    step = MyStep()
+    step.name = 'parse'
+    step.key = KeyMaker(step)
+
+    # When it loops
+    step.loop()
+
+    # Then nothing should have gone to redis on its own
+    MyStep.produce_queue.put.called.should.be.false
+    MyStep.backend.rpush.called.should.be.false
+
+    # But all at once, after the ack
+    MyStep.consume_queue.ack.assert_called_once_with()
+    MyStep.consume_queue.hand_off.assert_called_once_with(
+        MyStep.produce_queue, [{'parsed': 'http://a/'}],
+        'lineup:parse:logging',
+        ['parse is about to consume its queue', 'parse is done'],
+        'lineup:parse:stats', {'consumed': 1, 'produced': 1})
+
+    # And the step should be back to producing right away
+    step.handoff.should.be.none
+
+
+def test_step_can_hand_off():
+    ("Step#can_hand_off should ask its consume queue, unless turned off")
+
+    class MyStep(TestStep):
+        consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
+        backend = Mock(name='backend')
+
+    MyStep.consume_queue.can_hand_off.return_value = True
+
+    MyStep().can_hand_off().should.be.true
+    MyStep.consume_queue.can_hand_off.assert_called_once_with(
+        MyStep.produce_queue, MyStep.backend)
+
+    MyStep.atomic_handoff = False
+    MyStep().can_hand_off().should.be.false
+    TestConcurrentStep().can_hand_off().should.be.false
+
+
+def test_step_loop_timeout():
+    ("Step#loop should not consume when the queue times out")
+
+    class MyStep(TestStep):
+        consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
+        before_consume = Mock(name='MyStep.before_consume')
+        after_consume = Mock(name='MyStep.after_consume')
+        do_consume = Mock(name='MyStep.do_consume')
+
+    step = MyStep()
+    MyStep.consume_queue.get.return_value = None
+
+    step.loop()
+
+    MyStep.consume_queue.get.assert_called_once_with(wait=True)
+    MyStep.do_consume.called.should.be.false
+    MyStep.after_consume.called.should.be.false
+
+
+def test_step_loop_waits_for_room_downstream():
+    ("Step#loop should not take work while the produce queue is full")
+
+    class MyStep(TestStep):
+        consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
+        before_consume = Mock(name='MyStep.before_consume')
+        do_consume = Mock(name='MyStep.do_consume')
+
+    MyStep.produce_queue.wait_for_room.return_value = False
+    step = MyStep()
+
+    step.loop()
+
+    MyStep.produce_queue.wait_for_room.assert_called_once_with()
+    MyStep.consume_queue.get.called.should.be.false
+    MyStep.do_consume.called.should.be.false
+
+
+@patch('lineup.steps.logger')
+def test_step_loop_upon_queue_full(logger):
+    ("Step#loop should give the instructions back when "
+     "the produce queue is full")
+
+    class MyStep(TestStep):
+        consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
+        before_consume = Mock(name='MyStep.before_consume')
+        after_consume = Mock(name='MyStep.after_consume')
+        ready = Mock(name='MyStep.ready')
+        do_consume = Mock(name='MyStep.do_consume')
+        handle_exception = Mock(name='MyStep.handle_exception')
+
+    MyStep.do_consume.side_effect = LineUpQueueFull('full')
+    MyStep.consume_queue.get.return_value = 'instructions'
+    step = MyStep()
+
+    step.loop()
+
+    MyStep.consume_queue.put_back.assert_called_once_with('instructions')
+    MyStep.handle_exception.called.should.be.false
+
+
 def test_step_loop_upon_exception():
     ("Step#loop should call handle_exception if it happens")
 
@@ -460,6 +619,7 @@ def test_step_loop_upon_exception():
 
         ready = Mock(name='MyStep.ready')
         consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
         do_consume = Mock(name='MyStep.do_consume')
         handle_exception = Mock(name='MyStep.handle_exception')
 
@@ -476,9 +636,9 @@ def test_step_loop_upon_exception():
     MyStep.handle_exception.assert_called_once_with(
         exc, 'instructions')
 
+    # And a stop that came in meanwhile isn't cleared
     stack.should.equal([
         ('before_consume', (step,), {}),
-        ('ready.clear()', (), {}),
         ('after_consume', (step, 'instructions'), {})
     ])
 
@@ -499,6 +659,7 @@ def test_step_loop_upon_lineup_key_error(logger):
 
         ready = Mock(name='MyStep.ready')
         consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
         do_consume = Mock(name='MyStep.do_consume')
         handle_exception = Mock(name='MyStep.handle_exception')
 
@@ -518,3 +679,172 @@ def test_step_loop_upon_lineup_key_error(logger):
              nopyc(mock.__file__), 958),
         call(u'The send data was lost: \033[1;33m%s\033[0m', u'instructions'),
     ])
+
+
+@patch('lineup.steps.time')
+@patch('lineup.steps.traceback')
+def test_step_handle_exception_retry(traceback, time):
+    ("Step#handle_exception should retry the instructions later when "
+     "the step has a retry policy")
+
+    traceback.format_exc.return_value = 'the infamous traceback'
+    time.time.return_value = 1000
+
+    class MyStep(TestStep):
+        max_attempts = 3
+        consume_queue = Mock(name='MyStep.consume_queue')
+        get_backoff = Mock(name='MyStep.get_backoff')
+
+    MyStep.get_backoff.return_value = 1.5
+
+    step = MyStep()
+    step.name = 'my-step'
+    instructions = {'some': 'instructions'}
+    step.handle_exception(ValueError("WHAAAT"), instructions)
+
+    instructions.should.equal({
+        'some': 'instructions',
+        '__lineup__retry__': {
+            'step': 'my-step',
+            'attempts': 1,
+            'error': 'the infamous traceback',
+            'failed_at': 1000,
+        },
+    })
+    MyStep.get_backoff.assert_called_once_with(1)
+    MyStep.consume_queue.retry.assert_called_once_with(instructions, 1.5)
+
+
+def test_step_handle_failure_counts_attempts():
+    ("Step#handle_failure should only count the attempts of the "
+     "same step")
+
+    class MyStep(TestStep):
+        max_attempts = 3
+        consume_queue = Mock(name='MyStep.consume_queue')
+
+    step = MyStep()
+    step.name = 'my-step'
+
+    instructions = {'__lineup__retry__': {'step': 'my-step', 'attempts': 1}}
+    step.handle_failure(instructions)
+    instructions['__lineup__retry__']['attempts'].should.equal(2)
+
+    instructions = {'__lineup__retry__': {'step': 'other', 'attempts': 2}}
+    step.handle_failure(instructions)
+    instructions['__lineup__retry__']['attempts'].should.equal(1)
+
+
+def test_step_handle_failure_gives_up():
+    ("Step#handle_failure should send the instructions to the "
+     "dead-letter queue after the last attempt")
+
+    class MyStep(TestStep):
+        max_attempts = 3
+        consume_queue = Mock(name='MyStep.consume_queue')
+        parent = Mock(name='MyStep.parent')
+
+    step = MyStep()
+    step.name = 'my-step'
+
+    instructions = {'__lineup__retry__': {'step': 'my-step', 'attempts': 2}}
+    step.handle_failure(instructions)
+
+    MyStep.parent.dead_letter.put.assert_called_once_with(instructions)
+    MyStep.consume_queue.retry.called.should.be.false
+
+
+def test_step_give_up_without_dead_letter():
+    ("Step#give_up should roll back when the pipeline has no "
+     "dead-letter queue")
+
+    class MyStep(TestStep):
+        parent = object()
+        rollback = Mock(name='MyStep.rollback')
+
+    step = MyStep()
+    step.give_up({'some': 'instructions'})
+
+    MyStep.rollback.assert_called_once_with({'some': 'instructions'})
+
+
+@patch('lineup.steps.random')
+def test_step_get_backoff(random):
+    ("Step#get_backoff should grow exponentially, up to max_backoff, "
+     "with jitter")
+
+    class MyStep(TestStep):
+        backoff = 1
+        max_backoff = 10
+        jitter = 0.5
+
+    step = MyStep()
+
+    random.random.return_value = 0
+    step.get_backoff(1).should.equal(1)
+    step.get_backoff(3).should.equal(4)
+    step.get_backoff(10).should.equal(10)
+
+    random.random.return_value = 1
+    step.get_backoff(3).should.equal(2)
+
+
+def test_concurrent_step_loop():
+    ("ConcurrentStep#loop should hand the instructions to its pool")
+
+    class MyStep(TestConcurrentStep):
+        consume_queue = Mock(name='consume_queue')
+        produce_queue = Mock(name='produce_queue')
+        is_active = Mock(name='MyStep.is_active', return_value=True)
+
+    step = MyStep()
+    step.pool = Mock(name='pool')
+    step.in_flight = deque()
+    step.running = 0
+    step.condition = Condition()
+    MyStep.consume_queue.get.return_value = 'instructions'
+
+    step.loop()
+
+    step.running.should.equal(1)
+    step.pool.apply_async.assert_called_once_with(
+        step.handle, ('instructions', [False]))
+
+
+def test_concurrent_step_acknowledge():
+    ("ConcurrentStep#acknowledge should only ack the items taken "
+     "before the first one still running")
+
+    class MyStep(TestConcurrentStep):
+        consume_queue = Mock(name='consume_queue')
+
+    step = MyStep()
+    step.condition = Condition()
+    step.in_flight = deque([[True], [True], [False], [True]])
+
+    step.acknowledge()
+
+    MyStep.consume_queue.ack.assert_called_once_with(2)
+    list(step.in_flight).should.equal([[False], [True]])
+
+
+def test_concurrent_step_handle():
+    ("ConcurrentStep#handle should process the instructions and free "
+     "its slot")
+
+    class MyStep(TestConcurrentStep):
+        before_consume = Mock(name='MyStep.before_consume')
+        after_consume = Mock(name='MyStep.after_consume')
+        process = Mock(name='MyStep.process')
+
+    step = MyStep()
+    step.condition = Condition()
+    step.running = 1
+    entry = [False]
+
+    step.handle('instructions', entry)
+
+    MyStep.process.assert_called_once_with('instructions')
+    MyStep.after_consume.assert_called_once_with('instructions')
+    entry.should.equal([True])
+    step.running.should.equal(0)